@@ -40,6 +40,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "ocm.metrics.MetricsMiddleware",  # Server-Timing; skipped unless METRICS_ENABLED
 ]
 
 CORS_ALLOWED_ORIGINS = [
@@ -62,14 +63,60 @@ TEMPLATES = [{
     ]},
 }]
 
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "evproxy-cache",
-        "TIMEOUT": 300,  # seconds (5 min)
+# EVPROXY_CACHE picks the backend: "locmem" (per process, default), "file"
+# (shared by every worker on the host) or "redis" (shared across hosts;
+# needs the redis package and EVPROXY_CACHE_URL)
+EVPROXY_CACHE = os.getenv("EVPROXY_CACHE", "locmem")
+# Bump when the shape of cached values changes, so a shared cache doesn't
+# hand new code entries written by the old one
+EVPROXY_CACHE_VERSION = 2
+if EVPROXY_CACHE == "redis":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("EVPROXY_CACHE_URL", "redis://127.0.0.1:6379/1"),
+            "TIMEOUT": 300,
+            "VERSION": EVPROXY_CACHE_VERSION,
+        }
     }
+elif EVPROXY_CACHE == "file":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.getenv("EVPROXY_CACHE_URL", str(BASE_DIR / ".cache")),
+            "TIMEOUT": 300,
+            "VERSION": EVPROXY_CACHE_VERSION,
+            "OPTIONS": {"MAX_ENTRIES": 5000},
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "evproxy-cache",
+            "TIMEOUT": 300,  # seconds (5 min)
+            "VERSION": EVPROXY_CACHE_VERSION,
+        }
+    }
+
+# Per key family: "ttl" = seconds a value is fresh, "stale" = extra seconds it
+# may still be served while one request refreshes it in the background
+CACHE_LAYERS = {
+    "ocm_tile": {"ttl": 900, "stale": 900},
+    "routechargers": {"ttl": 600, "stale": 600},
+    "trip_corridor": {"ttl": 1800, "stale": 1800},  # plan_trip, per city pair
+    "osrm_route": {"ttl": 86400, "stale": 6 * 86400},  # roads change slowly
 }
 
+# Per-process budget (bytes) for ev_stations' cache of nearest-station lists
+EV_STATIONS_CACHE_BYTES = int(os.getenv("EV_STATIONS_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+# Route endpoints are snapped to this grid (degrees, ~110 m) before the
+# OSRM route cache lookup, so nearby requests share a route.
+ROUTE_SNAP_DEG = 0.001
+# ?zoom= simplifies route geometry so it strays at most this many screen pixels
+ROUTE_SIMPLIFY_PIXELS = 0.5
+
 WSGI_APPLICATION = "evproxy.wsgi.application"
 
 DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": BASE_DIR / "db.sqlite3"}}
@@ -79,4 +126,90 @@ STATIC_URL = "static/"
 OCM_API_KEY = os.getenv("OCM_API_KEY")
 
 # Gemini AI API key for chatbot
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
\ No newline at end of file
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+# OCM fan-out along a route: max parallel requests per view call, and a
+# deadline (seconds) for the whole fan-out
+OCM_FANOUT_WORKERS = int(os.getenv("OCM_FANOUT_WORKERS", "6"))
+OCM_FANOUT_DEADLINE = float(os.getenv("OCM_FANOUT_DEADLINE", "20"))
+
+# plan_trip's time budget (seconds) for all its upstream calls together; past
+# it the plan is built from the stations found so far and flagged "degraded"
+PLAN_TRIP_DEADLINE = float(os.getenv("PLAN_TRIP_DEADLINE", "25"))
+
+# POST /api/plan-trips/batch: most trips per request, and how many distinct
+# city pairs are planned at once (each with its own OCM fan-out)
+PLAN_TRIPS_BATCH_MAX = int(os.getenv("PLAN_TRIPS_BATCH_MAX", "100"))
+PLAN_TRIPS_BATCH_WORKERS = int(os.getenv("PLAN_TRIPS_BATCH_WORKERS", "4"))
+
+# Where station lookups come from: "upstream" (OpenChargeMap per request) or
+# "local" (the Station table filled by `manage.py load_stations`).
+# Views also accept ?source=local|upstream.
+OCM_STATION_SOURCE = os.getenv("OCM_STATION_SOURCE", "upstream")
+STATION_INDEX_REFRESH = 60  # seconds between checks for a reloaded Station table
+
+# route_chargers search strategy: "samples" (radius query per sample point)
+# or "corridor" (bounding boxes over the simplified route). ?mode= overrides.
+ROUTE_CHARGERS_MODE = os.getenv("ROUTE_CHARGERS_MODE", "samples")
+
+# Nominatim answers are kept in the GeocodeResult table (see ocm/geocode.py);
+# "not found" answers expire sooner so new places get picked up.
+GEOCODE_CACHE_TTL = 30 * 86400  # seconds
+GEOCODE_NEGATIVE_TTL = 86400
+
+# JSON codec for responses and upstream bodies (see ocm/jsoncodec.py):
+# "auto" uses orjson when it is installed, "orjson" or "json" pick one.
+JSON_CODEC = os.getenv("JSON_CODEC", "auto")
+
+# Serve the API from the async views in ocm/async_views.py (run under ASGI,
+# e.g. `uvicorn evproxy.asgi:application`); upstream waits then hold no
+# worker thread. Off: the sync views, as under WSGI.
+OCM_ASYNC_VIEWS = os.getenv("OCM_ASYNC_VIEWS", "0").lower() in ("1", "true", "yes")
+
+# Per-stage timings, upstream and cache counters (see ocm/metrics.py): a
+# Server-Timing header on every response and Prometheus text at /metrics,
+# served only to METRICS_ALLOWED_IPS. Off by default.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0").lower() in ("1", "true", "yes")
+METRICS_ALLOWED_IPS = ("127.0.0.1", "::1")
+
+# Cache warming (see ocm/prefetch.py): views count requests per corridor and
+# tile; `manage.py warm_cache`, or a thread in each worker every
+# PREFETCH_INTERVAL seconds (0: none), refreshes the PREFETCH_TOP hottest
+# entries and PREFETCH_CORRIDORS before they go stale, keeping this process
+# under PREFETCH_OCM_PER_MINUTE OCM requests.
+PREFETCH_TRACKING = os.getenv("PREFETCH_TRACKING", "1").lower() in ("1", "true", "yes")
+PREFETCH_INTERVAL = int(os.getenv("PREFETCH_INTERVAL", "0"))
+PREFETCH_TOP = int(os.getenv("PREFETCH_TOP", "50"))
+PREFETCH_AHEAD = 0.25  # refresh with less than this fraction of the TTL left
+PREFETCH_OCM_PER_MINUTE = int(os.getenv("PREFETCH_OCM_PER_MINUTE", "60"))
+PREFETCH_HALF_LIFE = 3600  # seconds; older requests count for less
+PREFETCH_CORRIDORS = [
+    ("Mumbai", "Pune"), ("Delhi", "Agra"), ("Bengaluru", "Mysuru"), ("Delhi", "Jaipur"),
+    ("Mumbai", "Nashik"), ("Chennai", "Bengaluru"), ("Ahmedabad", "Vadodara"), ("Delhi", "Chandigarh"),
+]
+
+# Identical upstream GETs in flight at the same time share one request
+UPSTREAM_COALESCE = os.getenv("UPSTREAM_COALESCE", "1").lower() in ("1", "true", "yes")
+
+# Upstream HTTP services (see ocm/upstream.py). Base URLs can be overridden,
+# e.g. to point at a local stub server; timeouts are defaults per service.
+UPSTREAMS = {
+    "ocm": {
+        "base_url": os.getenv("OCM_BASE_URL", "https://api.openchargemap.io"),
+        "timeout": 15, "retries": 2, "pool_size": 20,
+    },
+    "osrm": {
+        "base_url": os.getenv("OSRM_BASE_URL", "https://router.project-osrm.org"),
+        "timeout": 15, "retries": 2, "pool_size": 10,
+    },
+    "nominatim": {
+        "base_url": os.getenv("NOMINATIM_BASE_URL", "https://nominatim.openstreetmap.org"),
+        "timeout": 10, "retries": 1, "pool_size": 4,
+        "headers": {"User-Agent": "EV-PATH/1.0"},
+    },
+    "gemini": {
+        "base_url": os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com"),
+        # each POST is billed and generates anew: retried only when it never got sent
+        "timeout": 30, "retries": 1, "pool_size": 10, "idempotent": False,
+    },
+}
@@ -15,9 +15,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
-from ocm.views import ev_stations, route_chargers, plan_trip, chatbot
+from ocm.metrics import metrics_view
+
+if getattr(settings, "OCM_ASYNC_VIEWS", False):
+    from ocm.async_views import ev_stations, route_chargers, plan_trip, plan_trips_batch, chatbot
+else:
+    from ocm.views import ev_stations, route_chargers, plan_trip, plan_trips_batch, chatbot
 
 
 
@@ -26,5 +32,7 @@ urlpatterns = [
     path("api/ev-stations/", ev_stations),
     path("api/route-chargers/", route_chargers),
     path("api/plan-trip", plan_trip),
+    path("api/plan-trips/batch", plan_trips_batch),
     path("api/chatbot/", chatbot),
+    path("metrics", metrics_view),
 ]
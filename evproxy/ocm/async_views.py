@@ -0,0 +1,273 @@
+"""
+Async (ASGI) versions of the ocm views, served instead of ocm.views when
+OCM_ASYNC_VIEWS is on (see evproxy/urls.py).
+
+Same params, responses and cache entries as the sync views; the parsing,
+filtering and response building is shared with them. What differs is the
+waiting: OCM, OSRM, Nominatim and Gemini requests go through
+upstream.aget/apost, so a request blocked on an upstream holds no worker
+thread, and the per-sample OCM fan-out is a set of tasks instead of a
+thread pool.
+
+Database access (local station index, geocode cache) and the trip optimizer
+run via sync_to_async. Streamed responses (?stream=ndjson|sse|json, or an
+Accept header asking for one; see streaming.requested_format) are served by
+the sync views in a thread.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from . import caching
+from . import geocode
+from . import metrics
+from . import prefetch
+from . import routing
+from . import streaming
+from . import upstream
+from . import views
+from . import stations as station_store
+from .jsoncodec import JsonResponse
+from .views import _ViewError
+
+logger = logging.getLogger(__name__)
+
+
+async def _sync_view(view, request):
+    # the sync view in a thread; a streamed body is pulled from that thread chunk by chunk
+    response = await sync_to_async(view)(request)
+    if response.streaming:
+        response.streaming_content = _pulled(response.streaming_content)
+    return response
+
+async def _pulled(iterator):
+    iterator = iter(iterator)
+    pull = sync_to_async(next)
+    done = object()
+    while (chunk := await pull(iterator, done)) is not done:
+        yield chunk
+
+
+async def _aocm_query(extra, timeout, deadline=None):
+    resp = await upstream.aget("ocm", views.OCM_POI_PATH, params=views._ocm_params(extra), timeout=timeout,
+                               deadline=deadline)
+    return views._parse_ocm(resp)
+
+async def _aocm_all(param_sets, timeout, deadline=None, missed=None):
+    """
+    views._ocm_iter for async views: one OCM POI query per params dict, at
+    most OCM_FANOUT_WORKERS at a time, and the raw POIs of each in input
+    order. Queries that fail or don't finish before OCM_FANOUT_DEADLINE (or
+    the upstream.Deadline) come back empty, and their indexes go in `missed`.
+    """
+    if not param_sets:
+        return []
+    limit = asyncio.Semaphore(views.OCM_FANOUT_WORKERS)
+
+    async def one(extra):
+        async with limit:
+            return await _aocm_query(extra, timeout, deadline)
+
+    tasks = [asyncio.ensure_future(one(extra)) for extra in param_sets]
+    _, pending = await asyncio.wait(tasks, timeout=views._fanout_wait(deadline))
+    for task in pending:
+        # keep whatever finished in time, drop the stragglers
+        task.cancel()
+    results = []
+    for i, (extra, task) in enumerate(zip(param_sets, tasks)):
+        if task in pending or task.exception() is not None:
+            if task not in pending:
+                logger.warning("Error fetching stations for %s: %s", extra, task.exception())
+            if missed is not None:
+                missed.append(i)
+            results.append([])
+        else:
+            results.append(task.result())
+    return results
+
+async def _aocm_tile(level, i, j):
+    # views._ocm_tile; the children of a truncated tile are fetched together
+    async def fetch():
+        items = await _aocm_query(views._tile_query(level, i, j), timeout=15)
+        children = views._tile_children(level, i, j, items)
+        if children:
+            parts = await asyncio.gather(*(_aocm_tile(level - 1, ci, cj) for ci, cj in children))
+            return [rec for part in parts for rec in part]
+        return views._tile_records(items)
+
+    key = views._tile_key(level, i, j)
+    prefetch.track("ocm_tile", key, (level, i, j))
+    return await caching.aget_or_compute("ocm_tile", key, fetch)
+
+async def _astations_from_tiles(lat, lon, radius_km, limit):
+    level, tiles = views._tiles_around(lat, lon, radius_km)
+    tile_records = await asyncio.gather(*(_aocm_tile(level, i, j) for i, j in tiles))
+    return views._nearest_in_tiles(tile_records, lat, lon, radius_km, limit)
+
+async def _alocal_stations(request):
+    return await sync_to_async(views._use_local_stations)(request)
+
+
+async def ev_stations(request):
+    try:
+        p = views._ev_stations_params(request)
+    except _ViewError as e:
+        return JsonResponse(e.payload, status=e.status)
+
+    try:
+        with metrics.stage("stations"):
+            nearest = await _anearest(request, p)
+    except Exception as e:
+        return JsonResponse({"error": "OCM request failed", "detail": str(e)}, status=502)
+
+    with metrics.stage("filter"):
+        body = views._ev_stations_filtered(nearest, p)
+    return JsonResponse(body, safe=False)
+
+async def _anearest(request, p):
+    lat, lon, distance_km = p["lat"], p["lon"], p["distance_km"]
+    if await _alocal_stations(request):
+        index = await sync_to_async(station_store.get_index)()
+        return await views._nearby_lru.aget_or_compute(
+            views._nearby_key(p, index),
+            sync_to_async(lambda: index.nearby(lat, lon, distance_km, limit=views.EV_STATIONS_MAX_RESULTS)))
+    return await views._nearby_lru.aget_or_compute(
+        views._nearby_key(p),
+        lambda: _astations_from_tiles(lat, lon, distance_km, views.EV_STATIONS_MAX_RESULTS))
+
+
+async def _aroute_coords(src_lat, src_lon, dst_lat, dst_lon):
+    try:
+        with metrics.stage("route"):
+            route = await routing.aget_route(src_lat, src_lon, dst_lat, dst_lon)
+    except Exception as e:
+        raise _ViewError({"error": "OSRM error", "detail": str(e)}, 502)
+    return views._route_coords_or_error(route)
+
+async def _aroute_chargers_result(src_lat, src_lon, dst_lat, dst_lon, sample_km, radius_km, max_per_sample,
+                                  mode, max_per_box, local):
+    coords = await _aroute_coords(src_lat, src_lon, dst_lat, dst_lon)
+    batches, param_sets = await sync_to_async(views._route_station_lookups)(
+        coords, sample_km, radius_km, max_per_sample, mode, max_per_box, local)
+    with metrics.stage("stations"):
+        if batches is None:
+            seen = set()
+            batches = [views._new_records(items, seen) for items in await _aocm_all(param_sets, timeout=10)]
+        stations_list = [pair for found in batches
+                         for pair in views._place_route_stations(found, coords, mode, radius_km)]
+    return views._route_chargers_assembled(coords, stations_list)
+
+@require_GET
+async def route_chargers(request):
+    """views.route_chargers, async."""
+    if streaming.requested_format(request):
+        return await _sync_view(views.route_chargers, request)
+    try:
+        args = views._route_chargers_args(request) + (await _alocal_stations(request),)
+    except _ViewError as e:
+        return JsonResponse(e.payload, status=e.status)
+    cache_key = views._route_chargers_key(*args)
+    prefetch.track("routechargers", cache_key, args)
+    try:
+        geometry = views._geometry_options(request)
+        result = await caching.aget_or_compute("routechargers", cache_key, lambda: _aroute_chargers_result(*args))
+    except _ViewError as e:
+        return JsonResponse(e.payload, status=e.status)
+    return JsonResponse({"route": views._shaped(result["route"], geometry),
+                         "stations": views._route_station_dicts(result["stations"])}, safe=False)
+
+
+async def _atrip_corridor(from_city, to_city, local, deadline=None):
+    with metrics.stage("geocode"):
+        source, destination = await asyncio.gather(geocode.alookup(from_city, deadline),
+                                                   geocode.alookup(to_city, deadline))
+    views._trip_places_or_error(source, destination)
+    with metrics.stage("route"):
+        route = await routing.aget_route(source["lat"], source["lon"], destination["lat"], destination["lon"],
+                                         deadline)
+    trip = views._trip_from_route(source, destination, route)
+
+    missed = []
+    with metrics.stage("stations"):
+        if local:
+            batches = [list((await sync_to_async(station_store.fanout)(views._trip_points(trip), 15, 20)).values())]
+        else:
+            seen = set()
+            lookups = await _aocm_all(views._trip_params(trip), timeout=15, missed=missed,
+                                      deadline=deadline.reserve(views.PLAN_TRIP_RESERVE) if deadline else None)
+            batches = [views._new_records(items, seen) for items in lookups]
+        stations = [ts for found in batches for ts in views._place_trip_stations(found, trip["coordinates"])]
+    return views._trip_corridor_checked(views._trip_with_stations(trip, stations), missed,
+                                        len(views._trip_points(trip)))
+
+@require_GET
+async def plan_trip(request):
+    """views.plan_trip, async."""
+    if streaming.requested_format(request):
+        return await _sync_view(views.plan_trip, request)
+    try:
+        from_city = request.GET.get("from", "").strip()
+        to_city = request.GET.get("to", "").strip()
+
+        if not from_city or not to_city:
+            return JsonResponse({"error": "from and to parameters required"}, status=400)
+
+        vehicle_range = float(request.GET.get("vehicle_range", views.EV_RANGE_KM))
+        current_battery = float(request.GET.get("current_battery", 80))
+
+        local = await _alocal_stations(request)
+        geometry = views._geometry_options(request)
+
+        cache_key = views._trip_corridor_key(from_city, to_city, local)
+        prefetch.track("trip_corridor", cache_key, (from_city, to_city, local))
+        deadline = upstream.Deadline(views.PLAN_TRIP_DEADLINE)
+        degraded = None
+        try:
+            corridor = await caching.aget_or_compute("trip_corridor", cache_key, lambda: _atrip_corridor(
+                from_city, to_city, local, deadline), wait=deadline.remaining(), refresh=lambda: _atrip_corridor(
+                from_city, to_city, local, deadline.renewed()))
+        except views._Degraded as e:
+            corridor, degraded = e.value, e.reasons
+        with metrics.stage("plan"):
+            result = await sync_to_async(views._plan_trip_result, thread_sensitive=False)(
+                corridor, vehicle_range, current_battery)
+            result = views._shaped_trip(result, geometry)
+        if degraded:
+            views._mark_degraded(result, degraded)
+        return JsonResponse(result, safe=False)
+
+    except _ViewError as e:
+        return JsonResponse(e.payload, status=e.status)
+    except upstream.DeadlineExceeded as e:
+        return JsonResponse(views._trip_timed_out(e), status=504)
+    except Exception as e:
+        return JsonResponse({"error": "Trip planning failed", "detail": str(e)}, status=500)
+
+
+@csrf_exempt
+@require_POST
+async def plan_trips_batch(request):
+    """views.plan_trips_batch, run in a thread: it streams, and fans out in a thread pool of its own."""
+    return await _sync_view(views.plan_trips_batch, request)
+
+
+@csrf_exempt
+async def chatbot(request):
+    """views.chatbot, async."""
+    if request.method != 'POST':
+        return JsonResponse({"error": "Only POST method allowed"}, status=405)
+    try:
+        data = json.loads(request.body)
+        user_message, conversation_history, gemini_api_key, payload = views._chatbot_request(data)
+        response = await upstream.apost("gemini", views.GEMINI_PATH, **views._chatbot_post(gemini_api_key, payload))
+        return views._chatbot_reply(response, user_message, conversation_history)
+    except _ViewError as e:
+        return JsonResponse(e.payload, status=e.status)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON in request body"}, status=400)
+    except Exception as e:
+        return JsonResponse({"error": "Chatbot error", "detail": str(e)}, status=500)
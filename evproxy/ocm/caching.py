@@ -0,0 +1,277 @@
+"""
+Layered caching on top of Django's cache (see CACHES / CACHE_LAYERS in settings).
+
+Every key family ("layer") has its own TTL plus a stale window. Inside the
+TTL a value is served as-is; inside the stale window it is still served, but
+one caller refreshes it in a background thread. A miss is computed by a
+single caller at a time: the others wait for its result instead of all
+hitting OCM/OSRM at once. The lock is a `cache.add` key holding a token of
+its owner, who deletes it only while it still holds that token. With redis
+`add` is atomic, so this holds across workers too; the file backend's `add`
+is not, so two workers can now and then both compute the same key (wasted
+work, never a wrong value), and locmem only locks within one process.
+
+A background refresh runs `refresh()` when given, else `compute()`. Pass it
+when compute is bound to the request's upstream.Deadline: the refresh
+outlives the request and needs a budget of its own (Deadline.renewed).
+
+aget_or_compute is the same for async views: compute is a
+coroutine function and waiting doesn't block the event loop.
+
+LRU is a per-process cache of live objects on top of that, for values that
+are cheap to rebuild from the layers but costly to unpickle on every hit.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LAYER = {"ttl": 300, "stale": 0}
+LOCK_TIMEOUT = 60  # seconds; upper bound on how long one computation may hold a key
+WAIT_STEP = 0.05
+
+
+def layer_config(layer):
+    return {**DEFAULT_LAYER, **getattr(settings, "CACHE_LAYERS", {}).get(layer, {})}
+
+def _store(key, value, cfg):
+    envelope = {"v": value, "fresh_until": time.time() + cfg["ttl"]}
+    cache.set(key, envelope, timeout=cfg["ttl"] + cfg["stale"])
+
+def _lock(key):
+    """A token when this caller now holds the lock on `key`, else None."""
+    token = uuid.uuid4().hex
+    return token if cache.add(f"lock:{key}", token, timeout=LOCK_TIMEOUT) else None
+
+def _unlock(key, token):
+    # only our own lock: once LOCK_TIMEOUT has passed it may belong to another caller
+    # (get-then-delete isn't atomic, but that only leaves a tiny window)
+    lock_key = f"lock:{key}"
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+def _refresh(key, compute, cfg, token):
+    try:
+        value = compute()
+        if value is not None:
+            _store(key, value, cfg)
+    except Exception as e:
+        logger.warning("Background refresh of %s failed: %s", key, e)
+    finally:
+        _unlock(key, token)
+        connections.close_all()  # this thread's DB connections, if compute opened any
+
+
+def get_or_compute(layer, key, compute, wait=None, refresh=None):
+    """
+    Cached value of `key`, computing it with `compute()` when missing.
+    A None result is returned but not cached; exceptions from compute()
+    propagate to the caller that ran it. `wait` caps how long (seconds) to
+    wait for another caller's computation before running compute() anyway.
+    A stale value is refreshed in the background with `refresh()` (default
+    compute()).
+    """
+    cfg = layer_config(layer)
+
+    envelope = cache.get(key)
+    if envelope is not None:
+        stale = time.time() >= envelope["fresh_until"]
+        metrics.cache_lookup(layer, "stale" if stale else "hit")
+        token = _lock(key) if stale else None
+        if token:
+            # stale: serve it now, refresh behind the caller's back
+            threading.Thread(target=_refresh, args=(key, refresh or compute, cfg, token), daemon=True).start()
+        return envelope["v"]
+    metrics.cache_lookup(layer, "miss")
+
+    # miss: one caller computes, the rest wait for it
+    deadline = time.monotonic() + (LOCK_TIMEOUT if wait is None else wait)
+    while not (token := _lock(key)):
+        time.sleep(WAIT_STEP)
+        envelope = cache.get(key)
+        if envelope is not None:
+            return envelope["v"]
+        if time.monotonic() > deadline:
+            return compute()  # holder looks stuck; don't wait forever
+    try:
+        value = compute()
+        if value is not None:
+            _store(key, value, cfg)
+        return value
+    finally:
+        _unlock(key, token)
+
+
+def peek(layer, key):
+    """Cached value of `key` if there is one (fresh or stale), else None. Never computes."""
+    envelope = cache.get(key)
+    metrics.cache_lookup(layer, "miss" if envelope is None else "hit")
+    return envelope["v"] if envelope is not None else None
+
+def put(layer, key, value):
+    """Store a value computed outside get_or_compute (e.g. assembled while streaming)."""
+    if value is not None:
+        _store(key, value, layer_config(layer))
+
+def fresh_for(key):
+    """Seconds `key` stays fresh (negative once stale), or None when it isn't cached."""
+    envelope = cache.get(key)
+    return envelope["fresh_until"] - time.time() if envelope is not None else None
+
+def refresh(layer, key, compute):
+    """
+    Recompute `key` now, whatever its state (see prefetch.py). Returns False
+    without computing when another caller holds its lock.
+    """
+    token = _lock(key)
+    if not token:
+        return False
+    try:
+        value = compute()
+        if value is not None:
+            _store(key, value, layer_config(layer))
+        return True
+    finally:
+        _unlock(key, token)
+
+
+
+_background = set()  # running refresh tasks; the loop only keeps weak references
+
+async def _astore(key, value, cfg):
+    envelope = {"v": value, "fresh_until": time.time() + cfg["ttl"]}
+    await cache.aset(key, envelope, timeout=cfg["ttl"] + cfg["stale"])
+
+async def _alock(key):
+    token = uuid.uuid4().hex
+    return token if await cache.aadd(f"lock:{key}", token, timeout=LOCK_TIMEOUT) else None
+
+async def _aunlock(key, token):
+    lock_key = f"lock:{key}"
+    if await cache.aget(lock_key) == token:
+        await cache.adelete(lock_key)
+
+async def _arefresh(key, compute, cfg, token):
+    try:
+        value = await compute()
+        if value is not None:
+            await _astore(key, value, cfg)
+    except Exception as e:
+        logger.warning("Background refresh of %s failed: %s", key, e)
+    finally:
+        await _aunlock(key, token)
+
+async def aget_or_compute(layer, key, compute, wait=None, refresh=None):
+    """get_or_compute for async views; `compute` and `refresh` are coroutine functions."""
+    cfg = layer_config(layer)
+
+    envelope = await cache.aget(key)
+    if envelope is not None:
+        stale = time.time() >= envelope["fresh_until"]
+        metrics.cache_lookup(layer, "stale" if stale else "hit")
+        token = await _alock(key) if stale else None
+        if token:
+            task = asyncio.get_running_loop().create_task(_arefresh(key, refresh or compute, cfg, token))
+            _background.add(task)
+            task.add_done_callback(_background.discard)
+        return envelope["v"]
+    metrics.cache_lookup(layer, "miss")
+
+    deadline = time.monotonic() + (LOCK_TIMEOUT if wait is None else wait)
+    while not (token := await _alock(key)):
+        await asyncio.sleep(WAIT_STEP)
+        envelope = await cache.aget(key)
+        if envelope is not None:
+            return envelope["v"]
+        if time.monotonic() > deadline:
+            return await compute()
+    try:
+        value = await compute()
+        if value is not None:
+            await _astore(key, value, cfg)
+        return value
+    finally:
+        await _aunlock(key, token)
+
+class LRU:
+    """
+    Least-recently-used cache of live objects (nothing is pickled), bounded by
+    an approximate byte budget: sizeof(value) estimates each entry. Entries
+    also expire after `ttl` seconds when one is given; `name` labels its
+    hits and misses in the metrics. Thread-safe.
+    """
+
+    def __init__(self, max_bytes, sizeof, ttl=None, name="lru"):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.nbytes = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] is not None and time.monotonic() >= entry[2]:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = self.sizeof(value)
+        if nbytes > self.max_bytes:
+            return  # would evict everything else and still not fit
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, nbytes, expires_at)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def get_or_compute(self, key, compute):
+        """Like the module-level get_or_compute, without locking: concurrent misses each compute."""
+        value = self.get(key)
+        metrics.cache_lookup(self.name, "miss" if value is None else "hit")
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    async def aget_or_compute(self, key, compute):
+        """get_or_compute for async views; `compute` is a coroutine function."""
+        value = self.get(key)
+        metrics.cache_lookup(self.name, "miss" if value is None else "hit")
+        if value is None:
+            value = await compute()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self.nbytes -= nbytes
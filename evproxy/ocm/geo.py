@@ -0,0 +1,316 @@
+"""
+Geometry helpers for routes and stations.
+
+Points are (lat, lon); route coordinates are [lon, lat] as OSRM returns them.
+The batched functions use NumPy when it is installed and fall back to plain
+Python loops otherwise.
+"""
+import bisect
+import math
+
+try:
+    import numpy as np
+except ImportError:  # optional: the pure-Python paths below cover everything
+    np = None
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180.0
+
+# points x segments per NumPy block in project_to_route (bounds temp memory)
+_BLOCK = 1 << 21
+# grid cell (degrees) for bucketing route segments when NumPy isn't available
+_CELL = 0.05
+
+
+def haversine_km(a, b):
+    # a, b: (lat, lon)
+    R = EARTH_RADIUS_KM
+    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    h = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    return 2 * R * math.asin(math.sqrt(h))
+
+def _haversine_np(lat1, lon1, lat2, lon2):
+    # element-wise (broadcasting) haversine on degree arrays
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def cumulative_km(pts):
+    """Distance along (lat, lon) points: cum[i] is km from pts[0] to pts[i]."""
+    if not pts:
+        return []
+    if np is not None and len(pts) > 1:
+        arr = np.asarray(pts, dtype=float)
+        steps = _haversine_np(arr[:-1, 0], arr[:-1, 1], arr[1:, 0], arr[1:, 1])
+        return [0.0] + np.cumsum(steps).tolist()
+    cum = [0.0]
+    for i in range(1, len(pts)):
+        cum.append(cum[-1] + haversine_km(pts[i-1], pts[i]))
+    return cum
+
+def polyline_length_km(coords):
+    # coords: list of [lon, lat] (OSRM returns lon,lat)
+    if not coords:
+        return 0.0
+    return cumulative_km([(c[1], c[0]) for c in coords])[-1]
+
+
+def sample_along_route(coords_lonlat, sample_km=20):
+    """
+    Points roughly every sample_km along the route, plus the final point.
+    coords_lonlat: list of [lon, lat]
+    Returns (samples, km_along): (lat, lon) points and each one's distance
+    from the start along the route. Samples closer than 0.5 km are merged.
+    """
+    if not coords_lonlat:
+        return [], []
+    pts = [(c[1], c[0]) for c in coords_lonlat]  # to (lat, lon)
+    cum = cumulative_km(pts)
+    total = cum[-1]
+    if total == 0:
+        return [pts[0]], [0.0]
+
+    # positions only move forward, so one pointer walk over cum covers every sample
+    samples, kms = [], []
+    i = 1
+    pos = 0.0
+    while pos <= total:
+        while cum[i] < pos:
+            i += 1
+        seg_len = cum[i] - cum[i-1]
+        frac = 0 if seg_len == 0 else (pos - cum[i-1]) / seg_len
+        lat1, lon1 = pts[i-1]
+        lat2, lon2 = pts[i]
+        samples.append((lat1 + (lat2 - lat1) * frac, lon1 + (lon2 - lon1) * frac))
+        kms.append(pos)
+        pos += sample_km
+    # always include final point
+    samples.append(pts[-1])
+    kms.append(total)
+
+    # dedupe near duplicates
+    out, out_km = [], []
+    for p, km in zip(samples, kms):
+        if not out or haversine_km(out[-1], p) > 0.5:  # 0.5 km tolerance
+            out.append(p)
+            out_km.append(km)
+    return out, out_km
+
+
+def point_at_km(samples, km_along, km):
+    """Interpolate the (lat, lon) at `km` along the route from sample_along_route output."""
+    if not samples:
+        return None
+    i = bisect.bisect_left(km_along, km)
+    if i <= 0:
+        return samples[0]
+    if i >= len(samples):
+        return samples[-1]
+    span = km_along[i] - km_along[i-1]
+    frac = 0 if span == 0 else (km - km_along[i-1]) / span
+    (lat1, lon1), (lat2, lon2) = samples[i-1], samples[i]
+    return (lat1 + (lat2 - lat1) * frac, lon1 + (lon2 - lon1) * frac)
+
+
+def simplify(coords_lonlat, tolerance_km):
+    """
+    Douglas-Peucker simplification of a [lon, lat] polyline; keeps endpoints
+    and every vertex needed to stay within tolerance_km of the original.
+    """
+    n = len(coords_lonlat)
+    if n <= 2 or tolerance_km <= 0:
+        return list(coords_lonlat)
+    lat0 = sum(c[1] for c in coords_lonlat) / n
+    kx = math.cos(math.radians(lat0)) * KM_PER_DEG
+    xs = [c[0] * kx for c in coords_lonlat]
+    ys = [c[1] * KM_PER_DEG for c in coords_lonlat]
+    if np is not None:
+        xa, ya = np.asarray(xs), np.asarray(ys)
+    tol2 = tolerance_km * tolerance_km
+
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        ax, ay, dx, dy = xs[i], ys[i], xs[j] - xs[i], ys[j] - ys[i]
+        seg2 = dx * dx + dy * dy
+        if np is not None:
+            px, py = xa[i+1:j] - ax, ya[i+1:j] - ay
+            if seg2 == 0:
+                d2 = px * px + py * py
+            else:
+                t = np.clip((px * dx + py * dy) / seg2, 0.0, 1.0)
+                ex, ey = px - t * dx, py - t * dy
+                d2 = ex * ex + ey * ey
+            k = int(d2.argmax())
+            worst, idx = float(d2[k]), i + 1 + k
+        else:
+            worst, idx = -1.0, i
+            for k in range(i + 1, j):
+                px, py = xs[k] - ax, ys[k] - ay
+                t = 0.0 if seg2 == 0 else max(0.0, min(1.0, (px * dx + py * dy) / seg2))
+                ex, ey = px - t * dx, py - t * dy
+                d2 = ex * ex + ey * ey
+                if d2 > worst:
+                    worst, idx = d2, k
+        if worst > tol2:
+            keep[idx] = True
+            stack.append((i, idx))
+            stack.append((idx, j))
+    return [c for c, k in zip(coords_lonlat, keep) if k]
+
+
+def zoom_tolerance_km(zoom, lat, pixels=1.0):
+    """Ground size of `pixels` screen pixels at a web-map zoom level (256 px tiles) and latitude."""
+    return pixels * 2 * math.pi * EARTH_RADIUS_KM * math.cos(math.radians(lat)) / (256 * 2 ** zoom)
+
+
+def corridor_boxes(coords_lonlat, radius_km, max_box_km=100.0, max_waste=3.0):
+    """
+    Cover the corridor within radius_km of a (simplified) [lon, lat] polyline
+    with bounding boxes. Consecutive vertices share a box until it gets longer
+    than max_box_km or its area exceeds max_waste times the corridor strip it
+    actually covers. Returns (south, west, north, east) tuples.
+    """
+    if not coords_lonlat:
+        return []
+    boxes = []
+
+    def emit(s, w, n, e):
+        dlat = radius_km / KM_PER_DEG
+        dlon = radius_km / (KM_PER_DEG * max(math.cos(math.radians(max(abs(s), abs(n)))), 0.01))
+        boxes.append((s - dlat, w - dlon, n + dlat, e + dlon))
+
+    lon, lat = coords_lonlat[0]
+    s = n = lat
+    w = e = lon
+    length = 0.0
+    prev = (lat, lon)
+    for lon, lat in coords_lonlat[1:]:
+        step = haversine_km(prev, (lat, lon))
+        ns, nn, nw, ne = min(s, lat), max(n, lat), min(w, lon), max(e, lon)
+        kx = math.cos(math.radians((ns + nn) / 2)) * KM_PER_DEG
+        h = (nn - ns) * KM_PER_DEG + 2 * radius_km
+        wd = (ne - nw) * kx + 2 * radius_km
+        strip = (length + step + 2 * radius_km) * 2 * radius_km
+        if length > 0 and (length + step > max_box_km or h * wd > max_waste * strip):
+            # close the box at the previous vertex and start a new one from it
+            emit(s, w, n, e)
+            s = n = prev[0]
+            w = e = prev[1]
+            length = 0.0
+            ns, nn, nw, ne = min(s, lat), max(n, lat), min(w, lon), max(e, lon)
+        s, n, w, e = ns, nn, nw, ne
+        length += step
+        prev = (lat, lon)
+    emit(s, w, n, e)
+    return boxes
+
+
+def distance_to_route_km(points, coords_lonlat):
+    """
+    Shortest distance in km from each (lat, lon) point to the route polyline
+    (segments, not just vertices). Each point is measured in a local
+    equirectangular frame centred on it, which is well within 1% at the
+    tens-of-km scale a charger detour lives at.
+    """
+    return [d for d, _ in project_to_route(points, coords_lonlat)]
+
+def project_to_route(points, coords_lonlat):
+    """
+    (distance_km, km_along) for each (lat, lon) point: how far it is from the
+    route, and how far along the route its closest point lies.
+    Both are None when there is no route.
+    """
+    if not points:
+        return []
+    if not coords_lonlat:
+        return [(None, None)] * len(points)
+    if len(coords_lonlat) == 1:
+        only = (coords_lonlat[0][1], coords_lonlat[0][0])
+        return [(haversine_km(p, only), 0.0) for p in points]
+    route = [(c[1], c[0]) for c in coords_lonlat]
+    cum = cumulative_km(route)
+    if np is not None:
+        return _project_np(points, coords_lonlat, cum)
+
+    # no NumPy: bucket segments into a grid and only measure the ones near each point
+    grid = {}
+    for i in range(len(route) - 1):
+        (la1, lo1), (la2, lo2) = route[i], route[i + 1]
+        for ci in range(math.floor(min(la1, la2) / _CELL), math.floor(max(la1, la2) / _CELL) + 1):
+            for cj in range(math.floor(min(lo1, lo2) / _CELL), math.floor(max(lo1, lo2) / _CELL) + 1):
+                grid.setdefault((ci, cj), []).append(i)
+    ci_lo, ci_hi = min(k[0] for k in grid), max(k[0] for k in grid)
+    cj_lo, cj_hi = min(k[1] for k in grid), max(k[1] for k in grid)
+
+    out = []
+    for plat, plon in points:
+        kx = math.cos(math.radians(plat)) * KM_PER_DEG
+        ring_km = _CELL * min(kx, KM_PER_DEG)  # lower bound on distance per ring of cells
+        pi, pj = math.floor(plat / _CELL), math.floor(plon / _CELL)
+        max_ring = max(abs(pi - ci_lo), abs(pi - ci_hi), abs(pj - cj_lo), abs(pj - cj_hi))
+        best, best_i, best_t = float("inf"), 0, 0.0
+        seen = set()
+        for r in range(max_ring + 1):
+            for ci in range(pi - r, pi + r + 1):
+                step = 1 if abs(ci - pi) == r else 2 * r  # only the ring's border cells
+                for cj in range(pj - r, pj + r + 1, max(step, 1)):
+                    for i in grid.get((ci, cj), ()):
+                        if i in seen:
+                            continue
+                        seen.add(i)
+                        d2, t = _seg_proj(route[i], route[i + 1], plat, plon, kx)
+                        if d2 < best:
+                            best, best_i, best_t = d2, i, t
+            # anything in further rings is at least r * ring_km away
+            if best <= (r * ring_km) ** 2:
+                break
+        out.append((math.sqrt(best), cum[best_i] + best_t * (cum[best_i + 1] - cum[best_i])))
+    return out
+
+def _seg_proj(a, b, plat, plon, kx):
+    # (squared km, fraction along a-b) of the closest point on segment a-b to
+    # (plat, plon), in a frame centred on the point
+    ax, ay = (a[1] - plon) * kx, (a[0] - plat) * KM_PER_DEG
+    bx, by = (b[1] - plon) * kx, (b[0] - plat) * KM_PER_DEG
+    dx, dy = bx - ax, by - ay
+    seg2 = dx * dx + dy * dy
+    t = 0.0 if seg2 == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / seg2))
+    cx, cy = ax + t * dx, ay + t * dy
+    return cx * cx + cy * cy, t
+
+def _project_np(points, coords_lonlat, cum):
+    route = np.asarray(coords_lonlat, dtype=float)
+    cum = np.asarray(cum)
+    a_lon, a_lat = route[:-1, 0], route[:-1, 1]
+    b_lon, b_lat = route[1:, 0], route[1:, 1]
+    pts = np.asarray(points, dtype=float)
+    dist = np.empty(len(pts))
+    along = np.empty(len(pts))
+    rows = max(1, _BLOCK // len(a_lon))
+    for start in range(0, len(pts), rows):
+        blk = pts[start:start + rows]
+        plat, plon = blk[:, 0:1], blk[:, 1:2]
+        kx = np.cos(np.radians(plat)) * KM_PER_DEG
+        ax, ay = (a_lon - plon) * kx, (a_lat - plat) * KM_PER_DEG
+        bx, by = (b_lon - plon) * kx, (b_lat - plat) * KM_PER_DEG
+        dx, dy = bx - ax, by - ay
+        seg2 = dx * dx + dy * dy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(seg2 > 0, -(ax * dx + ay * dy) / seg2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        cx, cy = ax + t * dx, ay + t * dy
+        d2 = cx * cx + cy * cy
+        seg = d2.argmin(axis=1)
+        row = np.arange(len(blk))
+        dist[start:start + rows] = np.sqrt(d2[row, seg])
+        along[start:start + rows] = cum[seg] + t[row, seg] * (cum[seg + 1] - cum[seg])
+    return list(zip(dist.tolist(), along.tolist()))
@@ -0,0 +1,225 @@
+"""
+City geocoding for plan_trip.
+
+Lookups go, cheapest first, through:
+  1. the bundled gazetteer (ocm/data/gazetteer_in.csv), loaded once at import
+     into exact/alias, prefix and trigram indexes;
+  2. the GeocodeResult table, a persistent cache of Nominatim answers,
+     including "not found" answers (negative caching);
+  3. Nominatim itself, whose answer is then written to that table.
+
+    place = geocode.lookup("Bangalore")   # {"name", "lat", "lon"} or None
+"""
+import bisect
+import csv
+import logging
+import os
+import re
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from . import jsoncodec
+from . import upstream
+from .models import GeocodeResult
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(__file__), "data", "gazetteer_in.csv")
+CACHE_TTL = getattr(settings, "GEOCODE_CACHE_TTL", 30 * 86400)          # seconds, found places
+NEGATIVE_TTL = getattr(settings, "GEOCODE_NEGATIVE_TTL", 86400)         # seconds, "no such place"
+MIN_PREFIX = 4        # shorter queries are too ambiguous to complete
+STRICT_SIMILARITY = 0.7  # fuzzy match good enough to skip Nominatim
+LOOSE_SIMILARITY = 0.5   # last resort when Nominatim has nothing either
+
+_PUNCT = re.compile(r"[^a-z0-9 ]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text):
+    text = _PUNCT.sub(" ", text.lower().replace("-", " "))
+    text = _SPACES.sub(" ", text).strip()
+    if text.endswith(" india"):
+        text = text[:-len(" india")]
+    return text
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _place(row):
+    name = row["name"] if row["state"] == row["name"] else f"{row['name']}, {row['state']}"
+    return {"name": f"{name}, India", "lat": float(row["lat"]), "lon": float(row["lon"])}
+
+
+class Gazetteer:
+    """In-memory place index: exact names/aliases, sorted keys for prefixes, trigram postings."""
+
+    def __init__(self, rows=()):
+        self.places = []
+        self.tiers = []
+        self.exact = {}       # normalized name or alias -> place index
+        self.postings = {}    # trigram -> [(key, place index)]
+        for row in rows:
+            idx = len(self.places)
+            self.places.append(_place(row))
+            self.tiers.append(int(row.get("tier") or 3))
+            names = [row["name"]] + [a for a in (row.get("aliases") or "").split("|") if a]
+            for key in map(normalize, names):
+                if key and key not in self.exact:
+                    self.exact[key] = idx
+        for key, idx in self.exact.items():
+            for g in trigrams(key):
+                self.postings.setdefault(g, []).append((key, idx))
+        self.keys = sorted(self.exact)
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls(csv.DictReader(f))
+
+    def _best(self, indexes):
+        # most important place first (tier), then the file's own order
+        return self.places[min(indexes, key=lambda i: (self.tiers[i], i))]
+
+    def get(self, key):
+        idx = self.exact.get(key)
+        return self.places[idx] if idx is not None else None
+
+    def contained(self, key):
+        """A known place named inside the query ("andheri mumbai"), longest word run first."""
+        words = key.split()
+        for n in range(len(words), 0, -1):
+            for i in range(len(words) - n + 1):
+                idx = self.exact.get(" ".join(words[i:i + n]))
+                if idx is not None:
+                    return self.places[idx]
+        return None
+
+    def prefix(self, key):
+        if len(key) < MIN_PREFIX:
+            return None
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_left(self.keys, key + "\x7f")
+        if lo == hi:
+            return None
+        return self._best({self.exact[k] for k in self.keys[lo:hi]})
+
+    def fuzzy(self, key, threshold):
+        """Closest name by trigram (Dice) similarity, or None below threshold."""
+        grams = trigrams(key)
+        shared = Counter()
+        for g in grams:
+            for candidate in self.postings.get(g, ()):
+                shared[candidate] += 1
+        best, best_score = None, threshold
+        for (cand, idx), n in shared.items():
+            score = 2.0 * n / (len(grams) + len(trigrams(cand)))
+            if score > best_score or (score == best_score and best is not None
+                                      and self.tiers[idx] < self.tiers[best]):
+                best, best_score = idx, score
+        return self.places[best] if best is not None else None
+
+    def match(self, key):
+        """Everything short of the loose fuzzy pass."""
+        return (self.get(key)
+                or self.contained(key)   # also "pune, maharashtra"
+                or self.prefix(key)
+                or self.fuzzy(key, STRICT_SIMILARITY))
+
+
+GAZETTEER = Gazetteer.from_csv(GAZETTEER_PATH)
+
+
+def _cached(key):
+    """(hit, place) from the GeocodeResult table; expired or unreadable rows are a miss."""
+    try:
+        row = GeocodeResult.objects.filter(query=key).first()
+    except DatabaseError as e:
+        logger.warning("Geocode cache unavailable: %s", e)
+        return False, None
+    if row is None:
+        return False, None
+    ttl = CACHE_TTL if row.found else NEGATIVE_TTL
+    if timezone.now() - row.fetched_at > timedelta(seconds=ttl):
+        return False, None
+    if not row.found:
+        return True, None
+    return True, {"name": row.name, "lat": row.lat, "lon": row.lon}
+
+def _remember(key, place):
+    fields = {"found": False, "name": None, "lat": None, "lon": None}
+    if place:
+        fields = {"found": True, **place}
+    try:
+        GeocodeResult.objects.update_or_create(query=key, defaults=fields)
+    except DatabaseError as e:
+        logger.warning("Could not cache geocode for %r: %s", key, e)
+
+def nominatim(city, deadline=None):
+    """
+    Ask Nominatim, going through the persistent cache. Network errors return
+    None without caching anything; an empty answer is cached as a negative.
+    upstream.DeadlineExceeded propagates: the place may well exist.
+    """
+    key = normalize(city)[:200]
+    hit, place = _cached(key)
+    if hit:
+        return place
+    try:
+        resp = upstream.get("nominatim", "/search", params=_nominatim_params(city), deadline=deadline)
+        place = _parse_nominatim(resp, city)
+    except upstream.DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning("Nominatim lookup for %r failed: %s", city, e)
+        return None
+    _remember(key, place)
+    return place
+
+async def anominatim(city, deadline=None):
+    """nominatim() for async views."""
+    key = normalize(city)[:200]
+    hit, place = await sync_to_async(_cached)(key)
+    if hit:
+        return place
+    try:
+        resp = await upstream.aget("nominatim", "/search", params=_nominatim_params(city), deadline=deadline)
+        place = _parse_nominatim(resp, city)
+    except upstream.DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.warning("Nominatim lookup for %r failed: %s", city, e)
+        return None
+    await sync_to_async(_remember)(key, place)
+    return place
+
+def _nominatim_params(city):
+    return {"format": "json", "limit": 1, "q": city + " India"}
+
+def _parse_nominatim(resp, city):
+    resp.raise_for_status()
+    data = jsoncodec.loads(resp.content)
+    if not data:
+        return None
+    return {"name": data[0].get("display_name", city),
+            "lat": float(data[0]["lat"]), "lon": float(data[0]["lon"])}
+
+
+def lookup(city, deadline=None):
+    """{"name", "lat", "lon"} for a city/town name, or None."""
+    key = normalize(city)
+    if not key:
+        return None
+    return GAZETTEER.match(key) or nominatim(city, deadline) or GAZETTEER.fuzzy(key, LOOSE_SIMILARITY)
+
+async def alookup(city, deadline=None):
+    """lookup() for async views."""
+    key = normalize(city)
+    if not key:
+        return None
+    return GAZETTEER.match(key) or await anominatim(city, deadline) or GAZETTEER.fuzzy(key, LOOSE_SIMILARITY)
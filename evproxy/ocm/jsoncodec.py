@@ -0,0 +1,93 @@
+"""
+JSON encoding and decoding for responses and upstream bodies.
+
+Route geometry and station lists make for large documents, and with the
+stdlib encoder serializing them (and parsing OCM/OSRM bodies) shows up at
+the top of profiles. orjson does the same work several times faster, so
+it's used when installed; JSON_CODEC ("auto", "orjson" or "json") picks
+explicitly.
+
+    data = jsoncodec.loads(resp.content)
+    return jsoncodec.JsonResponse(result, safe=False)  # drop-in for django's
+
+Both codecs take what DjangoJSONEncoder takes (Decimal, datetime, lazy
+strings, ...). orjson writes compact JSON (no spaces after separators) and
+NaN as null; the stdlib codec writes exactly what JsonResponse used to.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib codec covers everything
+    orjson = None
+
+_encoder = DjangoJSONEncoder()
+
+
+def _json_dumps(value):
+    return json.dumps(value, cls=DjangoJSONEncoder).encode()
+
+def _json_loads(data):
+    return json.loads(data)
+
+CODECS = {"json": (_json_dumps, _json_loads)}
+
+if orjson is not None:
+    # datetimes go through DjangoJSONEncoder so both codecs format them alike
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def _orjson_dumps(value):
+        try:
+            return orjson.dumps(value, default=_encoder.default, option=_OPTIONS)
+        except TypeError:
+            # ints beyond 64 bits, unusual dict keys: let the stdlib have a go
+            return _json_dumps(value)
+
+    CODECS["orjson"] = (_orjson_dumps, orjson.loads)
+
+
+def _configured():
+    name = getattr(settings, "JSON_CODEC", "auto")
+    if name == "auto":
+        return "orjson" if "orjson" in CODECS else "json"
+    if name not in CODECS:
+        logger.warning("JSON_CODEC %r is not available, using the stdlib json codec", name)
+        return "json"
+    return name
+
+NAME = _configured()
+_dumps, _loads = CODECS[NAME]
+
+
+def dumps(value):
+    """Encode `value` to JSON bytes."""
+    return _dumps(value)
+
+def loads(data):
+    """Decode JSON from bytes or str. Errors are ValueError (json.JSONDecodeError)."""
+    return _loads(data)
+
+def separators():
+    """(item, key) separators the codec writes, for code that assembles JSON piecewise."""
+    return (b",", b":") if NAME == "orjson" else (b", ", b": ")
+
+
+class JsonResponse(HttpResponse):
+    """django.http.JsonResponse, encoded with the configured codec."""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError("In order to allow non-dict objects to be serialized set the safe parameter to False.")
+        kwargs.setdefault("content_type", "application/json")
+        with metrics.stage("serialize"):
+            content = dumps(data)
+        super().__init__(content=content, **kwargs)
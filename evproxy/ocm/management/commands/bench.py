@@ -0,0 +1,245 @@
+import json
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+
+from ocm import geo
+from ocm import replay
+from ocm import routing
+from ocm import upstream
+from ocm import views
+
+# name -> (url, params); the three distances are what plan_trip and
+# route_chargers see in practice: across town, a day's drive, a long haul
+_MUMBAI, _THANE = (19.0760, 72.8777), (19.2183, 72.9781)
+_PUNE, _HYDERABAD, _DELHI = (18.5204, 73.8567), (17.3850, 78.4867), (28.7041, 77.1025)
+
+def _route(src, dst):
+    return {"src_lat": src[0], "src_lon": src[1], "dst_lat": dst[0], "dst_lon": dst[1]}
+
+SCENARIOS = {
+    "stations_city": ("/api/ev-stations/", {"lat": _MUMBAI[0], "lon": _MUMBAI[1], "distance": 15}),
+    "chargers_city": ("/api/route-chargers/", _route(_MUMBAI, _THANE)),
+    "chargers_500km": ("/api/route-chargers/", _route(_PUNE, _HYDERABAD)),
+    "chargers_1500km": ("/api/route-chargers/", _route(_DELHI, _HYDERABAD)),
+    "trip_city": ("/api/plan-trip", {"from": "Mumbai", "to": "Thane"}),
+    "trip_500km": ("/api/plan-trip", {"from": "Pune", "to": "Hyderabad"}),
+    "trip_1500km": ("/api/plan-trip", {"from": "Delhi", "to": "Hyderabad"}),
+}
+
+_BENCH_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "evproxy-bench"}}
+
+# the numbers --baseline compares; lower is better for all of them
+_COMPARED = ("cold_p50_ms", "warm_p50_ms", "peak_mb")
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+def _fetch(client, url, params):
+    resp = client.get(url, params)
+    body = b"".join(resp.streaming_content) if resp.streaming else resp.content
+    if resp.status_code != 200:
+        raise CommandError(f"{url} {params}: HTTP {resp.status_code} {body[:200]!r}")
+    return body
+
+def _clear_caches():
+    cache.clear()
+    views._nearby_lru.clear()
+
+def _best_us(fn, repeat, number=1):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - t) / number)
+    return best * 1e6
+
+
+class Command(BaseCommand):
+    help = ("Benchmark ev_stations, route_chargers and plan_trip against a synthetic stub of OCM/OSRM/Nominatim "
+            "(or replayed --fixtures recorded with --record), plus the geo route helpers")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), default=[],
+                            help="run only these; repeatable (default: all)")
+        parser.add_argument("--fixtures", help="directory of recorded upstream responses to replay")
+        parser.add_argument("--strict", action="store_true",
+                            help="fail requests with no recording instead of answering them synthetically")
+        parser.add_argument("--record", metavar="DIR",
+                            help="run each scenario once against the real upstreams and save their responses to "
+                                 "DIR, instead of benchmarking")
+        parser.add_argument("--latency", type=float, default=20, help="ms the stub waits before answering")
+        parser.add_argument("--iterations", type=int, default=20, help="requests per latency measurement")
+        parser.add_argument("--concurrency", type=int, default=8, help="client threads for the throughput run")
+        parser.add_argument("--no-micro", action="store_true", help="skip the geo microbenchmarks")
+        parser.add_argument("--json", metavar="PATH", help="also write the results here")
+        parser.add_argument("--baseline", metavar="PATH",
+                            help="results of an earlier --json run; fail when something got slower or bigger")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="allowed slowdown against --baseline, as a fraction (default 0.25)")
+
+    def handle(self, *args, **opts):
+        names = opts["scenario"] or list(SCENARIOS)
+        if opts["record"]:
+            return self._record(names, opts["record"])
+        if opts["iterations"] < 1 or opts["concurrency"] < 1:
+            raise CommandError("--iterations and --concurrency must be at least 1")
+
+        results = {"scenarios": {}, "micro": {}}
+        with replay.StubServer(opts["fixtures"], latency=opts["latency"] / 1000, strict=opts["strict"]) as stub:
+            with override_settings(UPSTREAMS=stub.upstreams(settings.UPSTREAMS), CACHES=_BENCH_CACHES):
+                upstream.reset()
+                try:
+                    self.stdout.write(f"stub upstreams at {stub.base_url}, {opts['latency']:g} ms latency, "
+                                      f"{len(replay.FixtureStore(opts['fixtures']))} recorded responses")
+                    self.stdout.write(f"{'scenario':<16} {'cold p50':>9} {'cold p99':>9} {'warm p50':>9} "
+                                      f"{'warm p99':>9} {'req/s':>8} {'peak MB':>8} {'KB':>7}   (ms unless noted)")
+                    for name in names:
+                        results["scenarios"][name] = row = self._scenario(name, opts)
+                        self.stdout.write(
+                            f"{name:<16} {row['cold_p50_ms']:>9.1f} {row['cold_p99_ms']:>9.1f} "
+                            f"{row['warm_p50_ms']:>9.1f} {row['warm_p99_ms']:>9.1f} {row['throughput_rps']:>8.1f} "
+                            f"{row['peak_mb']:>8.1f} {row['response_kb']:>7.1f}")
+                finally:
+                    upstream.reset()
+            self.stdout.write(f"upstream requests: {stub.count('replayed')} replayed, "
+                              f"{stub.count('synthesized')} synthetic, {stub.count('missing')} missing")
+        if not opts["no_micro"]:
+            results["micro"] = self._micro()
+
+        if opts["json"]:
+            Path(opts["json"]).write_text(json.dumps(results, indent=2))
+            self.stdout.write(f"wrote {opts['json']}")
+        if opts["baseline"]:
+            self._compare(results, json.loads(Path(opts["baseline"]).read_text()), opts["tolerance"])
+
+    def _scenario(self, name, opts):
+        url, params = SCENARIOS[name]
+        client = Client()
+        n = opts["iterations"]
+
+        cold = []
+        for _ in range(n):
+            _clear_caches()
+            t = time.perf_counter()
+            _fetch(client, url, params)
+            cold.append((time.perf_counter() - t) * 1000)
+
+        # peak Python heap of one cold request (tracemalloc slows it down, so it isn't timed)
+        _clear_caches()
+        tracemalloc.start()
+        try:
+            body = _fetch(client, url, params)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        warm = []
+        for _ in range(n):
+            t = time.perf_counter()
+            _fetch(client, url, params)
+            warm.append((time.perf_counter() - t) * 1000)
+
+        return {
+            "cold_p50_ms": statistics.median(cold), "cold_p99_ms": _percentile(cold, 99),
+            "warm_p50_ms": statistics.median(warm), "warm_p99_ms": _percentile(warm, 99),
+            "throughput_rps": self._throughput(url, params, opts["concurrency"], n),
+            "peak_mb": peak / 2**20, "response_kb": len(body) / 1024,
+        }
+
+    def _throughput(self, url, params, concurrency, per_thread):
+        # warm caches, `concurrency` clients at once: what the process serves per second at steady state
+        errors = []
+
+        def run():
+            client = Client()
+            try:
+                for _ in range(per_thread):
+                    _fetch(client, url, params)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(concurrency)]
+        t = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - t
+        if errors:
+            raise CommandError(f"throughput run failed: {errors[0]}")
+        return concurrency * per_thread / elapsed
+
+    def _micro(self):
+        # a 1500 km route with a point every ~100 m, like OSRM's full overview, and
+        # stations scattered within ~25 km of it the way route_chargers sees them
+        src, dst = routing.snap(*_DELHI), routing.snap(*_HYDERABAD)
+        path = f"{routing.OSRM_ROUTE_PATH}/{src[1]},{src[0]};{dst[1]},{dst[0]}"
+        coords = routing.decode_polyline(replay.synthetic_osrm(path, {"geometries": "polyline6"})["routes"][0]["geometry"])
+        rng = random.Random(0)
+        stations = [(c[1] + rng.uniform(-0.2, 0.2), c[0] + rng.uniform(-0.2, 0.2)) for c in coords[::10]]
+        # each helper has a NumPy path and a pure-Python fallback; time both
+        cases = {
+            "polyline_length_km": (lambda: geo.polyline_length_km(coords), 5),
+            "sample_along_route": (lambda: geo.sample_along_route(coords, 20), 5),
+            "simplify": (lambda: geo.simplify(coords, 0.05), 5),
+            "project_to_route": (lambda: geo.project_to_route(stations, coords), 1),
+        }
+        self.stdout.write(f"geo microbenchmarks, {len(coords)}-point route, {len(stations)} stations "
+                          f"(us per call, best of 5)")
+        numpy = geo.np
+        results = {}
+        for name, (fn, number) in cases.items():
+            line = f"  {name:<20}"
+            if numpy is not None:
+                results[f"{name}_us"] = _best_us(fn, 5, number)
+                line += f" {results[f'{name}_us']:>12.1f} numpy"
+            geo.np = None
+            try:
+                results[f"{name}_pure_us"] = _best_us(fn, 5, number)
+            finally:
+                geo.np = numpy
+            line += f" {results[f'{name}_pure_us']:>12.1f} pure Python"
+            self.stdout.write(line)
+        return results
+
+    def _compare(self, results, baseline, tolerance):
+        worse = []
+        for name, row in results["scenarios"].items():
+            before = baseline.get("scenarios", {}).get(name, {})
+            for field in _COMPARED:
+                if field in before and row[field] > before[field] * (1 + tolerance):
+                    worse.append(f"{name} {field}: {before[field]:.1f} -> {row[field]:.1f}")
+        for field, value in results["micro"].items():
+            before = baseline.get("micro", {}).get(field)
+            if before is not None and value > before * (1 + tolerance):
+                worse.append(f"{field}: {before:.1f} -> {value:.1f}")
+        if worse:
+            raise CommandError(f"slower than the baseline by more than {tolerance:.0%}:\n  " + "\n  ".join(worse))
+        self.stdout.write(f"within {tolerance:.0%} of the baseline")
+
+    def _record(self, names, directory):
+        client = Client()
+        with override_settings(CACHES=_BENCH_CACHES), replay.recording(directory) as store:
+            for name in names:
+                url, params = SCENARIOS[name]
+                _clear_caches()
+                try:
+                    _fetch(client, url, params)
+                except CommandError as e:
+                    self.stderr.write(f"{name}: {e}")
+                    continue
+                self.stdout.write(f"recorded {name}")
+        self.stdout.write(f"{len(store)} responses in {directory}")
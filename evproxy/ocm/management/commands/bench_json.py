@@ -0,0 +1,105 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from ocm import jsoncodec
+from ocm import replay
+from ocm import upstream
+
+# what runs without --file: a city trip, a ~500 km and a ~1500 km plan
+_STUB_TRIPS = (("Mumbai", "Thane"), ("Pune", "Hyderabad"), ("Delhi", "Hyderabad"))
+
+_STUB_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "evproxy-bench-json"}}
+
+
+def _best_ms(fn, arg, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - t)
+    return best * 1000
+
+
+def _plan_trip(from_city, to_city):
+    from ocm.views import plan_trip
+    return plan_trip(RequestFactory().get("/api/plan-trip", {"from": from_city, "to": to_city}))
+
+
+class Command(BaseCommand):
+    help = ("Compare the JSON codecs (stdlib json vs orjson) on plan_trip responses: recorded --file bodies, "
+            "else plans made offline against the synthetic upstream stub")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", action="append", default=[],
+                            help="recorded /api/plan-trip response body; repeatable")
+        parser.add_argument("--record", action="append", default=[], metavar="FROM,TO",
+                            help="run plan_trip for a city pair against the real upstreams and save the body to "
+                                 "--dir first; repeatable")
+        parser.add_argument("--dir", default=".", help="where --record writes plan_trip_<from>_<to>.json")
+        parser.add_argument("--repeat", type=int, default=30, help="runs per measurement (best is reported)")
+
+    def handle(self, *args, **opts):
+        paths = [Path(f) for f in opts["file"]]
+        for pair in opts["record"]:
+            path = self._record(pair, Path(opts["dir"]))
+            if path:
+                paths.append(path)
+        payloads = [(path.name, path.read_bytes()) for path in paths]
+        if not opts["file"] and not opts["record"]:
+            payloads = self._stub_payloads()
+
+        codecs = sorted(jsoncodec.CODECS)
+        if "orjson" not in codecs:
+            self.stdout.write("orjson is not installed: only the stdlib codec is measured")
+        self.stdout.write(f"{'payload':<32} {'KB':>8}  " + "  ".join(
+            f"{name + ' dec':>11} {name + ' enc':>11}" for name in codecs) + "   (ms, best of "
+            f"{opts['repeat']})")
+        for name, raw in payloads:
+            data = jsoncodec.CODECS["json"][1](raw)
+            cols = []
+            timings = {}
+            for codec in codecs:
+                dumps, loads = jsoncodec.CODECS[codec]
+                timings[codec] = (_best_ms(loads, raw, opts["repeat"]), _best_ms(dumps, data, opts["repeat"]))
+                cols.append(f"{timings[codec][0]:>11.2f} {timings[codec][1]:>11.2f}")
+            line = f"{name[:32]:<32} {len(raw) / 1024:>8.1f}  " + "  ".join(cols)
+            if "orjson" in timings:
+                (jd, je), (od, oe) = timings["json"], timings["orjson"]
+                line += f"   orjson x{jd / od:.1f} decode, x{je / oe:.1f} encode"
+            self.stdout.write(line)
+
+    def _stub_payloads(self):
+        payloads = []
+        with replay.StubServer() as stub:
+            with override_settings(UPSTREAMS=stub.upstreams(settings.UPSTREAMS), CACHES=_STUB_CACHES):
+                upstream.reset()
+                try:
+                    for from_city, to_city in _STUB_TRIPS:
+                        resp = _plan_trip(from_city, to_city)
+                        if resp.status_code != 200:
+                            raise CommandError(f"{from_city} -> {to_city}: plan_trip returned {resp.status_code}")
+                        payloads.append((f"stub {from_city} -> {to_city}", resp.content))
+                finally:
+                    upstream.reset()
+        self.stdout.write(f"no --file given: {len(payloads)} plan_trip responses built from synthetic upstream data")
+        return payloads
+
+    def _record(self, pair, out_dir):
+        try:
+            from_city, to_city = (c.strip() for c in pair.split(","))
+        except ValueError:
+            raise CommandError(f"--record wants FROM,TO, got {pair!r}")
+        resp = _plan_trip(from_city, to_city)
+        if resp.status_code != 200:
+            self.stderr.write(f"{from_city} -> {to_city}: plan_trip returned {resp.status_code}, skipped")
+            return None
+        out_dir.mkdir(parents=True, exist_ok=True)
+        path = out_dir / f"plan_trip_{from_city}_{to_city}.json".replace(" ", "_").lower()
+        path.write_bytes(resp.content)
+        self.stdout.write(f"recorded {path} ({len(resp.content) / 1024:.1f} KB)")
+        return path
@@ -0,0 +1,99 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ocm import jsoncodec
+from ocm import stations as station_store
+from ocm import upstream
+INDIA_BBOX = (6.0, 68.0, 37.0, 98.0)  # south, west, north, east
+
+
+def _read_dump(path):
+    """Yield POIs from an OCM export: a JSON array, NDJSON, or a directory of per-POI .json files."""
+    path = Path(path)
+    if path.is_dir():
+        for f in sorted(path.rglob("*.json")):
+            yield from _read_dump(f)
+        return
+    text = path.read_text(encoding="utf-8")
+    stripped = text.lstrip()
+    if stripped.startswith("["):
+        yield from jsoncodec.loads(text)
+    elif stripped.startswith("{") and "\n{" not in stripped:
+        yield jsoncodec.loads(text)
+    else:
+        for line in text.splitlines():
+            if line.strip():
+                yield jsoncodec.loads(line)
+
+
+class Command(BaseCommand):
+    help = "Bulk-load OpenChargeMap stations into the local station store"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", action="append", default=[],
+                            help="OCM dump to load (JSON array, NDJSON or directory); repeatable")
+        parser.add_argument("--pull", action="store_true",
+                            help="page POIs from the OCM API by bounding box")
+        parser.add_argument("--bbox", default=",".join(str(v) for v in INDIA_BBOX),
+                            help="south,west,north,east for --pull (default: India)")
+        parser.add_argument("--tile-deg", type=float, default=2.0, help="initial tile size for --pull")
+        parser.add_argument("--page-size", type=int, default=2000, help="maxresults per OCM request")
+
+    def handle(self, *args, **opts):
+        if not opts["file"] and not opts["pull"]:
+            raise CommandError("give --file and/or --pull")
+
+        total = 0
+        for f in opts["file"]:
+            n = station_store.ingest(_read_dump(f))
+            self.stdout.write(f"{f}: {n} stations")
+            total += n
+
+        if opts["pull"]:
+            try:
+                south, west, north, east = (float(v) for v in opts["bbox"].split(","))
+            except ValueError:
+                raise CommandError("--bbox must be south,west,north,east")
+            n = station_store.ingest(self._pull(south, west, north, east, opts["tile_deg"], opts["page_size"]))
+            self.stdout.write(f"OCM pull: {n} stations")
+            total += n
+
+        self.stdout.write(self.style.SUCCESS(f"Loaded {total} stations"))
+
+    def _pull(self, south, west, north, east, tile_deg, page_size):
+        # walk the bbox in tiles; a tile that comes back full is split in four and re-queried
+        tiles = []
+        lat = south
+        while lat < north:
+            lon = west
+            while lon < east:
+                tiles.append((lat, lon, min(lat + tile_deg, north), min(lon + tile_deg, east)))
+                lon += tile_deg
+            lat += tile_deg
+
+        while tiles:
+            s, w, n, e = tiles.pop()
+            params = {
+                "output": "json",
+                "boundingbox": f"({s},{w}),({n},{e})",
+                "maxresults": page_size,
+                "compact": True,
+                "verbose": False,
+                "key": settings.OCM_API_KEY,
+            }
+            try:
+                resp = upstream.get("ocm", "/v3/poi/", params=params, timeout=60)
+                resp.raise_for_status()
+                items = jsoncodec.loads(resp.content) or []
+            except Exception as ex:
+                self.stderr.write(f"tile {s},{w},{n},{e} failed: {ex}")
+                continue
+            if len(items) >= page_size and (n - s) > 0.05:
+                mid_lat, mid_lon = (s + n) / 2, (w + e) / 2
+                tiles += [(s, w, mid_lat, mid_lon), (s, mid_lon, mid_lat, e),
+                          (mid_lat, w, n, mid_lon), (mid_lat, mid_lon, n, e)]
+                continue
+            self.stdout.write(f"tile {s:.2f},{w:.2f},{n:.2f},{e:.2f}: {len(items)}")
+            yield from items
@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ocm import caching
+from ocm import prefetch
+
+
+class Command(BaseCommand):
+    help = ("Refresh the most requested plan_trip, route_chargers and ev_stations cache entries, and "
+            "PREFETCH_CORRIDORS, before they go stale (see ocm/prefetch.py)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=prefetch.TOP, help="how many of the hottest entries")
+        parser.add_argument("--ahead", type=float, default=prefetch.AHEAD,
+                            help="refresh entries with less than this fraction of their TTL left")
+        parser.add_argument("--per-minute", type=int, default=prefetch.OCM_PER_MINUTE,
+                            help="most OCM requests to make in any minute")
+        parser.add_argument("--time-limit", type=float, help="stop after this many seconds")
+        parser.add_argument("--every", type=float, metavar="SECONDS",
+                            help="keep running, warming every SECONDS (instead of once)")
+        parser.add_argument("--list", action="store_true", help="show the ranking and freshness; refresh nothing")
+        parser.add_argument("--dry-run", action="store_true", help="show what would be refreshed")
+
+    def handle(self, *args, **opts):
+        if opts["per_minute"] < 1:
+            raise CommandError("--per-minute must be at least 1")
+        if "LocMemCache" in settings.CACHES["default"]["BACKEND"]:
+            self.stderr.write("The cache is per process (LocMemCache): this command can't see the workers' "
+                              "request counts or warm their cache. Only useful with a shared cache.")
+        if opts["list"]:
+            return self._list(opts["top"])
+
+        budget = prefetch.OcmBudget(opts["per_minute"])
+        while True:
+            counts = prefetch.warm(top=opts["top"], ahead=opts["ahead"], budget=budget,
+                                   time_limit=opts["time_limit"] or opts["every"], dry_run=opts["dry_run"],
+                                   log=self.stdout.write)
+            self.stdout.write(", ".join(f"{n} {name}" for name, n in counts.items() if n))
+            if not opts["every"]:
+                return
+            time.sleep(opts["every"])
+
+    def _list(self, top):
+        entries = prefetch.candidates(top)
+        if not entries:
+            self.stdout.write("nothing tracked yet and no PREFETCH_CORRIDORS")
+        for entry in entries:
+            left = caching.fresh_for(entry.key)
+            state = "not cached" if left is None else f"fresh {left:.0f}s" if left > 0 else f"stale {-left:.0f}s"
+            self.stdout.write(f"{entry.score:>8.1f}  {prefetch.describe(entry):<50} {state}")
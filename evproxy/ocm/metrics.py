@@ -0,0 +1,255 @@
+"""
+In-process metrics: per-stage timers, upstream call counts and latencies,
+cache hits and misses. Off unless METRICS_ENABLED is set; when off, every
+hook here returns straight away (MetricsMiddleware isn't even loaded).
+
+    with metrics.stage("route"):
+        route = routing.get_route(...)
+
+When on:
+  - each response gets a Server-Timing header with the request's stages,
+    upstream time and total (streamed bodies: only what ran before the
+    first byte),
+  - GET /metrics serves the totals in the Prometheus text format, to the
+    addresses in METRICS_ALLOWED_IPS.
+
+The numbers are per process: with several workers, scrape each one.
+"""
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+
+ENABLED = getattr(settings, "METRICS_ENABLED", False)
+ALLOWED_IPS = getattr(settings, "METRICS_ALLOWED_IPS", ("127.0.0.1", "::1"))
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # seconds
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> count
+_histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+
+HELP = {
+    "evproxy_request_seconds": ("histogram", "Time to build each API response, by view."),
+    "evproxy_stage_seconds": ("histogram", "Time spent in each stage of a view."),
+    "evproxy_upstream_requests_total": ("counter", "Upstream HTTP calls, by service, host, view and status."),
+    "evproxy_upstream_request_seconds": ("histogram", "Upstream HTTP call latency, retries included."),
+    "evproxy_upstream_coalesced_total": ("counter", "Upstream calls that shared an identical call in flight."),
+    "evproxy_cache_requests_total": ("counter", "Cache lookups by key family and result (hit, stale, miss)."),
+}
+
+
+def _inc(name, labels, n=1):
+    key = (name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+def _observe(name, labels, seconds):
+    key = (name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                h[i] += 1
+                break
+        else:
+            h[len(BUCKETS)] += 1
+        h[-1] += seconds
+
+def reset():
+    """Forget everything recorded so far."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+# -- per request --
+
+class _Timings:
+    # what one request spent where; shared with its worker threads via bind()
+    __slots__ = ("view", "stages", "upstream_calls", "upstream_seconds")
+
+    def __init__(self):
+        self.view = "none"
+        self.stages = {}  # stage -> seconds, in first-seen order
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+
+_current = ContextVar("evproxy_metrics_timings", default=None)
+
+def _view():
+    timings = _current.get()
+    return timings.view if timings is not None else "none"
+
+
+class _Stage:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.started
+        timings = _current.get()
+        view = "none"
+        if timings is not None:
+            view = timings.view
+            with _lock:
+                timings.stages[self.name] = timings.stages.get(self.name, 0.0) + seconds
+        _observe("evproxy_stage_seconds", (("view", view), ("stage", self.name)), seconds)
+
+_NOOP = nullcontext()
+
+def stage(name):
+    """Context manager timing one stage of the current request."""
+    return _Stage(name) if ENABLED else _NOOP
+
+def bind(fn):
+    """
+    fn, made to record into the calling request's timings when it runs in
+    another thread (thread pools don't carry context variables over).
+    """
+    if not ENABLED:
+        return fn
+    timings = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(timings)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+# -- hooks for upstream.py and caching.py --
+
+_hosts = {}
+
+def upstream_call(service, base_url, status, seconds):
+    host = _hosts.get(base_url)
+    if host is None:
+        host = _hosts[base_url] = urlsplit(base_url).netloc
+    view = _view()
+    _inc("evproxy_upstream_requests_total",
+         (("service", service), ("host", host), ("view", view), ("status", str(status))))
+    _observe("evproxy_upstream_request_seconds", (("service", service), ("view", view)), seconds)
+    timings = _current.get()
+    if timings is not None:
+        with _lock:  # the fan-out's worker threads add up here together
+            timings.upstream_calls += 1
+            timings.upstream_seconds += seconds
+
+def coalesced(service):
+    if ENABLED:
+        _inc("evproxy_upstream_coalesced_total", (("service", service), ("view", _view())))
+
+def cache_lookup(family, result):
+    if ENABLED:
+        _inc("evproxy_cache_requests_total", (("family", family), ("result", result)))
+
+
+# -- Server-Timing --
+
+class MetricsMiddleware:
+    """Times each request and adds the Server-Timing header. Not loaded when metrics are off."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        timings, started = _Timings(), time.perf_counter()
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(timings, started, response)
+
+    async def _acall(self, request):
+        timings, started = _Timings(), time.perf_counter()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(timings, started, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = _current.get()
+        if timings is not None:
+            timings.view = getattr(view_func, "__name__", "view")
+
+    def _finish(self, timings, started, response):
+        total = time.perf_counter() - started
+        if timings.view != "metrics_view":
+            _observe("evproxy_request_seconds", (("view", timings.view),), total)
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.stages.items()]
+        if timings.upstream_calls:
+            parts.append(f'upstream;dur={timings.upstream_seconds * 1000:.1f};desc="{timings.upstream_calls} calls"')
+        parts.append(f"total;dur={total * 1000:.1f}")
+        response["Server-Timing"] = ", ".join(parts)
+        return response
+
+
+# -- /metrics --
+
+def _label_text(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def render():
+    """Everything recorded so far, in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(h) for key, h in _histograms.items()}
+    lines = []
+    for name, (kind, text) in HELP.items():
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_label_text(labels)} {value}")
+            continue
+        for (n, labels), h in sorted(histograms.items()):
+            if n != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, h):
+                cumulative += count
+                lines.append(f"{name}_bucket{_label_text(labels, [('le', f'{bound:g}')])} {cumulative}")
+            cumulative += h[len(BUCKETS)]
+            lines.append(f"{name}_bucket{_label_text(labels, [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {h[-1]:.6f}")
+            lines.append(f"{name}_count{_label_text(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+def metrics_view(request):
+    if not ENABLED:
+        return HttpResponseNotFound("metrics are disabled (METRICS_ENABLED)")
+    if request.META.get("REMOTE_ADDR") not in ALLOWED_IPS:
+        return HttpResponseForbidden("metrics are only served to METRICS_ALLOWED_IPS")
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
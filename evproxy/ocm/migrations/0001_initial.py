@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Station',
+            fields=[
+                ('ocm_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('lat', models.FloatField()),
+                ('lon', models.FloatField()),
+                ('cell_lat', models.IntegerField()),
+                ('cell_lon', models.IntegerField()),
+                ('data', models.JSONField()),
+                ('date_last_verified', models.CharField(blank=True, max_length=40, null=True)),
+                ('date_created', models.CharField(blank=True, max_length=40, null=True)),
+                ('date_last_status_update', models.CharField(blank=True, max_length=40, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['cell_lat', 'cell_lon'], name='ocm_station_cell_la_06e9c2_idx')],
+            },
+        ),
+    ]
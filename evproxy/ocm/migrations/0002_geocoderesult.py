@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocm', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeResult',
+            fields=[
+                ('query', models.CharField(max_length=200, primary_key=True, serialize=False)),
+                ('found', models.BooleanField(default=False)),
+                ('name', models.CharField(blank=True, max_length=255, null=True)),
+                ('lat', models.FloatField(blank=True, null=True)),
+                ('lon', models.FloatField(blank=True, null=True)),
+                ('fetched_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,3 +1,42 @@
 from django.db import models
 
-# Create your models here.
+
+class Station(models.Model):
+    """
+    Local copy of an OpenChargeMap POI, normalized at ingest time.
+    `data` holds the cleaned station dict the API returns; the grid cell
+    columns back the spatial lookups in ocm/stations.py.
+    """
+    ocm_id = models.IntegerField(primary_key=True)
+    lat = models.FloatField()
+    lon = models.FloatField()
+    cell_lat = models.IntegerField()
+    cell_lon = models.IntegerField()
+    data = models.JSONField()
+    date_last_verified = models.CharField(max_length=40, null=True, blank=True)
+    date_created = models.CharField(max_length=40, null=True, blank=True)
+    date_last_status_update = models.CharField(max_length=40, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["cell_lat", "cell_lon"])]
+
+    def __str__(self):
+        return f"{self.ocm_id} {self.data.get('name') or ''}".strip()
+
+
+class GeocodeResult(models.Model):
+    """
+    Persistent cache of Nominatim answers, keyed on the normalized query.
+    found=False rows are negative entries ("Nominatim had nothing"); they
+    expire sooner than positive ones (see ocm/geocode.py).
+    """
+    query = models.CharField(max_length=200, primary_key=True)
+    found = models.BooleanField(default=False)
+    name = models.CharField(max_length=255, null=True, blank=True)
+    lat = models.FloatField(null=True, blank=True)
+    lon = models.FloatField(null=True, blank=True)
+    fetched_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.query} -> {self.name if self.found else '(not found)'}"
@@ -0,0 +1,273 @@
+"""
+Charging-stop optimizer for plan_trip.
+
+Chooses concrete stations along the route that minimise total trip time:
+driving, detours to and from each station, a fixed overhead per stop and
+charging time from a state-of-charge dependent charge curve.
+
+Candidates are ordered by where they sit along the route and a car only
+moves forward, so the search is a shortest path over a DAG, solved in one
+pass in route order:
+
+    state  = (stop, state of charge when leaving it)
+    edge   = drive from one stop to a later one (arriving above RESERVE_SOC),
+             then charge there up to one of the SoC levels
+    cost   = minutes
+
+Only the leaving SoC is discretised (SOC_STEP). Arrival SoC and charge time
+are exact per edge, so rounding doesn't pile up over a long trip. Candidates
+are thinned to the best PER_BUCKET per BUCKET_KM of route first, which keeps
+hundreds of raw stations down to a graph that solves in milliseconds.
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:  # optional: _solve_py covers everything
+    np = None
+
+SOC_STEP = 0.025          # leaving-SoC levels: 2.5%, 5%, ... 100%
+RESERVE_SOC = 0.10        # never plan to arrive anywhere below this
+STOP_OVERHEAD_MIN = 5     # parking, plugging in, paying
+DETOUR_FACTOR = 1.3       # road km per straight-line km between route and station
+BUCKET_KM = 10
+PER_BUCKET = 2
+DEFAULT_POWER_KW = 7.4    # stations without connector power data
+DC_MIN_KW = 25            # at or above this, use the DC taper
+
+# fraction of the charging power the car accepts at a given SoC (piecewise linear)
+DC_CURVE = ((0.0, 1.0), (0.5, 1.0), (0.8, 0.5), (1.0, 0.15))
+AC_CURVE = ((0.0, 1.0), (0.9, 1.0), (1.0, 0.5))
+
+_UNAVAILABLE = ("not operational", "non-operational", "removed", "decommissioned", "planned", "unavailable")
+_FINE = 200  # integration steps for the charge curve tables
+
+
+def _curve_at(curve, s):
+    for (s0, f0), (s1, f1) in zip(curve, curve[1:]):
+        if s <= s1:
+            return f0 + (f1 - f0) * (s - s0) / (s1 - s0)
+    return curve[-1][1]
+
+def _integral_table(curve):
+    # F[k] = integral of 1/f(s) ds from 0 to k/_FINE (trapezoid rule)
+    table = [0.0]
+    prev = 1.0 / _curve_at(curve, 0.0)
+    for k in range(1, _FINE + 1):
+        cur = 1.0 / _curve_at(curve, k / _FINE)
+        table.append(table[-1] + (prev + cur) / (2 * _FINE))
+        prev = cur
+    return table
+
+_TABLES = {"dc": _integral_table(DC_CURVE), "ac": _integral_table(AC_CURVE)}
+
+def _F(table, s):
+    x = min(max(s, 0.0), 1.0) * _FINE
+    k = min(int(x), _FINE - 1)
+    return table[k] + (table[k + 1] - table[k]) * (x - k)
+
+def charge_minutes(from_soc, to_soc, power_kw, battery_kwh, vehicle_max_kw):
+    """Minutes to charge between two SoC fractions at a station of power_kw."""
+    kw = min(power_kw, vehicle_max_kw)
+    table = _TABLES["dc" if kw >= DC_MIN_KW else "ac"]
+    return 60.0 * battery_kwh / kw * (_F(table, to_soc) - _F(table, from_soc))
+
+
+def station_power_kw(station):
+    return station.max_power_kw if station.max_power_kw > 0 else DEFAULT_POWER_KW
+
+def is_usable(station):
+    status = (station.status or "").lower()
+    return not any(word in status for word in _UNAVAILABLE)
+
+def candidates(stations, battery_kwh, vehicle_max_kw):
+    """
+    Thin (station, km_along, detour_km) triples to the PER_BUCKET quickest
+    stops in every BUCKET_KM stretch of route, in route order.
+    Quickest = minutes of detour (at ~60 km/h) plus a 20% -> 60% charge.
+    """
+    buckets = {}
+    for station, km, detour in stations:
+        if km is None or not is_usable(station):
+            continue
+        kw = station_power_kw(station)
+        cost = 2 * detour * DETOUR_FACTOR + charge_minutes(0.2, 0.6, kw, battery_kwh, vehicle_max_kw)
+        buckets.setdefault(int(km // BUCKET_KM), []).append((cost, km, detour, station))
+    kept = []
+    for bucket in buckets.values():
+        bucket.sort(key=lambda c: c[0])
+        kept.extend(bucket[:PER_BUCKET])
+    kept.sort(key=lambda c: c[1])
+    return [(station, km, detour) for _, km, detour, station in kept]
+
+
+def plan_stops(stations, distance_km, duration_s, range_km, battery_kwh, start_soc, vehicle_max_kw=50):
+    """
+    Fastest sequence of charging stops.
+
+    stations: (StationRecord, km_along, detour_km) for every candidate; km_along
+    on the same scale as distance_km, detour_km straight-line from the route.
+    start_soc: fraction 0..1.
+
+    Returns {"stops": [...], "drive_minutes", "charge_minutes", "total_minutes"}
+    (stops empty when no charging is needed), or None when the trip can't be
+    done with these stations.
+    """
+    if distance_km <= 0 or range_km <= 0:
+        return None
+    speed_kmpm = distance_km / (duration_s / 60) if duration_s else 1.0  # km per minute
+    soc_per_km = 1.0 / range_km
+    cands = candidates(stations, battery_kwh, vehicle_max_kw)
+    # starting below the reserve: the first leg may dip to half of what's left rather than refusing
+    first_reserve = min(RESERVE_SOC, start_soc / 2)
+
+    # node 0 = start, 1..n = stations, n+1 = destination
+    kms = [0.0] + [km for _, km, _ in cands] + [distance_km]
+    detours = [0.0] + [d * DETOUR_FACTOR for _, _, d in cands] + [0.0]
+    powers = [0.0] + [min(station_power_kw(s), vehicle_max_kw) for s, _, _ in cands] + [0.0]
+    solve = _solve_np if np is not None else _solve_py
+    found = solve(kms, detours, powers, start_soc, first_reserve, soc_per_km, speed_kmpm, battery_kwh)
+    if found is None:
+        return None
+    total, path = found
+
+    stops = []
+    charge_total = 0.0
+    for node, arrive, leave in path:
+        station = cands[node - 1][0]
+        minutes = charge_minutes(arrive, leave, powers[node], battery_kwh, vehicle_max_kw)
+        charge_total += minutes
+        stops.append({
+            "station": station,
+            "km_along": kms[node],
+            "detour_km": detours[node],
+            "power_kw": powers[node],
+            "arrive_soc": arrive,
+            "leave_soc": leave,
+            "charge_minutes": minutes,
+            "energy_kwh": (leave - arrive) * battery_kwh,
+        })
+    return {
+        "stops": stops,
+        "charge_minutes": charge_total,
+        "drive_minutes": total - charge_total - STOP_OVERHEAD_MIN * len(stops),
+        "total_minutes": total,
+    }
+
+
+def _levels():
+    return [round(SOC_STEP * k, 6) for k in range(1, int(round(1 / SOC_STEP)) + 1)]
+
+def _solve_np(kms, detours, powers, start_soc, first_reserve, soc_per_km, speed_kmpm, battery_kwh):
+    n = len(kms)
+    levels = np.array(_levels())
+    L = len(levels)
+    Fdc, Fac = np.array(_TABLES["dc"]), np.array(_TABLES["ac"])
+    grid = np.linspace(0.0, 1.0, _FINE + 1)
+    kms_a = np.array(kms)
+    det_a = np.array(detours)
+
+    # leaving SoC and time per node; the start leaves once, at start_soc
+    leave = np.tile(levels, (n, 1))
+    leave[0, :] = start_soc
+    best = np.full((n, L), np.inf)
+    best[0, 0] = 0.0
+    # back-pointers per (node, level): predecessor node/level and arrival SoC
+    back = (np.zeros((n, L), dtype=int), np.zeros((n, L), dtype=int), np.zeros((n, L)))
+    reach = 1.0 / soc_per_km  # km on a full battery
+
+    lo = 0
+    for j in range(1, n):
+        while kms[j] - kms[lo] > reach:
+            lo += 1
+        if lo >= j:
+            return None  # a gap no battery can cross
+        dist = (kms[j] - kms_a[lo:j]) + det_a[lo:j] + detours[j]
+        arr = leave[lo:j] - (dist * soc_per_km)[:, None]
+        t = best[lo:j] + (dist / speed_kmpm)[:, None]
+        reserve = np.where(np.arange(lo, j) == 0, first_reserve, RESERVE_SOC)[:, None]
+        ok = (arr >= reserve) & np.isfinite(t)
+        if j == n - 1:
+            if not ok.any():
+                return None
+            t = np.where(ok, t, np.inf)
+            i, l = np.unravel_index(np.argmin(t), t.shape)
+            return float(t[i, l]), _path(back, lo + i, l, leave)
+        if not ok.any():
+            continue
+        F = Fdc if powers[j] >= DC_MIN_KW else Fac
+        scale = 60.0 * battery_kwh / powers[j]
+        arr_ok, t_ok = arr[ok], t[ok]
+        src_i, src_l = np.nonzero(ok)
+        # time leaving at level m = min over arrivals <= m of (t - c*F(arr)) + c*F(m)
+        key = t_ok - scale * np.interp(arr_ok, grid, F)
+        order = np.argsort(arr_ok, kind="stable")
+        arr_s, key_s = arr_ok[order], key[order]
+        run = np.minimum.accumulate(key_s)
+        pos = np.arange(len(key_s))
+        arg = np.maximum.accumulate(np.where(key_s == run, pos, 0))
+        upto = np.searchsorted(arr_s, levels, side="right") - 1
+        m = upto >= 0
+        k = order[arg[upto[m]]]
+        best[j, m] = run[upto[m]] + scale * np.interp(levels[m], grid, F) + STOP_OVERHEAD_MIN
+        back[0][j, m], back[1][j, m], back[2][j, m] = lo + src_i[k], src_l[k], arr_ok[k]
+    return None
+
+def _solve_py(kms, detours, powers, start_soc, first_reserve, soc_per_km, speed_kmpm, battery_kwh):
+    n = len(kms)
+    levels = _levels()
+    L = len(levels)
+    leave = [[start_soc] + [math.nan] * (L - 1)] + [levels] * (n - 1)
+    best = [[0.0] + [math.inf] * (L - 1)] + [[math.inf] * L for _ in range(n - 1)]
+    back = ([[0] * L for _ in range(n)], [[0] * L for _ in range(n)], [[0.0] * L for _ in range(n)])
+    reach = 1.0 / soc_per_km
+
+    lo = 0
+    for j in range(1, n):
+        while kms[j] - kms[lo] > reach:
+            lo += 1
+        if lo >= j:
+            return None
+        entries = []  # (arrival soc, time, pred node, pred level)
+        for i in range(lo, j):
+            dist = kms[j] - kms[i] + detours[i] + detours[j]
+            used, drive = dist * soc_per_km, dist / speed_kmpm
+            reserve = first_reserve if i == 0 else RESERVE_SOC
+            for l, t in enumerate(best[i]):
+                if t == math.inf:
+                    continue
+                arr = leave[i][l] - used
+                if arr >= reserve:
+                    entries.append((arr, t + drive, i, l))
+        if j == n - 1:
+            if not entries:
+                return None
+            arr, t, i, l = min(entries, key=lambda e: e[1])
+            return t, _path(back, i, l, leave)
+        if not entries:
+            continue
+        table = _TABLES["dc" if powers[j] >= DC_MIN_KW else "ac"]
+        scale = 60.0 * battery_kwh / powers[j]
+        entries.sort()
+        run, run_e, k = math.inf, None, 0
+        for m, level in enumerate(levels):
+            while k < len(entries) and entries[k][0] <= level:
+                arr, t, i, l = entries[k]
+                key = t - scale * _F(table, arr)
+                if key < run:
+                    run, run_e = key, entries[k]
+                k += 1
+            if run_e is not None:
+                best[j][m] = run + scale * _F(table, level) + STOP_OVERHEAD_MIN
+                back[0][j][m], back[1][j][m], back[2][j][m] = run_e[2], run_e[3], run_e[0]
+    return None
+
+def _path(back, node, level, leave):
+    # walk predecessors back to the start: [(node, arrive_soc, leave_soc), ...] in route order
+    path = []
+    while node != 0:
+        pred, pred_level, arrive = back[0][node][level], back[1][node][level], back[2][node][level]
+        path.append((int(node), float(arrive), float(leave[node][level])))
+        node, level = pred, pred_level
+    path.reverse()
+    return path
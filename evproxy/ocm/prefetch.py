@@ -0,0 +1,262 @@
+"""
+Cache warming for the popular corridors.
+
+The views report each cached entry they ask for (plan_trip corridors,
+route_chargers results, ev_stations tiles) with track(). The counts decay
+with a half-life of PREFETCH_HALF_LIFE and are merged into the shared cache
+every FLUSH_EVERY seconds, so with a shared backend (redis/file) all workers
+and the warm_cache command see one ranking; with the per-process locmem
+cache, only the process itself does.
+
+warm() refreshes the PREFETCH_TOP hottest entries, plus the trips in
+PREFETCH_CORRIDORS, that are missing or within PREFETCH_AHEAD (a fraction of
+their TTL) of going stale, so requests keep finding them fresh. It only goes
+on while this process' OCM request rate, user traffic included, leaves room
+under PREFETCH_OCM_PER_MINUTE for the requests the next refresh is expected
+to make (what it made last time, or a guess per layer).
+
+    python manage.py warm_cache            # once, e.g. from cron
+    PREFETCH_INTERVAL=300                  # or every 5 minutes, in the workers
+
+Counts from several workers are merged without a lock, so a few can be lost;
+it's a ranking, not an audit.
+"""
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from . import caching
+from . import upstream
+from . import views
+
+logger = logging.getLogger(__name__)
+
+TRACKING = getattr(settings, "PREFETCH_TRACKING", True)
+INTERVAL = getattr(settings, "PREFETCH_INTERVAL", 0)  # seconds; 0: no in-process scheduler
+TOP = getattr(settings, "PREFETCH_TOP", 50)
+AHEAD = getattr(settings, "PREFETCH_AHEAD", 0.25)
+OCM_PER_MINUTE = getattr(settings, "PREFETCH_OCM_PER_MINUTE", 60)
+HALF_LIFE = getattr(settings, "PREFETCH_HALF_LIFE", 3600)  # seconds
+CORRIDORS = getattr(settings, "PREFETCH_CORRIDORS", ())
+
+FLUSH_EVERY = 30  # seconds
+MAX_TRACKED = 1000
+MIN_SCORE = 0.05  # decayed below this, an entry is forgotten
+HOT_KEY = "prefetch:hot"
+RUN_KEY = "prefetch:running"
+
+LAYERS = ("trip_corridor", "routechargers", "ocm_tile")  # what can be warmed
+# OCM requests a refresh is assumed to make until it has been seen doing one:
+# plan_trip's lookup cap, a typical route_chargers fan-out, one tile
+EXPECTED_OCM_CALLS = {"trip_corridor": 15, "routechargers": 15, "ocm_tile": 1}
+
+Entry = namedtuple("Entry", "layer key args score")
+
+
+# -- tracking --
+
+_pending = {}  # (layer, key) -> [requests, args], since the last flush
+_lock = threading.Lock()
+_next_flush = 0.0
+_scheduler = None
+
+def track(layer, key, args):
+    """Count one request for cache entry `key`; `args` recompute it (see _refresher)."""
+    global _next_flush
+    if not TRACKING:
+        return
+    with _lock:
+        entry = _pending.get((layer, key))
+        if entry is None:
+            _pending[(layer, key)] = [1, args]
+        else:
+            entry[0] += 1
+        now = time.monotonic()
+        due = now >= _next_flush
+        if due:
+            _next_flush = now + FLUSH_EVERY
+    if due:
+        # the shared cache may be a network hop away: not on the request's time
+        threading.Thread(target=_flush_quietly, daemon=True).start()
+    if INTERVAL and _scheduler is None:
+        _start_scheduler()
+
+def _flush_quietly():
+    try:
+        flush()
+    except Exception as e:
+        logger.warning("Prefetch counts not saved: %s", e)
+
+def _load(now):
+    hot = cache.get(HOT_KEY)
+    if not hot:
+        return {}
+    decay = 0.5 ** ((now - hot["at"]) / HALF_LIFE)
+    return {k: (score * decay, args) for k, (score, args) in hot["entries"].items() if score * decay >= MIN_SCORE}
+
+def flush():
+    """Merge this process' counts since the last flush into the shared ranking."""
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return
+    now = time.time()
+    entries = _load(now)
+    for k, (n, args) in pending.items():
+        entries[k] = (entries[k][0] + n if k in entries else n, args)
+    if len(entries) > MAX_TRACKED:
+        entries = dict(sorted(entries.items(), key=lambda kv: kv[1][0], reverse=True)[:MAX_TRACKED])
+    cache.set(HOT_KEY, {"at": now, "entries": entries}, timeout=None)
+
+def hottest(top=TOP):
+    """The `top` most requested entries, hottest first."""
+    flush()
+    ranked = sorted(_load(time.time()).items(), key=lambda kv: kv[1][0], reverse=True)
+    return [Entry(layer, key, args, score) for (layer, key), (score, args) in ranked[:top] if layer in LAYERS]
+
+def corridors():
+    """PREFETCH_CORRIDORS as plan_trip entries, both ways."""
+    local = views._use_local()
+    return [Entry("trip_corridor", views._trip_corridor_key(a, b, local), (a, b, local), 0.0)
+            for pair in CORRIDORS for a, b in (pair, pair[::-1])]
+
+def candidates(top=TOP):
+    entries = hottest(top)
+    seen = {e.key for e in entries}
+    return entries + [e for e in corridors() if e.key not in seen]
+
+
+# -- refreshing --
+
+def _trip_corridor(from_city, to_city, local):
+    # a _Degraded corridor (some lookups failed) propagates: what is cached stays
+    return views._trip_corridor(from_city, to_city, local, upstream.Deadline(views.PLAN_TRIP_DEADLINE))
+
+def _refresher(layer):
+    # looked up late: views imports this module
+    return {
+        "trip_corridor": _trip_corridor,
+        "routechargers": views._route_chargers_result,
+        "ocm_tile": views._ocm_tile_fetch,
+    }[layer]
+
+def describe(entry):
+    if entry.layer == "trip_corridor":
+        return f"trip {entry.args[0]} -> {entry.args[1]}"
+    if entry.layer == "routechargers":
+        return f"route {entry.args[0]:.3f},{entry.args[1]:.3f} -> {entry.args[2]:.3f},{entry.args[3]:.3f}"
+    return f"tile {entry.key.split(':', 1)[1]}"
+
+def due(entry, ahead=AHEAD):
+    """Whether `entry` is missing or has less than `ahead` of its TTL left."""
+    left = caching.fresh_for(entry.key)
+    return left is None or left < ahead * caching.layer_config(entry.layer)["ttl"]
+
+
+class OcmBudget:
+    """
+    Caps this process' OCM requests at `per_minute` over any minute: the
+    prefetcher waits for room, counting user traffic's requests too. Room
+    means enough for the whole next refresh (expected()), which is charged
+    what it actually made afterwards (spent()).
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self._seen = deque([(time.monotonic(), upstream.calls("ocm"))])  # (when, calls so far)
+        self._made = {}  # entry key -> OCM requests its last refresh made
+
+    def expected(self, entry):
+        return self._made.get(entry.key, EXPECTED_OCM_CALLS.get(entry.layer, 1))
+
+    def spent(self, entry, calls):
+        self._made[entry.key] = calls
+
+    def used(self):
+        now, calls = time.monotonic(), upstream.calls("ocm")
+        self._seen.append((now, calls))
+        while len(self._seen) > 1 and self._seen[1][0] <= now - 60:
+            self._seen.popleft()
+        return calls - self._seen[0][1]
+
+    def wait(self, until=None, need=1):
+        """Block until there is room for `need` requests; False if that would be after `until` (time.monotonic())."""
+        need = min(need, self.per_minute)  # a refresh bigger than the cap gets a minute to itself
+        while self.used() + need > self.per_minute:
+            if until is not None and time.monotonic() + 1 > until:
+                return False
+            time.sleep(1)
+        return True
+
+
+def warm(top=TOP, ahead=AHEAD, budget=None, time_limit=None, dry_run=False, log=None):
+    """
+    Refresh the hot entries that are due (see module docstring). Returns
+    counts: refreshed, fresh (not due), busy (being computed elsewhere),
+    degraded (only partly done, so not stored), failed, left (out of time
+    or OCM budget), and with dry_run, only fresh and due.
+    """
+    budget = budget or OcmBudget(OCM_PER_MINUTE)
+    until = time.monotonic() + time_limit if time_limit else None
+    counts = dict.fromkeys(("refreshed", "due", "fresh", "busy", "degraded", "failed", "left"), 0)
+    entries = candidates(top)
+    for n, entry in enumerate(entries):
+        if not due(entry, ahead):
+            counts["fresh"] += 1
+            continue
+        if dry_run:
+            counts["due"] += 1
+            if log:
+                log(f"due: {describe(entry)} (score {entry.score:.1f})")
+            continue
+        if (until is not None and time.monotonic() >= until) or not budget.wait(until, budget.expected(entry)):
+            counts["left"] = len(entries) - n
+            break
+        started, calls = time.monotonic(), upstream.calls("ocm")
+        try:
+            ran = caching.refresh(entry.layer, entry.key, lambda: _refresher(entry.layer)(*entry.args))
+            outcome = "refreshed" if ran else "busy"
+        except views._Degraded as e:
+            outcome = "degraded"
+            logger.warning("Prefetch of %s degraded, kept the cached entry: %s", describe(entry), e)
+        except Exception as e:
+            outcome = "failed"
+            logger.warning("Prefetch of %s failed: %s", describe(entry), e)
+        made = upstream.calls("ocm") - calls
+        if outcome != "busy":
+            budget.spent(entry, made)
+        counts[outcome] += 1
+        if log and outcome != "failed":
+            log(f"{outcome}: {describe(entry)} (score {entry.score:.1f}, "
+                f"{made} OCM requests, {time.monotonic() - started:.1f}s)")
+    return counts
+
+
+# -- in-process scheduler --
+
+def _start_scheduler():
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_run_scheduler, name="prefetch", daemon=True)
+            _scheduler.start()
+
+def _run_scheduler():
+    budget = OcmBudget(OCM_PER_MINUTE)
+    while True:
+        time.sleep(INTERVAL)
+        # with a shared cache, one worker per interval does the warming
+        if not cache.add(RUN_KEY, 1, timeout=max(1, int(INTERVAL * 0.9))):
+            continue
+        try:
+            warm(budget=budget, time_limit=INTERVAL)
+        except Exception as e:
+            logger.exception("Cache warming failed: %s", e)
+        finally:
+            connections.close_all()
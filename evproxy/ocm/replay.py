@@ -0,0 +1,312 @@
+"""
+Recorded upstream responses, and a local stub server that plays them back,
+so the views can be exercised (benchmarked) without OCM/OSRM/Nominatim.
+
+A fixture directory holds one JSON file per upstream response, under
+<dir>/<service>/, keyed by method, path and query params (OCM's API key is
+left out of the key, and out of the file):
+
+    with replay.recording("bench/fixtures"):   # real upstreams, responses saved
+        ...
+    with replay.StubServer("bench/fixtures", latency=0.02) as stub:
+        settings.UPSTREAMS = stub.upstreams(settings.UPSTREAMS)
+        ...
+
+Requests with no recording get a synthetic answer instead: OCM stations
+scattered over a fixed pseudo-random grid, an OSRM route with a point every
+~100 m between the two ends, and no Nominatim match. Same request, same
+answer, on every run. StubServer(strict=True) answers them 404 instead.
+"""
+import hashlib
+import json
+import math
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from . import routing
+from . import upstream
+
+SERVICES = ("ocm", "osrm", "nominatim")
+_SECRET_PARAMS = {"key"}
+
+
+def fixture_key(method, path, params):
+    """File name (without .json) of the recording for one request."""
+    params = sorted((k, v) for k, v in params if k not in _SECRET_PARAMS)
+    text = json.dumps([method.upper(), unquote(path), params])
+    return hashlib.sha1(text.encode()).hexdigest()[:20]
+
+
+class FixtureStore:
+    """Recorded responses in a directory; a missing directory is just empty."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory) if directory else None
+        self._lock = threading.Lock()
+
+    def _path(self, service, key):
+        return self.directory / service / f"{key}.json"
+
+    def load(self, service, method, path, params):
+        """(status, body bytes) for a recorded request, or None."""
+        if self.directory is None:
+            return None
+        try:
+            fixture = json.loads(self._path(service, fixture_key(method, path, params)).read_text())
+        except FileNotFoundError:
+            return None
+        return fixture["status"], fixture["body"].encode()
+
+    def save(self, service, method, path, params, status, body):
+        fixture = {
+            "method": method.upper(),
+            "path": unquote(path),
+            "params": [[k, v] for k, v in params if k not in _SECRET_PARAMS],
+            "status": status,
+            "body": body.decode("utf-8", "replace"),
+        }
+        target = self._path(service, fixture_key(method, path, params))
+        with self._lock:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_text(json.dumps(fixture))
+
+    def __len__(self):
+        if self.directory is None or not self.directory.is_dir():
+            return 0
+        return sum(1 for _ in self.directory.glob("*/*.json"))
+
+
+@contextmanager
+def recording(directory, services=SERVICES):
+    """
+    Save every response upstream.request() gets from `services` while the
+    block runs (sync callers only; async views' calls aren't seen).
+    """
+    store = FixtureStore(directory)
+    real = upstream._request
+
+    def recorded(service, method, path, timeout, deadline, **kwargs):
+        resp = real(service, method, path, timeout, deadline, **kwargs)
+        if service in services:
+            parts = urlsplit(resp.url)
+            base = urlsplit(upstream.config(service)["base_url"]).path.rstrip("/")
+            store.save(service, method, parts.path[len(base):], parse_qsl(parts.query, keep_blank_values=True),
+                       resp.status_code, resp.content)
+        return resp
+
+    upstream._request = recorded
+    try:
+        yield store
+    finally:
+        upstream._request = real
+
+
+# -- synthetic answers --
+
+_GRID = 0.05  # degrees per station cell
+_CONNECTORS = ("CCS (Type 2)", "Type 2 (Socket Only)", "CHAdeMO", "Type 1 (J1772)", "Bharat AC-001")
+_POWERS = (3.3, 7.4, 22, 30, 50, 60, 150, None)
+_STATUSES = ("Operational", "Operational", "Operational", "Planned", "Temporarily Unavailable", None)
+
+
+def _cell_station(i, j):
+    # the station in grid cell (i, j), or None; about one cell in two has one
+    r = random.Random(i * 100003 + j)
+    if r.random() < 0.5:
+        return None
+    lat, lon = (i + r.random()) * _GRID, (j + r.random()) * _GRID
+    station_id = (i + 100000) * 1000000 + (j + 100000)
+    return {
+        "ID": station_id,
+        "AddressInfo": {"Title": f"Station {station_id}", "AddressLine1": f"{r.randint(1, 200)} Main Road",
+                        "Town": "Town", "Latitude": round(lat, 6), "Longitude": round(lon, 6)},
+        "Connections": [{"ConnectionType": {"Title": r.choice(_CONNECTORS)}, "PowerKW": r.choice(_POWERS),
+                         "Quantity": r.randint(1, 4), "Level": {"Title": "Level 2 : Medium (Over 2kW)"}}
+                        for _ in range(r.randint(1, 3))],
+        "StatusType": {"Title": r.choice(_STATUSES)},
+        "UsageCost": r.choice(("Free", "INR 18/kWh", None)),
+        "NumberOfPoints": r.randint(1, 6),
+        "OperatorInfo": {"Title": r.choice(("Tata Power", "Statiq", "ChargeZone", "Ather Grid"))},
+        "DateLastVerified": None,
+        "DateCreated": f"20{r.randint(18, 24)}-0{r.randint(1, 9)}-1{r.randint(0, 9)}T00:00:00Z",
+    }
+
+def _stations_in_box(lat1, lon1, lat2, lon2):
+    found = []
+    for i in range(math.floor(lat1 / _GRID), math.floor(lat2 / _GRID) + 1):
+        for j in range(math.floor(lon1 / _GRID), math.floor(lon2 / _GRID) + 1):
+            station = _cell_station(i, j)
+            if station is None:
+                continue
+            a = station["AddressInfo"]
+            if lat1 <= a["Latitude"] <= lat2 and lon1 <= a["Longitude"] <= lon2:
+                found.append(station)
+    return found
+
+def synthetic_ocm(params):
+    q = dict(params)
+    limit = int(q.get("maxresults", 100))
+    if "boundingbox" in q:
+        # "(lat1,lon1),(lat2,lon2)"
+        lat1, lon1, lat2, lon2 = (float(x) for x in q["boundingbox"].replace("(", "").replace(")", "").split(","))
+        found = _stations_in_box(min(lat1, lat2), min(lon1, lon2), max(lat1, lat2), max(lon1, lon2))
+        return found[:limit]
+    lat, lon, radius = float(q["latitude"]), float(q["longitude"]), float(q.get("distance", 10))
+    dlat = radius / 111.0
+    dlon = radius / (111.0 * max(0.1, math.cos(math.radians(lat))))
+    found = []
+    for station in _stations_in_box(lat - dlat, lon - dlon, lat + dlat, lon + dlon):
+        a = station["AddressInfo"]
+        d = math.hypot((a["Latitude"] - lat) * 111.0, (a["Longitude"] - lon) * 111.0 * math.cos(math.radians(lat)))
+        if d <= radius:
+            a["Distance"] = round(d, 3)
+            found.append(station)
+    found.sort(key=lambda s: s["AddressInfo"]["Distance"])
+    return found[:limit]
+
+def synthetic_osrm(path, params):
+    # /route/v1/driving/lon1,lat1;lon2,lat2
+    (lon1, lat1), (lon2, lat2) = ([float(x) for x in p.split(",")] for p in unquote(path).rsplit("/", 1)[1].split(";"))
+    straight = math.hypot((lat2 - lat1) * 111.0, (lon2 - lon1) * 111.0 * math.cos(math.radians(lat1)))
+    n = max(2, int(straight / 0.1))
+    r = random.Random(f"{lat1},{lon1};{lat2},{lon2}")
+    phase, bends = r.random() * math.pi, 3 + straight / 60
+    points = []
+    for k in range(n):
+        t = k / (n - 1)
+        wobble = 0.04 * math.sin(phase + t * bends * math.pi) * math.sin(t * math.pi)  # roads aren't straight
+        points.append((lat1 + (lat2 - lat1) * t + wobble, lon1 + (lon2 - lon1) * t - wobble))
+    distance = sum(math.hypot((b[0] - a[0]) * 111000.0, (b[1] - a[1]) * 111000.0 * math.cos(math.radians(a[0])))
+                   for a, b in zip(points, points[1:]))
+    precision = 6 if dict(params).get("geometries") == "polyline6" else 5
+    return {"code": "Ok", "routes": [{"distance": round(distance, 1), "duration": round(distance / 16.7, 1),
+                                      "geometry": routing.encode_polyline(points, precision)}]}
+
+def synthetic(service, path, params):
+    """(status, body bytes) made up for a request nothing was recorded for."""
+    if service == "ocm":
+        body = synthetic_ocm(params)
+    elif service == "osrm" and "/route/" in path:
+        body = synthetic_osrm(path, params)
+    elif service == "nominatim":
+        body = []
+    else:
+        return 404, b'{"error": "no fixture"}'
+    return 200, json.dumps(body).encode()
+
+
+# -- the stub server --
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real upstreams, so pooling is measured too
+
+    def do_GET(self):
+        self._answer()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self._answer()
+
+    def _answer(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        service, _, path = parts.path.lstrip("/").partition("/")
+        path = "/" + path
+        params = parse_qsl(parts.query, keep_blank_values=True)
+        answer = server.store.load(service, self.command, path, params)
+        if answer is not None:
+            counter = server.counts["replayed"]
+        elif server.strict:
+            answer, counter = (404, b'{"error": "no fixture"}'), server.counts["missing"]
+        else:
+            answer, counter = synthetic(service, path, params), server.counts["synthesized"]
+        with counter.get_lock():
+            counter.value += 1
+        if server.latency:
+            time.sleep(server.latency)
+        status, body = answer
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # the OCM fan-out opens many connections at once
+
+    def handle_error(self, request, client_address):
+        # a client whose deadline ran out hangs up before the answer; nothing to report
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def _serve(fixtures, latency, strict, counts, ready):
+    server = _Server(("127.0.0.1", 0), _Handler)
+    server.store, server.latency, server.strict, server.counts = FixtureStore(fixtures), latency, strict, counts
+    ready.send(server.server_address[1])
+    server.serve_forever()
+
+
+class StubServer:
+    """
+    Local HTTP server standing in for OCM, OSRM and Nominatim: each service
+    under its own path prefix (http://127.0.0.1:<port>/ocm/v3/poi/...).
+    `latency` (seconds) is added to every answer, as network time.
+
+    It runs in a child process, so its work doesn't show up in the
+    caller's CPU time, memory or GIL contention.
+    """
+
+    def __init__(self, fixtures=None, latency=0.0, strict=False):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.strict = strict
+        self.counts = {name: multiprocessing.Value("l", 0) for name in ("replayed", "synthesized", "missing")}
+        self.port = None
+        self._process = None
+
+    def start(self):
+        ready, child = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.fixtures, self.latency, self.strict, self.counts, child), daemon=True)
+        self._process.start()
+        if not ready.poll(30):
+            self.stop()
+            raise RuntimeError("stub server didn't start")
+        self.port = ready.recv()
+        return self
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, name):
+        """How many requests were "replayed", "synthesized" or "missing" (strict 404s)."""
+        return self.counts[name].value
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def upstreams(self, current):
+        """settings.UPSTREAMS with OCM, OSRM and Nominatim pointed here."""
+        return {service: {**cfg, "base_url": f"{self.base_url}/{service}"} if service in SERVICES else cfg
+                for service, cfg in current.items()}
@@ -0,0 +1,155 @@
+"""
+OSRM driving routes, cached.
+
+Both route_chargers and plan_trip ask for the same thing: the full route
+between two points. Endpoints are snapped to a small grid (ROUTE_SNAP_DEG,
+~100 m by default) so requests from nearly the same spot share one entry,
+and the route is stored compactly as a polyline6 string plus distance and
+duration, in the "osrm_route" cache layer. Changing only vehicle or battery
+parameters therefore never re-fetches the route.
+
+    route = routing.get_route(src_lat, src_lon, dst_lat, dst_lon)
+    route["coordinates"]  # [[lon, lat], ...] like OSRM's geojson
+"""
+from django.conf import settings
+
+from . import caching
+from . import geo
+from . import jsoncodec
+from . import upstream
+
+OSRM_ROUTE_PATH = "/route/v1/driving"
+SNAP_DEG = getattr(settings, "ROUTE_SNAP_DEG", 0.001)
+PRECISION = 6  # polyline6, OSRM's full-precision encoding
+SIMPLIFY_PIXELS = getattr(settings, "ROUTE_SIMPLIFY_PIXELS", 0.5)  # max on-screen error at the requested zoom
+GEOMETRY_FORMATS = ("geojson", "polyline", "polyline6")
+
+
+def snap(lat, lon):
+    return round(round(lat / SNAP_DEG) * SNAP_DEG, 6), round(round(lon / SNAP_DEG) * SNAP_DEG, 6)
+
+
+def encode_polyline(points, precision=PRECISION):
+    """Google encoded polyline for (lat, lon) pairs."""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        ilat, ilon = round(lat * factor), round(lon * factor)
+        for delta in (ilat - prev_lat, ilon - prev_lon):
+            v = ~(delta << 1) if delta < 0 else delta << 1
+            while v >= 0x20:
+                out.append(chr((0x20 | (v & 0x1f)) + 63))
+                v >>= 5
+            out.append(chr(v + 63))
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(out)
+
+def decode_polyline(encoded, precision=PRECISION):
+    """[[lon, lat], ...] (geojson order) from an encoded polyline."""
+    factor = 10.0 ** precision
+    data = encoded.encode("ascii")  # iterating bytes gives ints, no ord() per char
+    n = len(data)
+    i = lat = lon = 0
+    coords = []
+    while i < n:
+        result = shift = 0
+        while True:
+            b = data[i] - 63
+            i += 1
+            result |= (b & 0x1f) << shift
+            shift += 5
+            if b < 0x20:
+                break
+        lat += ~(result >> 1) if result & 1 else result >> 1
+        result = shift = 0
+        while True:
+            b = data[i] - 63
+            i += 1
+            result |= (b & 0x1f) << shift
+            shift += 5
+            if b < 0x20:
+                break
+        lon += ~(result >> 1) if result & 1 else result >> 1
+        coords.append([lon / factor, lat / factor])
+    return coords
+
+
+def _route_path(src, dst):
+    return f"{OSRM_ROUTE_PATH}/{src[1]},{src[0]};{dst[1]},{dst[0]}"
+
+_ROUTE_PARAMS = {"overview": "full", "geometries": f"polyline{PRECISION}"}
+
+def _parse_route(resp):
+    resp.raise_for_status()
+    routes = jsoncodec.loads(resp.content).get("routes")
+    if not routes:
+        return None
+    route = routes[0]
+    return {"distance": route["distance"], "duration": route["duration"], "polyline": route["geometry"]}
+
+def _route_key(src, dst):
+    return f"osrm_route:{src[0]},{src[1]};{dst[0]},{dst[1]}"
+
+def _decoded(route):
+    if route is None:
+        return None
+    return {"distance": route["distance"], "duration": route["duration"],
+            "coordinates": decode_polyline(route["polyline"])}
+
+def _wait(deadline):
+    return deadline.remaining() if deadline is not None else None
+
+def _renewed(deadline):
+    # a stale route is refreshed in the background, past the request's own deadline
+    return deadline.renewed() if deadline is not None else None
+
+def fetch_route(src, dst, deadline=None):
+    """
+    One OSRM request; src/dst are (lat, lon). Returns
+    {"distance": m, "duration": s, "polyline": str}, or None when OSRM has no route.
+    HTTP and connection errors propagate, as does upstream.DeadlineExceeded.
+    """
+    return _parse_route(upstream.get("osrm", _route_path(src, dst), params=_ROUTE_PARAMS, deadline=deadline))
+
+async def afetch_route(src, dst, deadline=None):
+    return _parse_route(await upstream.aget("osrm", _route_path(src, dst), params=_ROUTE_PARAMS, deadline=deadline))
+
+def get_route(src_lat, src_lon, dst_lat, dst_lon, deadline=None):
+    """
+    Cached route between two points: {"distance", "duration", "coordinates"},
+    or None when there is none (not cached, so it is retried next time).
+    """
+    src, dst = snap(src_lat, src_lon), snap(dst_lat, dst_lon)
+    return _decoded(caching.get_or_compute("osrm_route", _route_key(src, dst),
+                                           lambda: fetch_route(src, dst, deadline), wait=_wait(deadline),
+                                           refresh=lambda: fetch_route(src, dst, _renewed(deadline))))
+
+async def aget_route(src_lat, src_lon, dst_lat, dst_lon, deadline=None):
+    """get_route for async views."""
+    src, dst = snap(src_lat, src_lon), snap(dst_lat, dst_lon)
+    return _decoded(await caching.aget_or_compute("osrm_route", _route_key(src, dst),
+                                                  lambda: afetch_route(src, dst, deadline), wait=_wait(deadline),
+                                                  refresh=lambda: afetch_route(src, dst, _renewed(deadline))))
+
+def shape_geometry(coords, zoom=None, tolerance_km=None, precision=None, fmt="geojson"):
+    """
+    Route geometry for a response, as the fields to put in the route object.
+
+    zoom:         simplify so the line moves at most SIMPLIFY_PIXELS on a map at that zoom
+    tolerance_km: simplify with an explicit Douglas-Peucker tolerance instead
+    precision:    decimals to keep in geojson coordinates (5 ~ 1 m)
+    fmt:          "geojson" -> {"coordinates": [[lon, lat], ...]}
+                  "polyline"/"polyline6" -> {"polyline": str, "polyline_precision": 5|6}
+    """
+    if tolerance_km is None and zoom is not None and coords:
+        lat = sum(c[1] for c in coords) / len(coords)
+        tolerance_km = geo.zoom_tolerance_km(zoom, lat, SIMPLIFY_PIXELS)
+    if tolerance_km:
+        coords = geo.simplify(coords, tolerance_km)
+    if fmt in ("polyline", "polyline6"):
+        digits = 6 if fmt == "polyline6" else 5
+        return {"polyline": encode_polyline([(c[1], c[0]) for c in coords], digits), "polyline_precision": digits}
+    if precision is not None:
+        coords = [[round(c[0], precision), round(c[1], precision)] for c in coords]
+    return {"coordinates": coords}
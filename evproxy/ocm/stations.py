@@ -0,0 +1,369 @@
+"""
+Local station store.
+
+OCM POIs are normalized once at ingest (see `clean_ocm_item`) and kept in the
+Station table. Reads go through an in-memory grid index built from that
+table, so radius and corridor lookups don't need an upstream call.
+Load it with `python manage.py load_stations`.
+
+In memory, and in the view caches, a station is a StationRecord: a
+__slots__ object with its connections, verification dates and the derived
+fields views keep asking for worked out once: max_power_kw, each
+connector's kind, and what the ev_stations filters test (lowercase search
+text and status, a connector bitmask, sorted connection powers). Records are shared and never modified; views turn them into
+response dicts with to_dict() and add their own per-request fields there.
+"""
+import bisect
+import itertools
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Count, Max
+
+from .geo import haversine_km
+from .models import Station
+
+logger = logging.getLogger(__name__)
+
+CELL_DEG = 0.1  # grid cell size in degrees (~11 km north-south)
+INDEX_REFRESH_SECONDS = getattr(settings, "STATION_INDEX_REFRESH", 60)
+
+
+# (substring of the lowercased OCM connection title, kind); first match wins
+_CONNECTOR_KINDS = (
+    ("chademo", "chademo"),
+    ("gb-t", "gbt"),
+    ("gb/t", "gbt"),
+    ("tesla", "tesla"),
+    ("nacs", "tesla"),
+    ("type 2", "type2"),
+    ("type 1", "type1"),
+    ("j1772", "type1"),
+    ("bharat", "bharat"),
+    ("schuko", "domestic"),
+    ("bs1363", "domestic"),
+    ("3 pin", "domestic"),
+    ("iec 60309", "industrial"),
+    ("cee", "industrial"),
+)
+
+def connector_kind(title):
+    """Normalized connector family for an OCM connection title ("CCS (Type 2)" -> "ccs2")."""
+    if not title:
+        return None
+    t = title.lower()
+    if "ccs" in t:
+        return "ccs1" if "type 1" in t else "ccs2"
+    for needle, kind in _CONNECTOR_KINDS:
+        if needle in t:
+            return kind
+    return "other"
+
+
+class _Slotted:
+    # pickled as a plain tuple of values: the view caches store these, and
+    # slot-name dicts would make every entry larger than the dicts they replace
+    __slots__ = ()
+
+    def __getstate__(self):
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in zip(self.__slots__, state):
+            setattr(self, k, v)
+
+
+# Connector bitmask: every distinct lowercased connection title gets a bit the
+# first time this process sees it (OCM has a few dozen). Bits are per process,
+# so records recompute their mask when unpickled.
+_connector_bits = {}
+_bits_lock = threading.Lock()
+
+def _connector_bit(title):
+    bit = _connector_bits.get(title)
+    if bit is None:
+        with _bits_lock:
+            bit = _connector_bits.setdefault(title, 1 << len(_connector_bits))
+    return bit
+
+def connector_mask(connections):
+    mask = 0
+    for c in connections:
+        if c.type:
+            mask |= _connector_bit(c.type.lower())
+    return mask
+
+def connector_query_mask(tokens):
+    """
+    Bits of every connection title one of the lowercase `tokens` appears in
+    ("type 2" -> "Type 2 (Socket Only)", "CCS (Type 2)", ...) or whose
+    connector_kind it names ("ccs2").
+    """
+    mask = 0
+    for title, bit in list(_connector_bits.items()):
+        kind = connector_kind(title)
+        if any(t in title or t == kind for t in tokens):
+            mask |= bit
+    return mask
+
+
+class Connection(_Slotted):
+    __slots__ = ("type", "power_kw", "quantity", "level", "kind")
+
+    def __init__(self, type, power_kw, quantity, level):
+        self.type = type
+        self.power_kw = power_kw
+        self.quantity = quantity
+        self.level = level
+        self.kind = connector_kind(type)
+
+    def to_dict(self):
+        return {"type": self.type, "power_kw": self.power_kw, "quantity": self.quantity, "level": self.level}
+
+
+class StationRecord(_Slotted):
+    """One charging station, normalized. See the module docstring."""
+    __slots__ = ("id", "name", "address", "town", "lat", "lon", "status", "usage_cost", "connections",
+                 "num_points", "operator", "last_verified", "date_created", "date_last_status_update",
+                 "max_power_kw", "powers", "search_text", "status_key", "connector_mask")
+
+    def __init__(self, data, meta=None):
+        # data: a clean_ocm_item dict (the Station.data column); meta: ocm_item_meta
+        self.id = data.get("id")
+        self.name = data.get("name")
+        self.address = data.get("address")
+        self.town = data.get("town")
+        self.lat = data.get("lat")
+        self.lon = data.get("lon")
+        self.status = data.get("status")
+        self.usage_cost = data.get("usage_cost")
+        self.connections = tuple(Connection(c.get("type"), c.get("power_kw"), c.get("quantity"), c.get("level"))
+                                 for c in data.get("connections") or ())
+        self.num_points = data.get("num_points")
+        self.operator = data.get("operator")
+        meta = meta or {}
+        self.last_verified = meta.get("last_verified")
+        self.date_created = meta.get("date_created")
+        self.date_last_status_update = meta.get("date_last_status_update")
+        self.max_power_kw = max([c.power_kw or 0 for c in self.connections], default=0)
+        self.powers = tuple(sorted(c.power_kw for c in self.connections if c.power_kw is not None))
+        self.search_text = " ".join(filter(None, [self.name, self.address, self.town, self.operator])).lower()
+        self.status_key = (self.status or "").lower()
+        self.connector_mask = connector_mask(self.connections)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.connector_mask = connector_mask(self.connections)  # bits are per process
+
+    @classmethod
+    def from_ocm(cls, item):
+        """From a raw OCM POI."""
+        return cls(clean_ocm_item(item), ocm_item_meta(item))
+
+    def to_dict(self):
+        """The cleaned station dict the API returns (what clean_ocm_item gives)."""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "address": self.address,
+            "town": self.town,
+            "lat": self.lat,
+            "lon": self.lon,
+            "status": self.status,
+            "usage_cost": self.usage_cost,
+            "connections": [c.to_dict() for c in self.connections],
+            "num_points": self.num_points,
+            "operator": self.operator,
+        }
+
+    def has_power(self, lo=None, hi=None):
+        """Whether some connection's power lies in [lo, hi] (None leaves that end open)."""
+        i = 0 if lo is None else bisect.bisect_left(self.powers, lo)
+        return i < len(self.powers) and (hi is None or self.powers[i] <= hi)
+
+    def meta(self):
+        return {
+            "last_verified": self.last_verified,
+            "date_created": self.date_created,
+            "date_last_status_update": self.date_last_status_update,
+        }
+
+
+def clean_ocm_item(s):
+    a = s.get("AddressInfo") or {}
+    conns = s.get("Connections") or []
+    connections = [{
+        "type": (c.get("ConnectionType") or {}).get("Title"),
+        "power_kw": c.get("PowerKW"),
+        "quantity": c.get("Quantity"),
+        "level": (c.get("Level") or {}).get("Title"),
+    } for c in conns]
+    return {
+        "id": s.get("ID"),
+        "name": a.get("Title"),
+        "address": a.get("AddressLine1"),
+        "town": a.get("Town"),
+        "lat": a.get("Latitude"),
+        "lon": a.get("Longitude"),
+        "status": (s.get("StatusType") or {}).get("Title"),
+        "usage_cost": s.get("UsageCost"),
+        "connections": connections,
+        "num_points": s.get("NumberOfPoints"),
+        "operator": (s.get("OperatorInfo") or {}).get("Title"),
+    }
+
+def ocm_item_meta(s):
+    # verification dates plan_trip shows next to each station
+    return {
+        "last_verified": s.get("DateLastVerified"),
+        "date_created": s.get("DateCreated"),
+        "date_last_status_update": s.get("DateLastStatusUpdate"),
+    }
+
+def cell_of(lat, lon):
+    return math.floor(lat / CELL_DEG), math.floor(lon / CELL_DEG)
+
+
+def ingest(items, batch_size=1000):
+    """
+    Normalize raw OCM POIs and upsert them into the Station table.
+    Returns the number of stations written.
+    """
+    written = 0
+    batch = []
+
+    def flush():
+        Station.objects.bulk_create(
+            batch, batch_size=batch_size, update_conflicts=True, unique_fields=["ocm_id"],
+            update_fields=["lat", "lon", "cell_lat", "cell_lon", "data", "date_last_verified",
+                           "date_created", "date_last_status_update", "updated_at"],
+        )
+        batch.clear()
+
+    for it in items:
+        st = clean_ocm_item(it)
+        if not st["id"] or st["lat"] is None or st["lon"] is None:
+            continue
+        meta = ocm_item_meta(it)
+        ci, cj = cell_of(st["lat"], st["lon"])
+        batch.append(Station(
+            ocm_id=st["id"], lat=st["lat"], lon=st["lon"], cell_lat=ci, cell_lon=cj, data=st,
+            date_last_verified=meta["last_verified"],
+            date_created=meta["date_created"],
+            date_last_status_update=meta["date_last_status_update"],
+        ))
+        written += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    reset_index()
+    return written
+
+
+_generations = itertools.count()
+
+class StationIndex:
+    """Grid-bucketed stations: radius queries only touch the cells around the query point."""
+
+    def __init__(self, records=()):
+        self.generation = next(_generations)  # tells rebuilt indexes apart in caches
+        self.cells = {}
+        self.size = 0
+        for rec in records:
+            self.cells.setdefault(cell_of(rec.lat, rec.lon), []).append(rec)
+            self.size += 1
+
+    def nearby(self, lat, lon, radius_km, limit=None):
+        """(distance_km, record) for every station within radius_km, nearest first."""
+        dlat = radius_km / 111.0
+        dlon = radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+        i0, j0 = cell_of(lat - dlat, lon - dlon)
+        i1, j1 = cell_of(lat + dlat, lon + dlon)
+        hits = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for rec in self.cells.get((i, j), ()):
+                    if abs(rec.lat - lat) > dlat or abs(rec.lon - lon) > dlon:
+                        continue
+                    d = haversine_km((lat, lon), (rec.lat, rec.lon))
+                    if d <= radius_km:
+                        hits.append((d, rec))
+        hits.sort(key=lambda h: h[0])
+        return hits[:limit] if limit else hits
+
+    def in_box(self, south, west, north, east):
+        """Every station record inside the box."""
+        i0, j0 = cell_of(south, west)
+        i1, j1 = cell_of(north, east)
+        hits = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for rec in self.cells.get((i, j), ()):
+                    if south <= rec.lat <= north and west <= rec.lon <= east:
+                        hits.append(rec)
+        return hits
+
+
+_index = None
+_index_stamp = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+def get_index():
+    """The in-memory index, rebuilt when the Station table has changed (checked every INDEX_REFRESH_SECONDS)."""
+    global _index, _index_stamp, _checked_at
+    if _index is not None and time.monotonic() - _checked_at < INDEX_REFRESH_SECONDS:
+        return _index
+    with _lock:
+        if _index is not None and time.monotonic() - _checked_at < INDEX_REFRESH_SECONDS:
+            return _index
+        try:
+            agg = Station.objects.aggregate(n=Count("ocm_id"), ts=Max("updated_at"))
+            stamp = (agg["n"], agg["ts"])
+            if _index is None or stamp != _index_stamp:
+                rows = Station.objects.values_list(
+                    "data", "date_last_verified", "date_created", "date_last_status_update"
+                ).iterator()
+                _index = StationIndex(
+                    StationRecord(data, {"last_verified": v, "date_created": c, "date_last_status_update": u})
+                    for data, v, c, u in rows
+                )
+                _index_stamp = stamp
+        except DatabaseError as e:
+            # table missing (migrations not run) -> behave as an empty store
+            logger.warning("Station index unavailable: %s", e)
+            _index, _index_stamp = StationIndex(), None
+        _checked_at = time.monotonic()
+    return _index
+
+def reset_index():
+    global _checked_at
+    _checked_at = 0.0
+
+def fanout(points, radius_km, max_per_point):
+    """
+    Local stand-in for the per-point OCM fan-out.
+    Returns {station_id: record}, first hit wins walking points in order.
+    """
+    index = get_index()
+    merged = {}
+    for lat, lon in points:
+        for _, rec in index.nearby(lat, lon, radius_km, limit=max_per_point):
+            if rec.id not in merged:
+                merged[rec.id] = rec
+    return merged
+
+def box_fanout(boxes):
+    """Like fanout, for (south, west, north, east) boxes."""
+    index = get_index()
+    merged = {}
+    for box in boxes:
+        for rec in index.in_box(*box):
+            if rec.id not in merged:
+                merged[rec.id] = rec
+    return merged
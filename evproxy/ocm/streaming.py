@@ -0,0 +1,130 @@
+"""
+Streaming responses for the big payloads (route geometry plus station lists).
+
+    ?stream=json    one JSON document, the same as the non-streaming response,
+                    encoded incrementally: long lists go out in slices and
+                    generators are written as arrays while they are consumed
+    ?stream=ndjson  one JSON object per line, {"type": "route", ...} first, then
+                    {"type": "stations", ...} batches as the fan-out finds them
+    ?stream=sse     the same events as text/event-stream, for EventSource
+
+Without ?stream, an Accept header of application/x-ndjson or
+text/event-stream picks the matching event format.
+"""
+import logging
+from collections.abc import Iterator
+
+from django.http import StreamingHttpResponse
+
+from . import jsoncodec
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("json", "ndjson", "sse")
+CHUNK_ITEMS = 1000        # list items encoded per slice
+FLUSH_BYTES = 64 * 1024   # json mode: hand the server chunks of about this size
+
+
+def requested_format(request):
+    fmt = (request.GET.get("stream") or "").lower()
+    if fmt in FORMATS:
+        return fmt
+    if fmt in ("1", "true"):
+        return "json"
+    accept = request.headers.get("Accept", "")
+    if "text/event-stream" in accept:
+        return "sse"
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    return None
+
+
+_dumps = jsoncodec.dumps
+
+def _big(value):
+    # worth encoding piecewise: a generator, a long list, or something containing one
+    if isinstance(value, Iterator):
+        return True
+    if isinstance(value, dict):
+        return any(_big(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return len(value) > CHUNK_ITEMS or any(_big(v) for v in value)
+    return False
+
+def iter_json(value):
+    """
+    Encode `value` as JSON bytes in pieces. Plain data comes out exactly as
+    jsoncodec.dumps would write it; iterators are written as arrays.
+    """
+    item_sep, key_sep = jsoncodec.separators()
+    if not _big(value):
+        yield _dumps(value)
+    elif isinstance(value, dict):
+        sep = b"{"
+        for k, v in value.items():
+            yield sep + _dumps(str(k)) + key_sep
+            yield from iter_json(v)
+            sep = item_sep
+        yield b"}"
+    elif isinstance(value, Iterator):
+        sep = b"["
+        for item in value:
+            yield sep
+            yield from iter_json(item)
+            sep = item_sep
+        yield b"[]" if sep == b"[" else b"]"
+    elif any(_big(v) for v in value):
+        sep = b"["
+        for item in value:
+            yield sep
+            yield from iter_json(item)
+            sep = item_sep
+        yield b"]"
+    else:
+        # long flat list (route coordinates): slices, without the slice brackets
+        for start in range(0, len(value), CHUNK_ITEMS):
+            yield (b"[" if start == 0 else item_sep) + _dumps(value[start:start + CHUNK_ITEMS])[1:-1]
+        yield b"]"
+
+def _buffered(pieces, size=FLUSH_BYTES):
+    buf, n = [], 0
+    for piece in pieces:
+        buf.append(piece)
+        n += len(piece)
+        if n >= size:
+            yield b"".join(buf)
+            buf, n = [], 0
+    if buf:
+        yield b"".join(buf)
+
+
+def _ndjson(events):
+    for event in events:
+        yield b"".join(iter_json(event)) + b"\n"
+
+def _sse(events):
+    for event in events:
+        data = b"".join(iter_json(event))
+        yield f"event: {event.get('type', 'message')}\ndata: ".encode() + data + b"\n\n"
+
+def _guarded(events):
+    # an exception mid-stream can't change the status code any more; report it as an event
+    try:
+        yield from events
+    except Exception as e:
+        logger.exception("Streaming response failed: %s", e)
+        yield {"type": "error", "error": "stream failed", "detail": str(e)}
+
+
+def document_response(document):
+    """Stream one JSON document (dicts/lists, with generators where items arrive late)."""
+    return StreamingHttpResponse(_buffered(iter_json(document)), content_type="application/json")
+
+def events_response(fmt, events):
+    """Stream event dicts (each with a "type") as NDJSON lines or server-sent events."""
+    if fmt == "sse":
+        resp = StreamingHttpResponse(_sse(_guarded(events)), content_type="text/event-stream")
+        resp["Cache-Control"] = "no-cache"
+        resp["X-Accel-Buffering"] = "no"  # nginx: pass events through as they come
+        return resp
+    return StreamingHttpResponse(_ndjson(_guarded(events)), content_type="application/x-ndjson")
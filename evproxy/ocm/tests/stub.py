@@ -0,0 +1,34 @@
+"""Shared setup for the tests that talk to OCM/OSRM/Nominatim: a replay.StubServer."""
+from django.conf import settings
+from django.core.cache import cache
+from django.test.utils import override_settings
+
+from ocm import replay
+from ocm import upstream
+from ocm import views
+
+
+class StubbedUpstreams:
+    """Mixin pointing OCM/OSRM/Nominatim at a replay.StubServer for the whole test class."""
+    latency = 0.0
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = replay.StubServer(latency=cls.latency).start()
+        cls.addClassCleanup(cls.stub.stop)
+        overrides = override_settings(UPSTREAMS=cls.stub.upstreams(settings.UPSTREAMS))
+        overrides.enable()
+        cls.addClassCleanup(overrides.disable)
+        upstream.reset()
+        cls.addClassCleanup(upstream.reset)
+
+    def setUp(self):
+        cache.clear()
+        views._nearby_lru.clear()
+
+
+def route_params(src, dst):
+    return {"src_lat": src[0], "src_lon": src[1], "dst_lat": dst[0], "dst_lon": dst[1]}
+
+MUMBAI, PUNE = (19.076, 72.8777), (18.5204, 73.8567)
@@ -0,0 +1,58 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, RequestFactory, TestCase
+
+from ocm import async_views
+from ocm import views
+from ocm.tests.stub import MUMBAI, PUNE, StubbedUpstreams, route_params
+
+
+class AsyncViewTests(StubbedUpstreams, TestCase):
+    """The async views answer exactly what the sync ones do."""
+
+    async def _compare(self, name, params):
+        async_resp = await getattr(async_views, name)(AsyncRequestFactory().get("/", params))
+        await sync_to_async(cache.clear)()
+        views._nearby_lru.clear()
+        sync_resp = await sync_to_async(getattr(views, name))(RequestFactory().get("/", params))
+        self.assertEqual((async_resp.status_code, sync_resp.status_code), (200, 200))
+        self.assertEqual(json.loads(async_resp.content), json.loads(sync_resp.content))
+        return json.loads(async_resp.content)
+
+    async def test_ev_stations(self):
+        self.assertTrue(await self._compare("ev_stations", {"lat": MUMBAI[0], "lon": MUMBAI[1], "distance": 10}))
+
+    async def test_route_chargers(self):
+        for mode in ("samples", "corridor"):
+            body = await self._compare("route_chargers", {**route_params(MUMBAI, PUNE), "mode": mode})
+            self.assertTrue(body["stations"])
+
+    async def test_plan_trip(self):
+        body = await self._compare("plan_trip", {"from": "Mumbai", "to": "Pune", "vehicle_range": 100})
+        self.assertGreaterEqual(body["routes"][0]["charging_stops_count"], 1)
+
+    async def test_errors(self):
+        rf = AsyncRequestFactory()
+        resp = await async_views.route_chargers(rf.get("/", {**route_params(MUMBAI, PUNE), "mode": "teleport"}))
+        self.assertEqual(resp.status_code, 400)
+        resp = await async_views.plan_trip(rf.get("/", {"from": "Mumbai", "to": "Nowhere Special"}))
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual((await async_views.ev_stations(rf.get("/", {"lat": 19}))).status_code, 400)
+
+    async def test_methods(self):
+        rf = AsyncRequestFactory()
+        self.assertEqual((await async_views.route_chargers(rf.post("/"))).status_code, 405)
+        self.assertEqual((await async_views.plan_trip(rf.post("/"))).status_code, 405)
+        self.assertEqual((await async_views.plan_trips_batch(rf.get("/"))).status_code, 405)
+        self.assertEqual((await async_views.chatbot(rf.get("/"))).status_code, 405)
+        self.assertTrue(async_views.chatbot.csrf_exempt)
+        self.assertTrue(async_views.plan_trips_batch.csrf_exempt)
+
+    async def test_streamed_requests_go_to_the_sync_view(self):
+        resp = await async_views.route_chargers(AsyncRequestFactory().get(
+            "/", {**route_params(MUMBAI, PUNE), "stream": "ndjson"}))
+        self.assertTrue(resp.is_async)
+        lines = [json.loads(chunk) async for chunk in resp.streaming_content]
+        self.assertEqual((lines[0]["type"], lines[-1]["type"]), ("route", "done"))
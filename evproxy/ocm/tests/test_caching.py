@@ -0,0 +1,126 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from ocm import caching
+
+
+@override_settings(CACHE_LAYERS={"test": {"ttl": 60, "stale": 60}, "stale_test": {"ttl": 0, "stale": 60}})
+class CachingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _counter(self, value="v"):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return value
+        return compute, calls
+
+    def _eventually(self, check, timeout=5):
+        until = time.monotonic() + timeout
+        while not check():
+            if time.monotonic() > until:
+                self.fail("timed out")
+            time.sleep(0.01)
+
+    def test_computes_once(self):
+        compute, calls = self._counter()
+        self.assertEqual(caching.get_or_compute("test", "k", compute), "v")
+        self.assertEqual(caching.get_or_compute("test", "k", compute), "v")
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(cache.get("lock:k"))
+
+    def test_none_is_not_cached(self):
+        compute, calls = self._counter(None)
+        caching.get_or_compute("test", "k", compute)
+        caching.get_or_compute("test", "k", compute)
+        self.assertEqual(len(calls), 2)
+
+    def test_waits_for_the_lock_holder(self):
+        token = caching._lock("k")
+        compute, calls = self._counter("mine")
+        threading.Timer(0.1, lambda: caching._store("k", "theirs", caching.layer_config("test"))).start()
+        self.assertEqual(caching.get_or_compute("test", "k", compute, wait=5), "theirs")
+        self.assertEqual(calls, [])
+        caching._unlock("k", token)
+
+    def test_stuck_holder_is_not_waited_for_forever(self):
+        caching._lock("k")
+        compute, calls = self._counter()
+        self.assertEqual(caching.get_or_compute("test", "k", compute, wait=0.1), "v")
+        self.assertEqual(len(calls), 1)
+
+    def test_unlock_leaves_someone_elses_lock(self):
+        old = caching._lock("k")
+        cache.delete("lock:k")  # as if LOCK_TIMEOUT had passed
+        new = caching._lock("k")
+        caching._unlock("k", old)
+        self.assertEqual(cache.get("lock:k"), new)
+        caching._unlock("k", new)
+        self.assertIsNone(cache.get("lock:k"))
+
+    def test_stale_value_is_served_and_refreshed(self):
+        caching.put("stale_test", "k", "old")
+        compute, computed = self._counter("computed")
+        refresh, refreshed = self._counter("refreshed")
+        self.assertEqual(caching.get_or_compute("stale_test", "k", compute, refresh=refresh), "old")
+        self._eventually(lambda: cache.get("k")["v"] == "refreshed" and cache.get("lock:k") is None)
+        self.assertEqual((len(computed), len(refreshed)), (0, 1))
+
+    def test_failed_refresh_keeps_stale_value(self):
+        caching.put("stale_test", "k", "old")
+
+        def broken():
+            raise RuntimeError("upstream down")
+        with self.assertLogs("ocm.caching", "WARNING"):
+            self.assertEqual(caching.get_or_compute("stale_test", "k", broken), "old")
+            self._eventually(lambda: cache.get("lock:k") is None)
+        self.assertEqual(cache.get("k")["v"], "old")
+
+    def test_refresh_skips_locked_keys(self):
+        token = caching._lock("k")
+        compute, calls = self._counter()
+        self.assertFalse(caching.refresh("test", "k", compute))
+        caching._unlock("k", token)
+        self.assertTrue(caching.refresh("test", "k", compute))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(caching.peek("test", "k"), "v")
+
+
+class LRUTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        lru = caching.LRU(3, sizeof=lambda v: 1)
+        for key in "abc":
+            lru.put(key, key.upper())
+        lru.get("a")
+        lru.put("d", "D")
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual([lru.get(k) for k in "acd"], ["A", "C", "D"])
+        self.assertEqual(lru.nbytes, 3)
+
+    def test_byte_budget(self):
+        lru = caching.LRU(10, sizeof=len)
+        lru.put("a", "x" * 6)
+        lru.put("b", "x" * 6)
+        self.assertEqual((len(lru), lru.nbytes), (1, 6))
+        lru.put("big", "x" * 11)  # never fits: ignored
+        self.assertIsNone(lru.get("big"))
+        self.assertEqual(lru.get("b"), "x" * 6)
+
+    def test_replacing_a_key_frees_its_bytes(self):
+        lru = caching.LRU(10, sizeof=len)
+        lru.put("a", "xxxx")
+        lru.put("a", "xx")
+        self.assertEqual((len(lru), lru.nbytes), (1, 2))
+
+    def test_ttl(self):
+        lru = caching.LRU(10, sizeof=len, ttl=0.05)
+        lru.put("a", "x")
+        time.sleep(0.1)
+        self.assertIsNone(lru.get("a"))
+        self.assertEqual(lru.nbytes, 0)
@@ -0,0 +1,109 @@
+import random
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ocm import geo
+
+
+def _route(points):
+    # (lat, lon) points -> OSRM-style [lon, lat] coordinates
+    return [[lon, lat] for lat, lon in points]
+
+def _wiggly_route(n=60, seed=1):
+    r = random.Random(seed)
+    lat, lon, points = 18.5, 73.8, []
+    for _ in range(n):
+        points.append((lat, lon))
+        lat += r.uniform(0.005, 0.03)
+        lon += r.uniform(-0.02, 0.03)
+    return points
+
+
+class ProjectionTests(SimpleTestCase):
+    def _brute_projection(self, point, points):
+        # nearest of many points interpolated along each segment
+        best, best_km, walked = float("inf"), None, 0.0
+        for a, b in zip(points, points[1:]):
+            step = geo.haversine_km(a, b)
+            for k in range(201):
+                t = k / 200
+                d = geo.haversine_km(point, (a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t))
+                if d < best:
+                    best, best_km = d, walked + t * step
+            walked += step
+        return best, best_km
+
+    def _check_projection(self):
+        points = _wiggly_route(25, seed=3)
+        r = random.Random(5)
+        probes = [(lat + r.uniform(-0.1, 0.1), lon + r.uniform(-0.1, 0.1)) for lat, lon in points[::3]]
+        for probe, (d, km) in zip(probes, geo.project_to_route(probes, _route(points))):
+            bd, bkm = self._brute_projection(probe, points)
+            self.assertAlmostEqual(d, bd, delta=0.01 * bd + 0.05)
+            self.assertAlmostEqual(km, bkm, delta=0.5)
+
+    def test_project_to_route_matches_brute_force(self):
+        self._check_projection()
+
+    def test_project_to_route_without_numpy(self):
+        with mock.patch.object(geo, "np", None):
+            self._check_projection()
+
+    def test_project_to_route_degenerate(self):
+        self.assertEqual(geo.project_to_route([], [[73.8, 18.5]]), [])
+        self.assertEqual(geo.project_to_route([(18.5, 73.8)], []), [(None, None)])
+        (d, km), = geo.project_to_route([(18.6, 73.8)], [[73.8, 18.5]])
+        self.assertAlmostEqual(d, geo.haversine_km((18.6, 73.8), (18.5, 73.8)))
+        self.assertEqual(km, 0.0)
+
+    def test_cumulative_km(self):
+        points = _wiggly_route(40)
+        expected = [0.0]
+        for a, b in zip(points, points[1:]):
+            expected.append(expected[-1] + geo.haversine_km(a, b))
+        for numpy in (geo.np, None):
+            with mock.patch.object(geo, "np", numpy):
+                for km, e in zip(geo.cumulative_km(points), expected):
+                    self.assertAlmostEqual(km, e, places=6)
+
+
+class SampleAlongRouteTests(SimpleTestCase):
+    def _brute_samples(self, points, sample_km):
+        # walk every segment again for every sample
+        total = sum(geo.haversine_km(a, b) for a, b in zip(points, points[1:]))
+        out, pos = [], 0.0
+        while pos <= total:
+            walked = 0.0
+            for a, b in zip(points, points[1:]):
+                step = geo.haversine_km(a, b)
+                if walked + step >= pos:
+                    frac = 0 if step == 0 else (pos - walked) / step
+                    out.append(((a[0] + (b[0] - a[0]) * frac, a[1] + (b[1] - a[1]) * frac), pos))
+                    break
+                walked += step
+            pos += sample_km
+        return out + [(points[-1], total)]
+
+    def test_matches_brute_force(self):
+        points = _wiggly_route()
+        samples, kms = geo.sample_along_route(_route(points), sample_km=7)
+        expected = self._brute_samples(points, 7)
+        # the last regular sample may be merged into the final point
+        self.assertIn(len(samples), (len(expected), len(expected) - 1))
+        for (lat, lon), km, ((elat, elon), ekm) in zip(samples[:-1], kms[:-1], expected):
+            self.assertAlmostEqual(km, ekm, places=6)
+            self.assertLess(geo.haversine_km((lat, lon), (elat, elon)), 1e-3)
+        self.assertEqual(samples[-1], points[-1])
+        self.assertAlmostEqual(kms[-1], expected[-1][1], places=6)
+
+    def test_edge_cases(self):
+        self.assertEqual(geo.sample_along_route([]), ([], []))
+        self.assertEqual(geo.sample_along_route([[73.8, 18.5], [73.8, 18.5]]), ([(18.5, 73.8)], [0.0]))
+
+    def test_point_at_km(self):
+        samples, kms = geo.sample_along_route(_route(_wiggly_route()), sample_km=7)
+        self.assertEqual(geo.point_at_km(samples, kms, 0), samples[0])
+        self.assertEqual(geo.point_at_km(samples, kms, kms[-1] + 10), samples[-1])
+        mid = geo.point_at_km(samples, kms, (kms[1] + kms[2]) / 2)
+        self.assertAlmostEqual(mid[0], (samples[1][0] + samples[2][0]) / 2, places=6)
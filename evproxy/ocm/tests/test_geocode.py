@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from ocm import geocode
+from ocm import upstream
+from ocm.models import GeocodeResult
+from ocm.tests.stub import StubbedUpstreams
+
+
+class GazetteerTests(SimpleTestCase):
+    def _name(self, query):
+        place = geocode.GAZETTEER.match(geocode.normalize(query))
+        return place and place["name"]
+
+    def test_names_and_aliases(self):
+        self.assertEqual(self._name("Mumbai"), "Mumbai, Maharashtra, India")
+        self.assertEqual(self._name("bombay"), "Mumbai, Maharashtra, India")
+        self.assertEqual(self._name("Gurgaon, India"), "Gurugram, Haryana, India")
+
+    def test_place_named_inside_the_query(self):
+        self.assertEqual(self._name("Andheri East, Mumbai"), "Mumbai, Maharashtra, India")
+        self.assertEqual(self._name("Navi Mumbai, Maharashtra"), "Navi Mumbai, Maharashtra, India")
+
+    def test_prefix(self):
+        self.assertEqual(self._name("Bengal"), "Bengaluru, Karnataka, India")
+        self.assertIsNone(geocode.GAZETTEER.prefix("ben"))  # under MIN_PREFIX
+
+    def test_misspellings(self):
+        self.assertEqual(self._name("Hydrabad"), "Hyderabad, Telangana, India")
+        self.assertEqual(self._name("Bengaluuru"), "Bengaluru, Karnataka, India")
+        self.assertIsNone(self._name("Nowhere Special"))
+
+    def test_trigram_similarity_prefers_the_closer_name(self):
+        gazetteer = geocode.Gazetteer([
+            {"name": "Sangli", "state": "Maharashtra", "lat": "16.85", "lon": "74.58", "tier": "3"},
+            {"name": "Sangola", "state": "Maharashtra", "lat": "17.43", "lon": "75.19", "tier": "3"},
+        ])
+        self.assertEqual(gazetteer.fuzzy("sangole", 0.3)["name"], "Sangola, Maharashtra, India")
+        self.assertIsNone(gazetteer.fuzzy("nagpur", 0.3))
+
+
+class NominatimCacheTests(StubbedUpstreams, TestCase):
+    def _asks(self, city):
+        before = upstream.calls("nominatim")
+        place = geocode.lookup(city)
+        return place, upstream.calls("nominatim") - before
+
+    def test_gazetteer_hits_skip_nominatim(self):
+        place, asked = self._asks("Pune")
+        self.assertEqual((place["lat"], place["lon"]), (18.5204, 73.8567))
+        self.assertEqual(asked, 0)
+
+    def test_not_found_is_cached(self):
+        self.assertEqual(self._asks("Nowhere Special"), (None, 1))
+        self.assertFalse(GeocodeResult.objects.get(query="nowhere special").found)
+        self.assertEqual(self._asks("nowhere  special!"), (None, 0))
+
+    def test_negative_entries_expire_first(self):
+        geocode._remember("atlantis", None)
+        geocode._remember("lemuria", {"name": "Lemuria, India", "lat": 10.0, "lon": 80.0})
+        old = timezone.now() - timedelta(seconds=geocode.NEGATIVE_TTL + 60)
+        GeocodeResult.objects.update(fetched_at=old)
+        self.assertEqual(self._asks("Lemuria"), ({"name": "Lemuria, India", "lat": 10.0, "lon": 80.0}, 0))
+        self.assertEqual(self._asks("Atlantis"), (None, 1))
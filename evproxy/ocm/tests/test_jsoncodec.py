@@ -0,0 +1,60 @@
+import datetime
+import decimal
+import json
+import unittest
+from unittest import mock
+
+from django.http import JsonResponse as DjangoJsonResponse
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from django.utils.translation import gettext_lazy
+
+from ocm import jsoncodec
+
+_DOC = {"when": datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc), "price": decimal.Decimal("12.50"),
+        "label": gettext_lazy("Operational"), "route": [[73.8567, 18.5204], [72.8777, 19.076]], "none": None}
+
+
+class CodecTests(SimpleTestCase):
+    def test_codecs_decode_each_others_output_alike(self):
+        decoded = [loads(dumps(_DOC)) for dumps, loads in jsoncodec.CODECS.values()]
+        for other in decoded[1:]:
+            self.assertEqual(other, decoded[0])
+        self.assertEqual(decoded[0]["when"], "2024-05-01T12:30:00Z")
+
+    def test_stdlib_codec_writes_what_django_did(self):
+        with mock.patch.object(jsoncodec, "_dumps", jsoncodec.CODECS["json"][0]):
+            self.assertEqual(jsoncodec.JsonResponse(_DOC).content, DjangoJsonResponse(_DOC).content)
+
+    def test_separators_match_the_codec(self):
+        item_sep, key_sep = jsoncodec.separators()
+        self.assertEqual(jsoncodec.dumps({"a": [1, 2]}), b"{\"a\"" + key_sep + b"[1" + item_sep + b"2]}")
+
+    def test_non_dict_needs_safe_false(self):
+        with self.assertRaises(TypeError):
+            jsoncodec.JsonResponse([1, 2])
+        self.assertEqual(json.loads(jsoncodec.JsonResponse([1, 2], safe=False).content), [1, 2])
+
+    @unittest.skipIf(jsoncodec.orjson is None, "orjson is not installed")
+    def test_orjson_hands_what_it_cannot_encode_to_the_stdlib(self):
+        dumps = jsoncodec.CODECS["orjson"][0]
+        self.assertEqual(json.loads(dumps({"id": 2**70})), {"id": 2**70})
+
+
+class ConfiguredCodecTests(SimpleTestCase):
+    def test_explicit_choice(self):
+        with override_settings(JSON_CODEC="json"):
+            self.assertEqual(jsoncodec._configured(), "json")
+
+    def test_auto_prefers_orjson(self):
+        with override_settings(JSON_CODEC="auto"):
+            self.assertEqual(jsoncodec._configured(), "orjson" if jsoncodec.orjson is not None else "json")
+
+    def test_unavailable_codec_falls_back_to_the_stdlib(self):
+        with override_settings(JSON_CODEC="orjson"), \
+                mock.patch.dict(jsoncodec.CODECS, {"json": jsoncodec.CODECS["json"]}, clear=True):
+            with self.assertLogs("ocm.jsoncodec", "WARNING") as logs:
+                self.assertEqual(jsoncodec._configured(), "json")
+            with override_settings(JSON_CODEC="auto"):
+                self.assertEqual(jsoncodec._configured(), "json")
+        self.assertIn("'orjson' is not available", logs.output[0])
@@ -0,0 +1,70 @@
+import re
+from unittest import mock
+
+from django.test import Client, SimpleTestCase, TestCase
+
+from ocm import metrics
+from ocm.tests.stub import MUMBAI, PUNE, StubbedUpstreams, route_params
+
+
+class RenderTests(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_histogram_buckets_are_cumulative(self):
+        labels = (("view", "plan_trip"),)
+        for seconds in (0.003, 0.03, 0.03, 60):
+            metrics._observe("evproxy_request_seconds", labels, seconds)
+        text = metrics.render()
+        self.assertIn('evproxy_request_seconds_bucket{view="plan_trip",le="0.005"} 1', text)
+        self.assertIn('evproxy_request_seconds_bucket{view="plan_trip",le="0.05"} 3', text)
+        self.assertIn('evproxy_request_seconds_bucket{view="plan_trip",le="30"} 3', text)
+        self.assertIn('evproxy_request_seconds_bucket{view="plan_trip",le="+Inf"} 4', text)
+        self.assertIn('evproxy_request_seconds_count{view="plan_trip"} 4', text)
+        self.assertIn('evproxy_request_seconds_sum{view="plan_trip"} 60.063000', text)
+
+    def test_label_values_are_escaped(self):
+        metrics._inc("evproxy_cache_requests_total", (("family", 'a"b\\c\nd'), ("result", "hit")))
+        self.assertIn('evproxy_cache_requests_total{family="a\\"b\\\\c\\nd",result="hit"} 1', metrics.render())
+
+
+class DisabledTests(StubbedUpstreams, TestCase):
+    def test_no_header_and_no_endpoint(self):
+        resp = self.client.get("/api/ev-stations/", {"lat": MUMBAI[0], "lon": MUMBAI[1]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("Server-Timing", resp.headers)
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+
+class EnabledTests(StubbedUpstreams, TestCase):
+    def setUp(self):
+        super().setUp()
+        enabled = mock.patch.object(metrics, "ENABLED", True)
+        enabled.start()
+        self.addCleanup(enabled.stop)
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.client = Client()  # loads MetricsMiddleware now that metrics are on
+
+    def test_server_timing(self):
+        resp = self.client.get("/api/route-chargers/", route_params(MUMBAI, PUNE))
+        self.assertEqual(resp.status_code, 200)
+        parts = dict(part.split(";", 1) for part in resp.headers["Server-Timing"].split(", "))
+        self.assertLessEqual({"route", "stations", "serialize", "upstream", "total"}, set(parts))
+        calls = int(re.search(r'desc="(\d+) calls"', parts["upstream"]).group(1))
+        self.assertGreater(calls, 1)  # the OSRM route and the OCM lookups
+
+        # a repeat is a cache hit: no upstream part
+        resp = self.client.get("/api/route-chargers/", route_params(MUMBAI, PUNE))
+        self.assertNotIn("upstream;", resp.headers["Server-Timing"])
+
+    def test_metrics_endpoint(self):
+        self.client.get("/api/route-chargers/", route_params(MUMBAI, PUNE))
+        self.client.get("/api/route-chargers/", route_params(MUMBAI, PUNE))
+        text = self.client.get("/metrics").content.decode()
+        self.assertIn('evproxy_request_seconds_count{view="route_chargers"} 2', text)
+        self.assertIn('evproxy_cache_requests_total{family="routechargers",result="hit"} 1', text)
+        self.assertRegex(text, r'evproxy_upstream_requests_total\{service="osrm",host="[^"]+",'
+                               r'view="route_chargers",status="200"\} 1')
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="10.0.0.7").status_code, 403)
@@ -0,0 +1,62 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ocm import optimizer
+from ocm.stations import StationRecord
+
+
+def _station(sid, power_kw=50, status="Operational"):
+    return StationRecord({"id": sid, "name": f"S{sid}", "lat": 0.0, "lon": 0.0, "status": status,
+                          "connections": [{"type": "CCS (Type 2)", "power_kw": power_kw, "quantity": 1}]})
+
+
+class OptimizerTests(SimpleTestCase):
+    RANGE_KM = 150
+
+    def _stations(self, distance_km, every_km):
+        return [(_station(i, power_kw=(50 if i % 2 else 22)), km, 1.0 + (i % 3))
+                for i, km in enumerate(range(every_km, int(distance_km), every_km))]
+
+    def _assert_feasible(self, plan, distance_km, start_soc):
+        self.assertIsNotNone(plan)
+        soc, km, detour = start_soc, 0.0, 0.0
+        for n, stop in enumerate(plan["stops"]):
+            self.assertGreater(stop["km_along"], km)
+            used = (stop["km_along"] - km + detour + stop["detour_km"]) / self.RANGE_KM
+            self.assertAlmostEqual(stop["arrive_soc"], soc - used, places=6)
+            reserve = min(optimizer.RESERVE_SOC, start_soc / 2) if n == 0 else optimizer.RESERVE_SOC
+            self.assertGreaterEqual(stop["arrive_soc"], reserve - 1e-9)
+            self.assertGreater(stop["leave_soc"], stop["arrive_soc"])
+            self.assertLessEqual(stop["leave_soc"], 1.0 + 1e-9)
+            soc, km, detour = stop["leave_soc"], stop["km_along"], stop["detour_km"]
+        last_reserve = optimizer.RESERVE_SOC if plan["stops"] else min(optimizer.RESERVE_SOC, start_soc / 2)
+        self.assertGreaterEqual(soc - (distance_km - km + detour) / self.RANGE_KM, last_reserve - 1e-9)
+        self.assertAlmostEqual(plan["total_minutes"], plan["drive_minutes"] + plan["charge_minutes"]
+                               + optimizer.STOP_OVERHEAD_MIN * len(plan["stops"]), places=6)
+
+    def test_long_trip_is_feasible(self):
+        stations = self._stations(600, 25)
+        plan = optimizer.plan_stops(stations, 600, 600 / 60 * 3600, self.RANGE_KM, 40, 0.8)
+        self._assert_feasible(plan, 600, 0.8)
+        self.assertGreaterEqual(len(plan["stops"]), 3)
+
+    def test_python_solver_agrees(self):
+        stations = self._stations(450, 20)
+        fast = optimizer.plan_stops(stations, 450, 450 / 60 * 3600, self.RANGE_KM, 40, 0.6)
+        with mock.patch.object(optimizer, "np", None):
+            slow = optimizer.plan_stops(stations, 450, 450 / 60 * 3600, self.RANGE_KM, 40, 0.6)
+        self._assert_feasible(slow, 450, 0.6)
+        self.assertAlmostEqual(fast["total_minutes"], slow["total_minutes"], places=4)
+
+    def test_no_stop_needed(self):
+        plan = optimizer.plan_stops(self._stations(100, 20), 100, 6000, self.RANGE_KM, 40, 0.9)
+        self.assertEqual(plan["stops"], [])
+
+    def test_gap_too_wide(self):
+        stations = [(_station(1), 50.0, 1.0), (_station(2), 400.0, 1.0)]
+        self.assertIsNone(optimizer.plan_stops(stations, 450, 27000, self.RANGE_KM, 40, 0.8))
+
+    def test_unusable_stations_are_skipped(self):
+        stations = [(_station(1, status="Planned"), 100.0, 1.0)]
+        self.assertIsNone(optimizer.plan_stops(stations, 200, 12000, self.RANGE_KM, 40, 0.8))
@@ -0,0 +1,121 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+
+from ocm import caching
+from ocm import prefetch
+from ocm import views
+from ocm.tests.stub import StubbedUpstreams
+
+
+class _CountsReset:
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        prefetch._pending.clear()
+        # no background flushes: hottest() flushes when the test asks
+        no_flush = mock.patch.object(prefetch, "_next_flush", float("inf"))
+        no_flush.start()
+        self.addCleanup(no_flush.stop)
+
+
+class RankingTests(_CountsReset, SimpleTestCase):
+    def test_hottest_first(self):
+        for layer, key, n in (("ocm_tile", "t1", 2), ("trip_corridor", "c1", 5), ("routechargers", "r1", 1)):
+            for _ in range(n):
+                prefetch.track(layer, key, (key,))
+        hottest = prefetch.hottest()
+        self.assertEqual([(e.key, e.args) for e in hottest], [("c1", ("c1",)), ("t1", ("t1",)), ("r1", ("r1",))])
+        for entry, score in zip(hottest, (5, 2, 1)):
+            self.assertAlmostEqual(entry.score, score, places=3)
+        self.assertEqual([e.key for e in prefetch.hottest(top=1)], ["c1"])
+
+    def test_counts_decay_and_merge(self):
+        prefetch.track("trip_corridor", "c1", ())
+        prefetch.track("trip_corridor", "c1", ())
+        prefetch.flush()
+        hot = cache.get(prefetch.HOT_KEY)
+        hot["at"] -= prefetch.HALF_LIFE  # as if flushed one half-life ago
+        cache.set(prefetch.HOT_KEY, hot, timeout=None)
+        prefetch.track("trip_corridor", "c1", ())
+        (entry,) = prefetch.hottest()
+        self.assertAlmostEqual(entry.score, 2 * 0.5 + 1, places=2)
+
+    def test_configured_corridors_both_ways(self):
+        with mock.patch.object(prefetch, "CORRIDORS", (("Mumbai", "Pune"),)):
+            self.assertEqual([e.args[:2] for e in prefetch.candidates()], [("Mumbai", "Pune"), ("Pune", "Mumbai")])
+
+
+class OcmBudgetTests(SimpleTestCase):
+    def setUp(self):
+        self.made = 0
+        calls = mock.patch.object(prefetch.upstream, "calls", lambda service: self.made)
+        calls.start()
+        self.addCleanup(calls.stop)
+
+    def test_waits_for_room_for_the_whole_refresh(self):
+        budget = prefetch.OcmBudget(per_minute=20)
+        self.made = 12  # user traffic this minute
+        soon = time.monotonic() + 0.5
+        self.assertTrue(budget.wait(soon, need=8))
+        self.assertFalse(budget.wait(soon, need=9))
+
+    def test_a_refresh_bigger_than_the_cap_needs_an_empty_minute(self):
+        budget = prefetch.OcmBudget(per_minute=10)
+        self.assertTrue(budget.wait(time.monotonic() + 0.5, need=50))
+        self.made = 1
+        self.assertFalse(budget.wait(time.monotonic() + 0.5, need=50))
+
+    def test_expected_calls_are_learnt(self):
+        budget = prefetch.OcmBudget(per_minute=10)
+        entry = prefetch.Entry("trip_corridor", "c1", (), 1.0)
+        self.assertEqual(budget.expected(entry), prefetch.EXPECTED_OCM_CALLS["trip_corridor"])
+        budget.spent(entry, 4)
+        self.assertEqual(budget.expected(entry), 4)
+
+
+@mock.patch.object(prefetch, "CORRIDORS", ())
+class WarmTests(_CountsReset, StubbedUpstreams, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.get("/api/plan-trip", {"from": "Mumbai", "to": "Pune"})
+        self.key = views._trip_corridor_key("Mumbai", "Pune", False)
+
+    def _warm(self, **kwargs):
+        kwargs.setdefault("budget", prefetch.OcmBudget(per_minute=1000))
+        counts = prefetch.warm(**kwargs)
+        return {name: n for name, n in counts.items() if n}
+
+    def test_only_due_entries_are_refreshed(self):
+        self.assertEqual(self._warm(), {"fresh": 1})
+        self.assertEqual(self._warm(ahead=2), {"refreshed": 1})  # inside the last 2 TTLs: always due
+        cache.delete(self.key)
+        self.assertEqual(self._warm(dry_run=True), {"due": 1})
+        self.assertEqual(self._warm(), {"refreshed": 1})
+        self.assertGreater(caching.fresh_for(self.key), 0)
+
+    def test_budget_charged_what_the_refresh_made(self):
+        budget = prefetch.OcmBudget(per_minute=1000)
+        cache.delete(self.key)
+        before = prefetch.upstream.calls("ocm")
+        self._warm(budget=budget)
+        (entry,) = prefetch.hottest()
+        self.assertEqual(budget.expected(entry), prefetch.upstream.calls("ocm") - before)
+        self.assertGreater(budget.expected(entry), 0)
+
+    def test_no_budget_left(self):
+        budget = prefetch.OcmBudget(per_minute=1000)
+        with mock.patch.object(budget, "wait", return_value=False):
+            self.assertEqual(self._warm(ahead=2, budget=budget), {"left": 1})
+
+    def test_degraded_refresh_keeps_the_cached_corridor(self):
+        before = cache.get(self.key)["fresh_until"]
+
+        def degraded(*args):
+            raise views._Degraded({}, ["2 of 10 station lookups failed"])
+        with mock.patch.object(prefetch, "_refresher", return_value=degraded), \
+                self.assertLogs("ocm.prefetch", "WARNING"):
+            self.assertEqual(self._warm(ahead=2), {"degraded": 1})
+        self.assertEqual(cache.get(self.key)["fresh_until"], before)
@@ -0,0 +1,75 @@
+import random
+
+from django.test import SimpleTestCase, TestCase
+
+from ocm import geo
+from ocm import routing
+from ocm.tests.stub import MUMBAI, PUNE, StubbedUpstreams, route_params
+
+
+class PolylineTests(SimpleTestCase):
+    def test_known_encoding(self):
+        # the example from Google's polyline documentation
+        points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        self.assertEqual(routing.encode_polyline(points, 5), "_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+        self.assertEqual(routing.decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@", 5),
+                         [[lon, lat] for lat, lon in points])
+
+    def test_round_trip(self):
+        r = random.Random(7)
+        points = [(r.uniform(-89, 89), r.uniform(-179, 179)) for _ in range(500)]
+        for precision in (5, 6):
+            decoded = routing.decode_polyline(routing.encode_polyline(points, precision), precision)
+            self.assertEqual(len(decoded), len(points))
+            for (lat, lon), (dlon, dlat) in zip(points, decoded):
+                self.assertAlmostEqual(lat, dlat, places=precision)
+                self.assertAlmostEqual(lon, dlon, places=precision)
+
+    def test_empty(self):
+        self.assertEqual(routing.encode_polyline([]), "")
+        self.assertEqual(routing.decode_polyline(""), [])
+
+
+class ShapeGeometryTests(SimpleTestCase):
+    def setUp(self):
+        r = random.Random(3)
+        lat, lon, self.coords = 18.5, 73.8, []
+        for _ in range(2000):
+            self.coords.append([lon, lat])
+            lat += r.uniform(0.0005, 0.001)
+            lon += r.uniform(-0.001, 0.0012)
+
+    def test_simplified_line_stays_within_tolerance(self):
+        shaped = routing.shape_geometry(self.coords, tolerance_km=0.2)["coordinates"]
+        self.assertLess(len(shaped), len(self.coords) / 4)
+        self.assertEqual((shaped[0], shaped[-1]), (self.coords[0], self.coords[-1]))
+        self.assertTrue(all(c in self.coords for c in shaped))
+        for d in geo.distance_to_route_km([(c[1], c[0]) for c in self.coords[::37]], shaped):
+            self.assertLess(d, 0.2 + 1e-6)
+
+    def test_lower_zoom_drops_more_points(self):
+        sizes = [len(routing.shape_geometry(self.coords, zoom=z)["coordinates"]) for z in (6, 10, 14)]
+        self.assertEqual(sizes, sorted(sizes))
+        self.assertLess(sizes[0], sizes[-1])
+
+    def test_polyline_and_precision(self):
+        shaped = routing.shape_geometry(self.coords, fmt="polyline6")
+        self.assertEqual(shaped["polyline_precision"], 6)
+        for (lon, lat), (dlon, dlat) in zip(self.coords, routing.decode_polyline(shaped["polyline"], 6)):
+            self.assertAlmostEqual(lat, dlat, places=5)
+            self.assertAlmostEqual(lon, dlon, places=5)
+        rounded = routing.shape_geometry(self.coords, precision=3)["coordinates"]
+        self.assertEqual(rounded[5], [round(self.coords[5][0], 3), round(self.coords[5][1], 3)])
+
+
+class RouteGeometryViewTests(StubbedUpstreams, TestCase):
+    def test_route_chargers_shapes_the_route_only_in_the_response(self):
+        params = route_params(MUMBAI, PUNE)
+        full = self.client.get("/api/route-chargers/", params).json()["route"]["coordinates"]
+        route = self.client.get("/api/route-chargers/", {**params, "geometry": "polyline", "zoom": 9}).json()["route"]
+        self.assertNotIn("coordinates", route)
+        decoded = routing.decode_polyline(route["polyline"], route["polyline_precision"])
+        self.assertLess(len(decoded), len(full))
+        self.assertAlmostEqual(decoded[-1][0], full[-1][0], places=5)
+        again = self.client.get("/api/route-chargers/", params).json()["route"]["coordinates"]
+        self.assertEqual(again, full)
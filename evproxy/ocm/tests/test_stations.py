@@ -0,0 +1,128 @@
+import json
+import pickle
+import random
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from ocm import geo
+from ocm import stations
+from ocm.models import Station
+
+
+def _poi(sid, lat, lon, title=None, connections=(("CCS (Type 2)", 50),)):
+    return {
+        "ID": sid,
+        "AddressInfo": {"Title": title or f"Station {sid}", "AddressLine1": "1 Main Road", "Town": "Pune",
+                        "Latitude": lat, "Longitude": lon},
+        "StatusType": {"Title": "Operational"},
+        "OperatorInfo": {"Title": "Tata Power"},
+        "Connections": [{"ConnectionType": {"Title": t}, "PowerKW": kw, "Quantity": 1} for t, kw in connections],
+        "NumberOfPoints": len(connections),
+        "DateLastVerified": "2024-01-02T00:00:00Z",
+    }
+
+def _scatter(n, seed=1):
+    r = random.Random(seed)
+    return [_poi(i, 18.5 + r.uniform(-0.5, 0.5), 73.8 + r.uniform(-0.5, 0.5)) for i in range(1, n + 1)]
+
+
+class StationIndexTests(TestCase):
+    def setUp(self):
+        self.records = [stations.StationRecord.from_ocm(p) for p in _scatter(300)]
+        self.index = stations.StationIndex(self.records)
+
+    def test_nearby_matches_brute_force(self):
+        for lat, lon, radius in ((18.5, 73.8, 5), (18.9, 74.2, 12), (18.0, 73.3, 30)):
+            hits = self.index.nearby(lat, lon, radius)
+            expected = sorted(r.id for r in self.records if geo.haversine_km((lat, lon), (r.lat, r.lon)) <= radius)
+            self.assertEqual(sorted(rec.id for _, rec in hits), expected)
+            self.assertEqual([d for d, _ in hits], sorted(d for d, _ in hits))
+
+    def test_nearby_limit_keeps_the_nearest(self):
+        every = self.index.nearby(18.5, 73.8, 30)
+        self.assertEqual(self.index.nearby(18.5, 73.8, 30, limit=5), every[:5])
+
+    def test_in_box(self):
+        box = (18.3, 73.6, 18.6, 74.0)
+        expected = {r.id for r in self.records if box[0] <= r.lat <= box[2] and box[1] <= r.lon <= box[3]}
+        self.assertEqual({r.id for r in self.index.in_box(*box)}, expected)
+
+    def test_record_matches_clean_ocm_item(self):
+        poi = _poi(7, 18.5, 73.8, connections=(("Type 2 (Socket Only)", 22), ("CCS (Type 2)", 60)))
+        rec = stations.StationRecord.from_ocm(poi)
+        self.assertEqual(rec.to_dict(), stations.clean_ocm_item(poi))
+        self.assertEqual(rec.meta()["last_verified"], "2024-01-02T00:00:00Z")
+        self.assertEqual(rec.max_power_kw, 60)
+
+
+class FilterKeyTests(SimpleTestCase):
+    TITLES = ("CCS (Type 2)", "Type 2 (Socket Only)", "CHAdeMO", "Type 1 (J1772)", "Bharat AC-001", "Tesla (Model S/X)")
+
+    def setUp(self):
+        r = random.Random(4)
+        self.records = [stations.StationRecord.from_ocm(_poi(i, 18.5, 73.8, connections=[
+            (r.choice(self.TITLES), r.choice((3.3, 7.4, 22, 50, 60, 150, None))) for _ in range(r.randint(0, 3))
+        ])) for i in range(200)]
+
+    def test_has_power_matches_brute_force(self):
+        for lo, hi in ((None, None), (22, None), (None, 22), (30, 60), (60, 30), (150, 150), (200, None)):
+            for rec in self.records:
+                expected = any(c.power_kw is not None and (lo is None or c.power_kw >= lo)
+                               and (hi is None or c.power_kw <= hi) for c in rec.connections)
+                self.assertEqual(rec.has_power(lo, hi), expected, (lo, hi, rec.powers))
+
+    def test_connector_mask_matches_title_search(self):
+        for tokens in (["type 2"], ["ccs2"], ["chademo", "type1"], ["tesla"], ["schuko"]):
+            bits = stations.connector_query_mask(tokens)
+            for rec in self.records:
+                expected = any(c.type and any(t in c.type.lower() or t == c.kind for t in tokens)
+                               for c in rec.connections)
+                self.assertEqual(bool(rec.connector_mask & bits), expected, (tokens, rec.connections))
+
+    def test_connector_kind(self):
+        self.assertEqual([stations.connector_kind(t) for t in self.TITLES],
+                         ["ccs2", "type2", "chademo", "type1", "bharat", "tesla"])
+        self.assertEqual(stations.connector_kind("CCS (Type 1)"), "ccs1")
+        self.assertIsNone(stations.connector_kind(None))
+
+    def test_pickled_records_recompute_their_mask(self):
+        rec = next(r for r in self.records if r.connections)
+        copy = pickle.loads(pickle.dumps(rec))
+        self.assertEqual(copy.to_dict(), rec.to_dict())
+        self.assertEqual((copy.powers, copy.search_text), (rec.powers, rec.search_text))
+        self.assertEqual(copy.connector_mask, rec.connector_mask)
+
+
+class IngestTests(TestCase):
+    def tearDown(self):
+        stations.reset_index()  # the index outlives the test's transaction
+
+    def test_ingest_upserts_and_skips_unplaced_pois(self):
+        unplaced = _poi(99, None, None)
+        self.assertEqual(stations.ingest(_scatter(20) + [unplaced]), 20)
+        self.assertEqual(stations.ingest([_poi(1, 18.5, 73.8, title="Renamed")]), 1)
+        self.assertEqual(Station.objects.count(), 20)
+        row = Station.objects.get(ocm_id=1)
+        self.assertEqual(row.data["name"], "Renamed")
+        self.assertEqual((row.cell_lat, row.cell_lon), stations.cell_of(18.5, 73.8))
+
+    def test_index_sees_ingested_stations(self):
+        self.assertEqual(stations.fanout([(18.5, 73.8)], 5, 10), {})
+        stations.ingest([_poi(1, 18.5, 73.8), _poi(2, 18.51, 73.81), _poi(3, 19.5, 73.8)])
+        self.assertEqual(sorted(stations.fanout([(18.5, 73.8)], 5, 10)), [1, 2])
+        self.assertEqual(sorted(stations.box_fanout([(19.4, 73.7, 19.6, 73.9)])), [3])
+
+    def test_load_stations_reads_json_arrays_and_ndjson(self):
+        pois = _scatter(6)
+        with tempfile.TemporaryDirectory() as tmp:
+            Path(tmp, "array.json").write_text(json.dumps(pois[:3]))
+            Path(tmp, "lines.ndjson").write_text("\n".join(json.dumps(p) for p in pois[3:]) + "\n")
+            out = StringIO()
+            call_command("load_stations", "--file", str(Path(tmp, "array.json")),
+                         "--file", str(Path(tmp, "lines.ndjson")), stdout=out)
+        self.assertIn("Loaded 6 stations", out.getvalue())
+        self.assertEqual(sorted(Station.objects.values_list("ocm_id", flat=True)), [1, 2, 3, 4, 5, 6])
@@ -0,0 +1,87 @@
+import json
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from ocm import jsoncodec
+from ocm import streaming
+from ocm.tests.stub import MUMBAI, PUNE, StubbedUpstreams, route_params
+
+
+def _body(resp):
+    return b"".join(resp.streaming_content)
+
+def _ndjson(resp):
+    return [json.loads(line) for line in _body(resp).splitlines() if line.strip()]
+
+def _sse(resp):
+    events = []
+    for block in _body(resp).decode().split("\n\n"):
+        if block.strip():
+            name, data = block.split("\n", 1)
+            events.append((name.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+class IterJsonTests(SimpleTestCase):
+    document = {"route": {"coordinates": [[73.8 + i / 1000, 18.5] for i in range(25)]},
+                "stations": [{"id": i, "name": f"S{i}", "tags": list(range(i % 4))} for i in range(12)],
+                "meta": {"unicode": "₹ 12", "none": None, "flag": True}}
+
+    def test_same_bytes_as_dumps(self):
+        with mock.patch.object(streaming, "CHUNK_ITEMS", 5):
+            pieces = list(streaming.iter_json(self.document))
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual(b"".join(pieces), jsoncodec.dumps(self.document))
+
+    def test_iterators_become_arrays(self):
+        doc = {"a": iter([1, {"b": iter([])}]), "c": iter([])}
+        self.assertEqual(json.loads(b"".join(streaming.iter_json(doc))), {"a": [1, {"b": []}], "c": []})
+
+    def test_requested_format(self):
+        rf = RequestFactory()
+        self.assertEqual(streaming.requested_format(rf.get("/", {"stream": "NDJSON"})), "ndjson")
+        self.assertEqual(streaming.requested_format(rf.get("/", {"stream": "1"})), "json")
+        self.assertEqual(streaming.requested_format(rf.get("/", HTTP_ACCEPT="text/event-stream")), "sse")
+        self.assertEqual(streaming.requested_format(rf.get("/", HTTP_ACCEPT="application/x-ndjson")), "ndjson")
+        self.assertIsNone(streaming.requested_format(rf.get("/", {"stream": "xml"})))
+
+    def test_failure_mid_stream_is_an_event(self):
+        def events():
+            yield {"type": "route"}
+            raise RuntimeError("boom")
+        with self.assertLogs("ocm.streaming", "ERROR"):
+            out = _ndjson(streaming.events_response("ndjson", events()))
+        self.assertEqual(out[0], {"type": "route"})
+        self.assertEqual((out[1]["type"], out[1]["detail"]), ("error", "boom"))
+
+
+class StreamedViewTests(StubbedUpstreams, TestCase):
+    def _route_chargers(self, headers=None, **extra):
+        return self.client.get("/api/route-chargers/", {**route_params(MUMBAI, PUNE), **extra}, headers=headers)
+
+    def test_route_chargers_json_stream_matches_the_plain_response(self):
+        streamed = self._route_chargers(stream="json")
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(streamed["Content-Type"], "application/json")
+        self.assertEqual(json.loads(_body(streamed)), self._route_chargers().json())
+
+    def test_route_chargers_events(self):
+        plain = self._route_chargers().json()
+        for events in (_ndjson(self._route_chargers(stream="ndjson")),
+                       [data for _, data in _sse(self._route_chargers(stream="sse"))]):
+            self.assertEqual(events[0], {"type": "route", "coordinates": plain["route"]["coordinates"]})
+            found = [st["id"] for e in events if e["type"] == "stations" for st in e["stations"]]
+            self.assertEqual(sorted(found), sorted(st["id"] for st in plain["stations"]))
+            self.assertEqual(events[-1], {"type": "done", "count": len(found)})
+
+    def test_sse_event_names(self):
+        names = [name for name, _ in _sse(self._route_chargers(headers={"Accept": "text/event-stream"}))]
+        self.assertEqual((names[0], names[-1]), ("route", "done"))
+
+    def test_plan_trip_ndjson(self):
+        resp = self.client.get("/api/plan-trip", {"from": "Mumbai", "to": "Pune", "stream": "ndjson"})
+        self.assertEqual(resp.status_code, 200)
+        events = _ndjson(resp)
+        self.assertEqual(events[0]["type"], "route")
+        self.assertEqual(events[-1]["type"], "plan")
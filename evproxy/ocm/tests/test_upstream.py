@@ -0,0 +1,132 @@
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from ocm import upstream
+from ocm import views
+from ocm.tests.stub import StubbedUpstreams
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _answer(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        server = self.server
+        with server.lock:
+            server.hits += 1
+        if server.mode == "drop":
+            self.close_connection = True
+            return  # hang up without an answer: a read error for the client
+        self.send_response(server.status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    do_GET = do_POST = _answer
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RetryTests(SimpleTestCase):
+    """Which failures each kind of upstream retries."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        cls.server.lock = threading.Lock()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+        base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        overrides = override_settings(UPSTREAMS={
+            "reads": {"base_url": base, "retries": 2, "backoff": 0},
+            "billed": {"base_url": base, "retries": 2, "backoff": 0, "idempotent": False},
+        })
+        overrides.enable()
+        cls.addClassCleanup(overrides.disable)
+
+    def setUp(self):
+        upstream.reset()
+        self.addCleanup(upstream.reset)
+        self.server.hits, self.server.status, self.server.mode = 0, 503, "answer"
+
+    def _calls(self, fn):
+        for deadline in (None, upstream.Deadline(10)):
+            self.server.hits = 0
+            upstream.reset()
+            yield fn(deadline), self.server.hits
+
+    def test_reads_retry_error_statuses(self):
+        for resp, hits in self._calls(lambda d: upstream.get("reads", "/x", deadline=d)):
+            self.assertEqual((resp.status_code, hits), (503, 3))
+
+    def test_billed_posts_are_not_retried_on_error_statuses(self):
+        for resp, hits in self._calls(lambda d: upstream.post("billed", "/x", json={}, deadline=d)):
+            self.assertEqual((resp.status_code, hits), (503, 1))
+
+    def test_billed_posts_are_not_retried_after_a_read_error(self):
+        self.server.mode = "drop"
+
+        def post(deadline):
+            with self.assertRaises(requests.ConnectionError):
+                upstream.post("billed", "/x", json={}, deadline=deadline)
+        for _, hits in self._calls(post):
+            self.assertEqual(hits, 1)
+
+    def test_connect_errors_count_as_never_sent(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            closed = s.getsockname()[1]  # nothing listens here once the socket is closed
+        with self.assertRaises(requests.ConnectionError) as caught:
+            upstream.session("billed", retries=False).post(f"http://127.0.0.1:{closed}/x", timeout=5)
+        self.assertTrue(upstream._never_sent(caught.exception))
+        self.server.mode = "drop"
+        with self.assertRaises(requests.ConnectionError) as caught:
+            upstream.session("billed", retries=False).post(upstream.url("billed", "/x"), timeout=5)
+        self.assertFalse(upstream._never_sent(caught.exception))
+
+
+class CoalescingTests(StubbedUpstreams, SimpleTestCase):
+    latency = 0.3
+    params = {"latitude": 18.52, "longitude": 73.85, "distance": 5, "maxresults": 10}
+
+    def _get(self, results, index, **kwargs):
+        try:
+            results[index] = upstream.get("ocm", views.OCM_POI_PATH, params=self.params, **kwargs)
+        except Exception as e:
+            results[index] = e
+
+    def _run(self, callers):
+        results, threads = {}, []
+        for i, kwargs in enumerate(callers):
+            threads.append(threading.Thread(target=self._get, args=(results, i), kwargs=kwargs))
+            threads[-1].start()
+            time.sleep(0.05)  # the first one leads
+        for t in threads:
+            t.join()
+        return [results[i] for i in range(len(callers))]
+
+    def test_identical_gets_share_one_request(self):
+        before = self.stub.count("synthesized")
+        results = self._run([{}] * 4)
+        self.assertEqual(self.stub.count("synthesized") - before, 1)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertEqual(results[0].status_code, 200)
+
+    def test_leaders_own_deadline_is_not_shared(self):
+        before = self.stub.count("synthesized")
+        leader, follower = self._run([{"deadline": upstream.Deadline(0.1)}, {}])
+        self.assertIsInstance(leader, upstream.DeadlineExceeded)
+        self.assertEqual(follower.status_code, 200)
+        self.assertGreaterEqual(self.stub.count("synthesized") - before, 2)
+
+    def test_follower_gives_up_at_its_deadline(self):
+        leader, follower = self._run([{}, {"deadline": upstream.Deadline(0.1)}])
+        self.assertEqual(leader.status_code, 200)
+        self.assertIsInstance(follower, upstream.DeadlineExceeded)
@@ -0,0 +1,176 @@
+import json
+import math
+import random
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+
+from ocm import geo
+from ocm import replay
+from ocm import upstream
+from ocm import views
+from ocm.tests.stub import MUMBAI, PUNE, StubbedUpstreams, route_params
+
+
+def _events(resp):
+    return [json.loads(line) for line in b"".join(resp.streaming_content).splitlines() if line.strip()]
+
+
+class TileTests(StubbedUpstreams, SimpleTestCase):
+    def test_tiles_cover_the_query_circle(self):
+        r = random.Random(2)
+        for _ in range(50):
+            lat, lon, radius = r.uniform(8, 30), r.uniform(70, 90), r.choice((1, 3, 10, 25, 60))
+            level, tiles = views._tiles_around(lat, lon, radius)
+            deg = views.EV_TILE_DEGREES[level]
+            for bearing in range(0, 360, 15):
+                # a point on the circle, a little inside
+                dlat = 0.99 * radius / 111.0 * math.cos(math.radians(bearing))
+                dlon = 0.99 * radius / (111.0 * math.cos(math.radians(lat))) * math.sin(math.radians(bearing))
+                self.assertIn((math.floor((lat + dlat) / deg), math.floor((lon + dlon) / deg)), tiles)
+
+    def test_full_tile_is_stitched_from_its_children(self):
+        level, i, j = 2, math.floor(18.5 / 0.25), math.floor(73.8 / 0.25)
+        deg = views.EV_TILE_DEGREES[level]
+        box = {"boundingbox": f"({i * deg},{j * deg}),({(i + 1) * deg},{(j + 1) * deg})", "maxresults": 10000}
+        expected = sorted(st["ID"] for st in replay.synthetic_ocm(box))
+        self.assertGreater(len(expected), 4)
+        before = self.stub.count("synthesized")
+        with mock.patch.object(views, "EV_TILE_MAX_RESULTS", 4):
+            records = views._ocm_tile(level, i, j)
+        self.assertEqual(sorted(rec.id for rec in records), expected)
+        self.assertGreater(self.stub.count("synthesized") - before, 1)
+
+    def test_tile_children(self):
+        with mock.patch.object(views, "EV_TILE_MAX_RESULTS", 2):
+            self.assertEqual(views._tile_children(1, 3, 5, [{}, {}]), [(6, 10), (6, 11), (7, 10), (7, 11)])
+            self.assertIsNone(views._tile_children(1, 3, 5, [{}]))
+            self.assertIsNone(views._tile_children(0, 3, 5, [{}, {}]))  # finest level: keep what came back
+
+
+class EvStationsTests(StubbedUpstreams, TestCase):
+    def test_nearest_first_within_the_radius(self):
+        resp = self.client.get("/api/ev-stations/", {"lat": MUMBAI[0], "lon": MUMBAI[1], "distance": 10})
+        self.assertEqual(resp.status_code, 200)
+        stations = resp.json()
+        self.assertTrue(stations)
+        distances = [st["distance"] for st in stations]
+        self.assertEqual(distances, sorted(distances))
+        self.assertLessEqual(distances[-1], 10)
+        for st in stations:
+            self.assertAlmostEqual(geo.haversine_km(MUMBAI, (st["lat"], st["lon"])), st["distance"], delta=0.01)
+
+    def test_filters(self):
+        params = {"lat": MUMBAI[0], "lon": MUMBAI[1], "distance": 25, "maxresults": 300}
+        every = self.client.get("/api/ev-stations/", params).json()
+        filters = {"connectors": "chademo,type 1", "min_kw": 20, "status": "operational"}
+        filtered = self.client.get("/api/ev-stations/", {**params, **filters}).json()
+        expected = [st["id"] for st in every
+                    if any("chademo" in (c["type"] or "").lower() or "type 1" in (c["type"] or "").lower()
+                           for c in st["connections"])
+                    and any(c["power_kw"] is not None and c["power_kw"] >= 20 for c in st["connections"])
+                    and "operational" in (st["status"] or "").lower()]
+        self.assertTrue(expected)
+        self.assertEqual([st["id"] for st in filtered], expected)
+
+    def test_nearby_queries_share_tiles(self):
+        self.client.get("/api/ev-stations/", {"lat": MUMBAI[0], "lon": MUMBAI[1], "distance": 5})
+        before = self.stub.count("synthesized")
+        resp = self.client.get("/api/ev-stations/", {"lat": MUMBAI[0] + 0.001, "lon": MUMBAI[1], "distance": 5})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.stub.count("synthesized"), before)
+
+    def test_repeats_are_served_from_process_memory(self):
+        params = {"lat": MUMBAI[0], "lon": MUMBAI[1], "distance": 10}
+        every = self.client.get("/api/ev-stations/", params).json()
+        cache.clear()  # only the in-process LRU is left
+        before = self.stub.count("synthesized")
+        fewer = self.client.get("/api/ev-stations/", {**params, "maxresults": 5, "min_kw": 50}).json()
+        self.assertEqual(self.stub.count("synthesized"), before)
+        self.assertEqual(fewer, [st for st in every[:5] if any((c["power_kw"] or 0) >= 50 for c in st["connections"])])
+        self.assertEqual(len(views._nearby_lru), 1)
+
+    def test_bad_params(self):
+        self.assertEqual(self.client.get("/api/ev-stations/", {"lat": 19}).status_code, 400)
+        self.assertEqual(self.client.get("/api/ev-stations/", {"lat": "x", "lon": 72}).status_code, 400)
+
+
+class RouteChargersTests(StubbedUpstreams, TestCase):
+    def test_both_modes_find_stations(self):
+        for mode in ("samples", "corridor"):
+            resp = self.client.get("/api/route-chargers/", {**route_params(MUMBAI, PUNE), "mode": mode})
+            self.assertEqual(resp.status_code, 200)
+            body = resp.json()
+            self.assertGreater(len(body["route"]["coordinates"]), 2)
+            self.assertTrue(body["stations"])
+
+    def test_corridor_keeps_only_stations_within_the_radius(self):
+        resp = self.client.get("/api/route-chargers/", {**route_params(MUMBAI, PUNE), "mode": "corridor",
+                                                        "radius_km": 3})
+        distances = [st["_dist_to_route_km"] for st in resp.json()["stations"]]
+        self.assertTrue(distances)
+        self.assertLessEqual(max(distances), 3)
+        self.assertEqual(distances, sorted(distances))
+
+    def test_bad_params(self):
+        for bad in ({"src_lat": ""}, {"src_lat": "x"}, {"max_per_box": "abc"}, {"max_per_box": 0},
+                    {"sample_km": "-5"}, {"mode": "teleport"}, {"zoom": 40}):
+            resp = self.client.get("/api/route-chargers/", {**route_params(MUMBAI, PUNE), **bad})
+            self.assertEqual(resp.status_code, 400, bad)
+
+
+class PlanTripTests(StubbedUpstreams, TestCase):
+    def test_plans_stops_at_real_stations(self):
+        resp = self.client.get("/api/plan-trip", {"from": "Mumbai", "to": "Pune", "vehicle_range": 100,
+                                                  "current_battery": 50})
+        self.assertEqual(resp.status_code, 200)
+        body = resp.json()
+        self.assertTrue(body["success"])
+        self.assertNotIn("degraded", body)
+        route = body["routes"][0]
+        self.assertEqual(route["charging_plan"], "optimized")
+        self.assertGreaterEqual(route["charging_stops_count"], 1)
+        along = [stop["distance_from_start"] for stop in route["charging_stops"]]
+        self.assertEqual(along, sorted(along))
+        for stop in route["charging_stops"]:
+            self.assertIsNotNone(stop["station"]["id"])
+
+    def test_errors(self):
+        self.assertEqual(self.client.get("/api/plan-trip", {"from": "Mumbai"}).status_code, 400)
+        # not in the gazetteer, and the stub's Nominatim knows nothing
+        resp = self.client.get("/api/plan-trip", {"from": "Mumbai", "to": "Nowhere Special"})
+        self.assertEqual(resp.status_code, 400)
+
+
+class PlanTripsBatchTests(StubbedUpstreams, TestCase):
+    def _batch(self, trips):
+        return self.client.post("/api/plan-trips/batch", json.dumps({"trips": trips}),
+                                content_type="application/json")
+
+    def test_plan_trips_batch(self):
+        resp = self._batch([{"from": "Mumbai", "to": "Pune", "id": "a"}, {"from": "Mumbai", "to": "Pune"},
+                            {"from": "Mumbai"}])
+        self.assertEqual(resp.status_code, 200)
+        events = _events(resp)
+        trips = sorted((e for e in events if e["type"] == "trip"), key=lambda e: e["index"])
+        self.assertEqual([e["status"] for e in trips], [200, 200, 400])
+        self.assertEqual(trips[0]["id"], "a")
+        self.assertEqual(events[-1], {"type": "done", "trips": 3, "planned": 2, "failed": 1, "corridors": 1})
+
+    def test_plan_trips_batch_bad_body(self):
+        self.assertEqual(self._batch([]).status_code, 400)
+        resp = self.client.post("/api/plan-trips/batch", "{", content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_overlapping_batch_corridors_share_station_lookups(self):
+        def ocm_calls(trips):
+            cache.clear()
+            before = upstream.calls("ocm")
+            events = _events(self._batch(trips))
+            self.assertTrue(all(e["status"] == 200 for e in events if e["type"] == "trip"))
+            return upstream.calls("ocm") - before
+        pune = ocm_calls([{"from": "Mumbai", "to": "Pune"}])
+        nashik = ocm_calls([{"from": "Mumbai", "to": "Nashik"}])
+        both = ocm_calls([{"from": "Mumbai", "to": "Pune"}, {"from": "Mumbai", "to": "Nashik"}])
+        self.assertLess(both, pune + nashik)
@@ -0,0 +1,393 @@
+"""
+Shared HTTP client for the upstream APIs (OCM, OSRM, Nominatim, Gemini).
+
+One pooled `requests.Session` per service keeps TCP/TLS connections alive
+between requests, retries 429/5xx with exponential backoff and applies the
+service's default timeout. A service whose calls aren't safe to repeat
+("idempotent": False, e.g. Gemini, which bills and generates per POST) is
+only retried when the request never reached it: connect errors. Base URLs, pool sizes, retries and timeouts come
+from settings.UPSTREAMS, so everything can be pointed at a local stub server.
+
+    resp = upstream.get("osrm", "/route/v1/driving/72.87,19.07;73.85,18.52", params={...})
+
+The async views use aget/apost, with the same settings: a pooled
+httpx.AsyncClient per service and event loop when httpx is installed,
+otherwise the blocking client in a worker thread. Either way the response
+has .status_code, .content, .text and .raise_for_status().
+
+A view with a time budget passes a Deadline to all its calls; each call's
+timeout is cut to what is left, retries stop when it runs out, and calls
+made after that raise DeadlineExceeded:
+
+    deadline = upstream.Deadline(25)
+    resp = upstream.get("osrm", path, params={...}, deadline=deadline)
+
+Identical GETs (same URL and params) made while one is in flight don't go
+out again: they wait for that one and get the same response object, so it
+must be treated as read-only. That holds across threads and async views
+alike; UPSTREAM_COALESCE = False turns it off. A caller with a Deadline
+stops waiting when it runs out (DeadlineExceeded). When the request fails
+because of its maker's own Deadline, the waiters don't share that failure:
+each makes the request again under its own budget.
+"""
+import asyncio
+import copy
+import threading
+import time
+import weakref
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+
+from . import metrics
+
+try:
+    import httpx
+except ImportError:  # optional: async callers fall back to threads
+    httpx = None
+
+COALESCE = getattr(settings, "UPSTREAM_COALESCE", True)
+
+DEFAULTS = {
+    "timeout": 15,          # seconds, or (connect, read)
+    "retries": 2,
+    "backoff": 0.3,         # sleeps 0.3s, 0.6s, ... between retries
+    "retry_statuses": (429, 500, 502, 503, 504),
+    "pool_size": 10,
+    "headers": {},
+    "idempotent": True,     # False: only retry connect errors, never a request that got sent
+}
+
+_sessions = {}
+_lock = threading.Lock()
+_calls = {}  # service -> requests made by this process
+_calls_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before or during an upstream call."""
+
+
+class Deadline:
+    """Time budget shared by the upstream calls made for one request."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def renewed(self):
+        """A Deadline as long as this one, starting now: for work that outlives the request (a cache refresh)."""
+        return Deadline(self.seconds)
+
+    def reserve(self, seconds):
+        """A Deadline `seconds` earlier than this one, for a stage that must leave time for the next."""
+        early = copy.copy(self)
+        early.expires_at -= seconds
+        return early
+
+    def clamp(self, timeout):
+        """`timeout` (seconds, or (connect, read)) cut to the time left; DeadlineExceeded when none is."""
+        left = self.remaining()
+        if left <= 0:
+            raise DeadlineExceeded(f"the {self.seconds:g}s time budget is used up")
+        if isinstance(timeout, tuple):
+            return tuple(min(t, left) for t in timeout)
+        return min(timeout, left)
+
+
+def config(service):
+    try:
+        return {**DEFAULTS, **settings.UPSTREAMS[service]}
+    except KeyError:
+        raise ValueError(f"unknown upstream service: {service}")
+
+def url(service, path=""):
+    return config(service)["base_url"].rstrip("/") + path
+
+def session(service, retries=True):
+    # retries=False: a separate pool whose callers retry themselves (see request)
+    key = service if retries else (service, "no-retry")
+    s = _sessions.get(key)
+    if s is not None:
+        return s
+    with _lock:
+        if key not in _sessions:
+            cfg = config(service)
+            if not retries:
+                retry = Retry(total=0, raise_on_status=False)
+            elif cfg["idempotent"]:
+                retry = Retry(
+                    total=cfg["retries"],
+                    backoff_factor=cfg["backoff"],
+                    status_forcelist=cfg["retry_statuses"],
+                    allowed_methods=None,  # any method: these services only get reads
+                    respect_retry_after_header=False,
+                    raise_on_status=False,  # hand the last response back; callers check it
+                )
+            else:
+                # connect errors only: urllib3 retries those for any method, as nothing was sent;
+                # read errors and statuses are only retried for the methods allowed here
+                retry = Retry(
+                    total=cfg["retries"], connect=cfg["retries"], read=0, status=0, other=0,
+                    backoff_factor=cfg["backoff"],
+                    allowed_methods=frozenset({"GET"}),
+                    raise_on_status=False,
+                )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=cfg["pool_size"], max_retries=retry)
+            s = requests.Session()
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers.update(cfg["headers"])
+            _sessions[key] = s
+    return _sessions[key]
+
+def reset():
+    """Drop pooled sessions (after settings change, or in a forked worker)."""
+    with _lock:
+        for s in _sessions.values():
+            s.close()
+        _sessions.clear()
+
+
+def calls(service):
+    """How many requests this process has made to `service` so far (a retried request counts once)."""
+    return _calls.get(service, 0)
+
+def _count(service):
+    with _calls_lock:
+        _calls[service] = _calls.get(service, 0) + 1
+
+
+# -- coalescing: identical GETs in flight at the same time share one request --
+
+class _Abandoned(Exception):
+    """The request being shared was cancelled; whoever waited on it goes on its own."""
+
+_flights = {}  # key -> Future of the request being made for it
+_flights_lock = threading.Lock()
+
+def _flight_key(service, method, path, kwargs):
+    # plain GETs only: a body or custom headers could make the answer caller-specific
+    if not COALESCE or method.upper() != "GET" or set(kwargs) - {"params"}:
+        return None
+    params = kwargs.get("params") or ()
+    pairs = []
+    for k, v in (params.items() if isinstance(params, dict) else params):
+        for one in (v if isinstance(v, (list, tuple)) else (v,)):
+            pairs.append((str(k), str(one)))
+    return service, url(service, path), tuple(sorted(pairs))
+
+def _board(key):
+    """(flight, leader): the Future for `key`, and whether this caller has to make the request."""
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = _flights[key] = Future()
+        flight.set_running_or_notify_cancel()  # so a waiter giving up can't cancel it for the rest
+        return flight, True
+
+def _land(key, flight, resp=None, error=None):
+    if error is None:
+        flight.set_result(resp)
+    else:
+        flight.set_exception(error)
+    with _flights_lock:
+        _flights.pop(key, None)
+
+def _ran_out(error, deadline):
+    """
+    Whether the leader failed because of its own time budget: it ran out, or
+    a timeout that the deadline had cut short. Its followers may have more
+    time (or no deadline), so they retry on their own instead of sharing it.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return True
+    if deadline is None:
+        return False
+    timeouts = (requests.Timeout,) if httpx is None else (requests.Timeout, httpx.TimeoutException)
+    return isinstance(error, timeouts)
+
+def _follow(flight, service, deadline):
+    metrics.coalesced(service)
+    try:
+        return flight.result(timeout=deadline.remaining() if deadline is not None else None)
+    except FuturesTimeout:
+        raise DeadlineExceeded(f"{service}: the {deadline.seconds:g}s time budget is used up")
+
+
+def request(service, method, path="", timeout=None, deadline=None, **kwargs):
+    key = _flight_key(service, method, path, kwargs)
+    if key is None:
+        return _measured(service, method, path, timeout, deadline, **kwargs)
+    flight, leader = _board(key)
+    if not leader:
+        try:
+            return _follow(flight, service, deadline)
+        except _Abandoned:
+            return _measured(service, method, path, timeout, deadline, **kwargs)
+    try:
+        resp = _measured(service, method, path, timeout, deadline, **kwargs)
+    except Exception as e:
+        _land(key, flight, error=_Abandoned() if _ran_out(e, deadline) else e)
+        raise
+    except BaseException:
+        _land(key, flight, error=_Abandoned())
+        raise
+    _land(key, flight, resp)
+    return resp
+
+def _measured(service, method, path, timeout, deadline, **kwargs):
+    _count(service)
+    if not metrics.ENABLED:
+        return _request(service, method, path, timeout, deadline, **kwargs)
+    started, status = time.perf_counter(), "error"
+    try:
+        resp = _request(service, method, path, timeout, deadline, **kwargs)
+        status = resp.status_code
+        return resp
+    finally:
+        metrics.upstream_call(service, config(service)["base_url"], status, time.perf_counter() - started)
+
+def _never_sent(error):
+    # a connect error or connect timeout: the request didn't reach the service
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0] if error.args else None, "reason", None)
+    return isinstance(reason, NewConnectionError)
+
+def _request(service, method, path, timeout, deadline, **kwargs):
+    if timeout is None:
+        timeout = config(service)["timeout"]
+    if deadline is None:
+        return session(service).request(method, url(service, path), timeout=timeout, **kwargs)
+
+    # retried here rather than by the session, so no attempt or backoff outlives the deadline
+    cfg = config(service)
+    for attempt in range(cfg["retries"] + 1):
+        last = attempt == cfg["retries"]
+        try:
+            resp = session(service, retries=False).request(
+                method, url(service, path), timeout=deadline.clamp(timeout), **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if deadline.expired():
+                raise DeadlineExceeded(f"{service}: {e}") from e
+            if last or not (cfg["idempotent"] or _never_sent(e)):
+                raise
+        else:
+            if last or not cfg["idempotent"] or resp.status_code not in cfg["retry_statuses"]:
+                return resp
+        time.sleep(min(cfg["backoff"] * 2 ** attempt, deadline.remaining()))
+
+def get(service, path="", **kwargs):
+    return request(service, "GET", path, **kwargs)
+
+def post(service, path="", **kwargs):
+    return request(service, "POST", path, **kwargs)
+
+
+# -- async --
+
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> {service: httpx.AsyncClient}
+
+def _async_client(service):
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    if service not in clients:
+        cfg = config(service)
+        clients[service] = httpx.AsyncClient(
+            headers=cfg["headers"],
+            limits=httpx.Limits(max_connections=cfg["pool_size"], max_keepalive_connections=cfg["pool_size"]),
+        )
+    return clients[service]
+
+def _httpx_timeout(timeout):
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+async def _afollow(flight, service, deadline):
+    metrics.coalesced(service)
+    waiting = asyncio.wrap_future(flight)
+    if deadline is None:
+        return await waiting
+    try:
+        return await asyncio.wait_for(waiting, deadline.remaining())
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"{service}: the {deadline.seconds:g}s time budget is used up")
+
+async def arequest(service, method, path="", timeout=None, deadline=None, **kwargs):
+    # shares in-flight requests with the sync callers too: one table, thread-safe futures
+    key = _flight_key(service, method, path, kwargs)
+    if key is None:
+        return await _ameasured(service, method, path, timeout, deadline, **kwargs)
+    flight, leader = _board(key)
+    if not leader:
+        try:
+            return await _afollow(flight, service, deadline)
+        except _Abandoned:
+            return await _ameasured(service, method, path, timeout, deadline, **kwargs)
+    try:
+        resp = await _ameasured(service, method, path, timeout, deadline, **kwargs)
+    except Exception as e:
+        _land(key, flight, error=_Abandoned() if _ran_out(e, deadline) else e)
+        raise
+    except BaseException:  # cancelled, e.g. a fan-out straggler
+        _land(key, flight, error=_Abandoned())
+        raise
+    _land(key, flight, resp)
+    return resp
+
+async def _ameasured(service, method, path, timeout, deadline, **kwargs):
+    _count(service)
+    if not metrics.ENABLED:
+        return await _arequest(service, method, path, timeout, deadline, **kwargs)
+    started, status = time.perf_counter(), "error"
+    try:
+        resp = await _arequest(service, method, path, timeout, deadline, **kwargs)
+        status = resp.status_code
+        return resp
+    finally:
+        metrics.upstream_call(service, config(service)["base_url"], status, time.perf_counter() - started)
+
+async def _arequest(service, method, path, timeout, deadline, **kwargs):
+    if timeout is None:
+        timeout = config(service)["timeout"]
+    if httpx is None:
+        return await sync_to_async(_request, thread_sensitive=False)(
+            service, method, path, timeout, deadline, **kwargs)
+    cfg = config(service)
+    client = _async_client(service)
+    for attempt in range(cfg["retries"] + 1):
+        last = attempt == cfg["retries"]
+        try:
+            attempt_timeout = timeout if deadline is None else deadline.clamp(timeout)
+            resp = await client.request(method, url(service, path), timeout=_httpx_timeout(attempt_timeout), **kwargs)
+        except httpx.TransportError as e:
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded(f"{service}: {e}") from e
+            if last or not (cfg["idempotent"] or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))):
+                raise
+        else:
+            if last or not cfg["idempotent"] or resp.status_code not in cfg["retry_statuses"]:
+                return resp
+        pause = cfg["backoff"] * 2 ** attempt
+        await asyncio.sleep(pause if deadline is None else min(pause, deadline.remaining()))
+
+async def aget(service, path="", **kwargs):
+    return await arequest(service, "GET", path, **kwargs)
+
+async def apost(service, path="", **kwargs):
+    return await arequest(service, "POST", path, **kwargs)
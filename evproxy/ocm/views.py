@@ -1,15 +1,67 @@
-import requests, hashlib, json,math
+import hashlib, json,math
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 from django.conf import settings
-from django.http import JsonResponse
-from django.core.cache import cache
+from django.db import connections
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET, require_POST
 
-from django.views.decorators.cache import cache_page
 import datetime
 
-
-OSRM_URL = "https://router.project-osrm.org/route/v1/driving"
+from . import geo
+from . import geocode
+from . import jsoncodec
+from .jsoncodec import JsonResponse
+from . import metrics
+from . import optimizer
+from . import prefetch
+from . import routing
+from . import streaming
+from . import caching
+from . import upstream
+from . import stations as station_store
+
+logger = logging.getLogger(__name__)
+
+
+# upstream paths (hosts live in settings.UPSTREAMS)
+OCM_POI_PATH = "/v3/poi/"
+GEMINI_PATH = "/v1beta/models/gemini-1.5-flash:generateContent"
+
+# Per-sample OCM lookups run in a small thread pool; the deadline bounds the whole fan-out
+OCM_FANOUT_WORKERS = getattr(settings, "OCM_FANOUT_WORKERS", 6)
+OCM_FANOUT_DEADLINE = getattr(settings, "OCM_FANOUT_DEADLINE", 20)  # seconds
+
+# plan_trip's time budget across geocoding, routing and the station lookups;
+# the lookups stop PLAN_TRIP_RESERVE early so the plan still goes out in time
+PLAN_TRIP_DEADLINE = getattr(settings, "PLAN_TRIP_DEADLINE", 25)  # seconds
+PLAN_TRIP_RESERVE = 1.0
+
+# route_chargers corridor mode: largest per-box result cap a client may ask OCM for
+ROUTE_CHARGERS_MAX_PER_BOX = 5000
+
+# POST /api/plan-trips/batch: trips per request, and corridors computed at once
+PLAN_TRIPS_BATCH_MAX = getattr(settings, "PLAN_TRIPS_BATCH_MAX", 100)
+PLAN_TRIPS_BATCH_WORKERS = getattr(settings, "PLAN_TRIPS_BATCH_WORKERS", 4)
+
+# ev_stations reads whole grid tiles (sizes in degrees, each half the next) so
+# that nearby lookups share cache entries; a tile holding more than
+# EV_TILE_MAX_RESULTS stations is stitched together from its children instead
+EV_TILE_DEGREES = (0.0625, 0.125, 0.25, 0.5, 1.0)
+EV_TILE_MAX_RESULTS = getattr(settings, "EV_TILE_MAX_RESULTS", 1000)
+
+# ev_stations keeps the nearest stations per (source, point, radius) in
+# process, sorted by distance and up to EV_STATIONS_MAX_RESULTS long; a
+# repeat with other filters or a smaller maxresults is a filtered slice
+EV_STATIONS_MAX_RESULTS = 300
+_NEARBY_ENTRY_BYTES = 450  # per (distance, StationRecord) pair, measured
+_nearby_lru = caching.LRU(
+    getattr(settings, "EV_STATIONS_CACHE_BYTES", 32 * 1024 * 1024),
+    sizeof=lambda hits: 100 + len(hits) * _NEARBY_ENTRY_BYTES,
+    ttl=caching.layer_config("ocm_tile")["ttl"],  # no staler than the tiles it is built from
+    name="ev_stations_nearby",
+)
 
 # Realistic fuel costs (INR per liter)
 PETROL_PRICE_PER_LITER = 100.0
@@ -25,6 +77,7 @@ EV_RANGE_KM = 300  # km on full charge
 EV_BATTERY_CAPACITY = 50  # kWh
 CHARGING_COST_PER_KWH = 8.0  # INR per kWh
 FAST_CHARGING_TIME_MINUTES = 45  # minutes for 20-80% charge
+EV_MAX_CHARGE_KW = 50  # most DC power the car accepts
 
 
 def get_ev_fallback_response(user_message):
@@ -211,21 +264,90 @@ However, I can help you with EV-related questions! Here are some common topics I
 Please try asking about any of these specific topics, or try again in a few minutes!"""
 
 
+class _ViewError(Exception):
+    """Raised from a cached computation to short-circuit the view with an error response."""
+    def __init__(self, payload, status):
+        super().__init__(payload.get("error"))
+        self.payload = payload
+        self.status = status
+
+
+class _Degraded(Exception):
+    """
+    Raised from a cached computation that could only be partly done in time:
+    carries the partial value (which is therefore not cached) and why.
+    """
+    def __init__(self, value, reasons):
+        super().__init__("; ".join(reasons))
+        self.value = value
+        self.reasons = reasons
+
+def _mark_degraded(result, reasons):
+    # flags on a response built from partial data
+    result["degraded"] = True
+    result["degraded_reasons"] = reasons
+    return result
+
+
+def _geometry_options(request):
+    """
+    Route geometry params shared by route_chargers and plan_trip, or None when
+    none are given (full-detail [lon, lat] coordinates, as before):
+      zoom         -- simplify for a map at this zoom level
+      tolerance_km -- or simplify with an explicit tolerance
+      precision    -- decimals kept in the coordinates
+      geometry     -- "geojson" (default), "polyline" or "polyline6" (encoded string)
+    """
+    get = request.GET
+    if not any(get.get(k) for k in ("zoom", "tolerance_km", "precision", "geometry")):
+        return None
+    try:
+        zoom = float(get["zoom"]) if get.get("zoom") else None
+        tolerance_km = float(get["tolerance_km"]) if get.get("tolerance_km") else None
+        precision = int(get["precision"]) if get.get("precision") else None
+    except ValueError:
+        raise _ViewError({"error": "zoom, tolerance_km and precision must be numbers"}, 400)
+    if zoom is not None and not 0 <= zoom <= 22:
+        raise _ViewError({"error": "zoom must be between 0 and 22"}, 400)
+    if tolerance_km is not None and tolerance_km < 0:
+        raise _ViewError({"error": "tolerance_km must not be negative"}, 400)
+    if precision is not None and not 0 <= precision <= 6:
+        raise _ViewError({"error": "precision must be between 0 and 6"}, 400)
+    fmt = (get.get("geometry") or "geojson").lower()
+    if fmt not in routing.GEOMETRY_FORMATS:
+        raise _ViewError({"error": f"geometry must be one of {', '.join(routing.GEOMETRY_FORMATS)}"}, 400)
+    return {"zoom": zoom, "tolerance_km": tolerance_km, "precision": precision, "fmt": fmt}
+
+def _shaped(obj, geometry):
+    # obj with its "coordinates" swapped for the requested geometry, key order kept;
+    # cached values keep the full route, only responses are shaped
+    if geometry is None:
+        return obj
+    out = {}
+    for k, v in obj.items():
+        if k == "coordinates":
+            out.update(routing.shape_geometry(v, **geometry))
+        else:
+            out[k] = v
+    return out
+
+
 def _cache_key(name: str, params: dict) -> str:
     blob = json.dumps(params, sort_keys=True, separators=(",", ":"))
     return f"{name}:{hashlib.sha1(blob.encode()).hexdigest()}"
 
-def ev_stations(request):
+def _ev_stations_params(request):
+    """ev_stations query: point, radius, result cap and filters. Raises _ViewError."""
     # ---- read & validate params ----
     lat = request.GET.get("lat")
     lon = request.GET.get("lon")
     if not lat or not lon:
-        return JsonResponse({"error": "lat & lon are required"}, status=400)
+        raise _ViewError({"error": "lat & lon are required"}, 400)
 
     try:
-        float(lat); float(lon)
+        lat = float(lat); lon = float(lon)
     except ValueError:
-        return JsonResponse({"error": "lat/lon must be numbers"}, status=400)
+        raise _ViewError({"error": "lat/lon must be numbers"}, 400)
 
     distance = request.GET.get("distance", "10")
     maxresults = request.GET.get("maxresults", "150")  # allow more for clustering
@@ -239,105 +361,77 @@ def ev_stations(request):
     connectors = [c.strip().lower() for c in connectors_raw.split(",") if c.strip()]
     try:
         distance_km = max(1, min(50, int(float(distance))))
-        maxresults_int = max(1, min(300, int(maxresults)))
+        maxresults_int = max(1, min(EV_STATIONS_MAX_RESULTS, int(maxresults)))
         min_kw_val = float(min_kw) if min_kw not in (None, "",) else None
         max_kw_val = float(max_kw) if max_kw not in (None, "",) else None
     except ValueError:
-        return JsonResponse({"error": "Invalid number in filters"}, status=400)
+        raise _ViewError({"error": "Invalid number in filters"}, 400)
 
-    # ---- check cache first ----
-    upstream_params = {
-        "lat": lat, "lon": lon,
-        "distance": distance_km,
-        "maxresults": maxresults_int,
-    }
-    ck = _cache_key("ocm_upstream", upstream_params)
-    raw = cache.get(ck)
-
-    if not raw:
-        # ---- call OpenChargeMap (minimal but targeted) ----
-        url = (
-            "https://api.openchargemap.io/v3/poi/"
-            f"?output=json&latitude={lat}&longitude={lon}"
-            f"&distance={distance_km}&distanceunit=KM&maxresults={maxresults_int}"
-            f"&compact=true&verbose=false&key={settings.OCM_API_KEY}"
-        )
-        try:
-            raw = requests.get(url, timeout=15).json()
-        except Exception as e:
-            return JsonResponse({"error": "OCM request failed", "detail": str(e)}, status=502)
-        # cache upstream payload for 5 minutes
-        cache.set(ck, raw, timeout=300)
-
-    # ---- clean & shape ----
-    cleaned = []
-    for s in raw or []:
-        a = (s.get("AddressInfo") or {})
-        conns = (s.get("Connections") or [])
-        connections_clean = [{
-            "type": (c.get("ConnectionType") or {}).get("Title"),
-            "power_kw": c.get("PowerKW"),
-            "level": (c.get("Level") or {}).get("Title"),
-            "quantity": c.get("Quantity"),
-        } for c in conns]
-
-        cleaned.append({
-            "id": s.get("ID"),
-            "name": a.get("Title"),
-            "address": a.get("AddressLine1"),
-            "town": a.get("Town"),
-            "lat": a.get("Latitude"),
-            "lon": a.get("Longitude"),
-            "distance": a.get("Distance"),  # may exist when OCM returns it
-            "status": (s.get("StatusType") or {}).get("Title"),  # "Operational" etc.
-            "usage_cost": s.get("UsageCost"),
-            "connections": connections_clean,
-            "num_points": s.get("NumberOfPoints"),
-            "operator": (s.get("OperatorInfo") or {}).get("Title"),
-        })
+    return {"lat": lat, "lon": lon, "distance_km": distance_km, "maxresults": maxresults_int, "q": q,
+            "connectors": connectors, "min_kw": min_kw_val, "max_kw": max_kw_val, "status": status}
 
+def _ev_stations_filtered(nearest, p):
+    """Response body: the first p["maxresults"] of `nearest` ((distance, record), nearest first), filtered."""
     # ---- apply server-side filters (safe, no need to know OCM IDs) ----
+    # records carry lowercase text, a connector bitmask and sorted powers, so
+    # each test is a substring check, a mask AND or a bisect
+    q_key = p["q"].lower()
+    status_key = p["status"].lower()
+    connectors, min_kw_val, max_kw_val = p["connectors"], p["min_kw"], p["max_kw"]
+    # pass if ANY asked connector appears in ANY connection title (or names its kind)
+    connector_bits = station_store.connector_query_mask(connectors) if connectors else 0
+
     def match_text(st):
-        if not q:
-            return True
-        hay = " ".join(filter(None, [
-            st.get("name"), st.get("address"), st.get("town"), st.get("operator")
-        ])).lower()
-        return q.lower() in hay
+        return not q_key or q_key in st.search_text
 
     def match_connectors(st):
-        if not connectors:
-            return True
-        # accept synonyms: ccs -> 'ccs', 'type 2' -> 'type 2'
-        titles = [ (c.get("type") or "").lower() for c in (st.get("connections") or []) ]
-        # pass if ANY asked connector appears in ANY connection title
-        return any(any(conn in title for title in titles) for conn in connectors)
+        return not connectors or bool(st.connector_mask & connector_bits)
 
     def match_power(st):
         if min_kw_val is None and max_kw_val is None:
             return True
-        powers = [c.get("power_kw") for c in (st.get("connections") or []) if c.get("power_kw") is not None]
-        if not powers:
-            return False
-        if min_kw_val is not None and max_kw_val is not None:
-            return any(min_kw_val <= p <= max_kw_val for p in powers)
-        if min_kw_val is not None:
-            return any(p >= min_kw_val for p in powers)
-        if max_kw_val is not None:
-            return any(p <= max_kw_val for p in powers)
-        return True
+        return st.has_power(min_kw_val, max_kw_val)
 
     def match_status(st):
-        if not status:
-            return True
-        s = (st.get("status") or "").lower()
-        return status.lower() in s
+        return not status_key or status_key in st.status_key
+
+    filtered = [(d, st) for d, st in nearest[:p["maxresults"]]
+                if match_text(st) and match_connectors(st) and match_power(st) and match_status(st)]
+
+    # already nearest first; only now build the response dicts
+    return [{**st.to_dict(), "distance": d} for d, st in filtered]  # km from the query point
+
+def _nearby_key(p, index=None):
+    if index is not None:
+        return ("local", index.generation, p["lat"], p["lon"], p["distance_km"])
+    return ("upstream", p["lat"], p["lon"], p["distance_km"])
 
-    filtered = [st for st in cleaned if match_text(st) and match_connectors(st) and match_power(st) and match_status(st)]
+def ev_stations(request):
+    try:
+        p = _ev_stations_params(request)
+    except _ViewError as e:
+        return JsonResponse(e.payload, status=e.status)
+    lat, lon, distance_km = p["lat"], p["lon"], p["distance_km"]
+
+    # ---- nearest stations, (distance_km, record) pairs nearest first ----
+    if _use_local_stations(request):
+        # answer from the local station index
+        index = station_store.get_index()
+        key = _nearby_key(p, index)
+        compute = lambda: index.nearby(lat, lon, distance_km, limit=EV_STATIONS_MAX_RESULTS)
+    else:
+        # from the cached grid tiles around the point
+        key = _nearby_key(p)
+        compute = lambda: _stations_from_tiles(lat, lon, distance_km, EV_STATIONS_MAX_RESULTS)
+    try:
+        with metrics.stage("stations"):
+            nearest = _nearby_lru.get_or_compute(key, compute)
+    except Exception as e:
+        return JsonResponse({"error": "OCM request failed", "detail": str(e)}, status=502)
 
-    # sort by distance if present, otherwise keep as-is
-    filtered.sort(key=lambda st: (999999 if st.get("distance") in (None, "") else float(st["distance"])))
-    return JsonResponse(filtered, safe=False)
+    with metrics.stage("filter"):
+        body = _ev_stations_filtered(nearest, p)
+    return JsonResponse(body, safe=False)
 
 def get_stations(request):
     city = request.GET.get("city")
@@ -349,99 +443,203 @@ def get_stations(request):
     if city:
         params["address"] = city   # OCM supports city name
 
-    url = "https://api.openchargemap.io/v3/poi/"
-    response = requests.get(url, params=params)
-    return JsonResponse(response.json(), safe=False)
-
-
-def _haversine_km(a, b):
-    # a, b: (lat, lon)
-    R = 6371.0
-    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
-    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    h = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    return 2 * R * math.asin(math.sqrt(h))
-
-def _polyline_length_km(coords):
-    # coords: list of [lon, lat] (OSRM returns lon,lat)
-    total = 0.0
-    if not coords:
-        return 0.0
-    prev = (coords[0][1], coords[0][0])
-    for lon, lat in coords[1:]:
-        cur = (lat, lon)
-        total += _haversine_km(prev, cur)
-        prev = cur
-    return total
-
-def _sample_along_route(coords_lonlat, sample_km=20):
-    # coords_lonlat: list of [lon, lat]
-    # returns list of (lat, lon) sample points roughly every sample_km kilometers
-    if not coords_lonlat:
-        return []
-    # Build cumulative distances
-    pts = [(c[1], c[0]) for c in coords_lonlat]  # to (lat, lon)
-    cum = [0.0]
-    for i in range(1, len(pts)):
-        d = _haversine_km(pts[i-1], pts[i])
-        cum.append(cum[-1] + d)
-    total = cum[-1]
-    if total == 0:
-        return [pts[0]]
-    samples = []
-    k = sample_km
-    pos = 0.0
-    while pos <= total:
-        # find segment containing pos
-        for i in range(1, len(cum)):
-            if cum[i] >= pos:
-                # fraction along segment
-                seg_len = cum[i] - cum[i-1]
-                if seg_len == 0:
-                    frac = 0
-                else:
-                    frac = (pos - cum[i-1]) / seg_len
-                lat1, lon1 = pts[i-1]
-                lat2, lon2 = pts[i]
-                lat = lat1 + (lat2 - lat1) * frac
-                lon = lon1 + (lon2 - lon1) * frac
-                samples.append((lat, lon))
-                break
-        pos += k
-    # always include final point
-    samples.append(pts[-1])
-    # dedupe near duplicates
-    out = []
-    for p in samples:
-        if not out or _haversine_km(out[-1], p) > 0.5:  # 0.5 km tolerance
-            out.append(p)
-    return out
+    response = upstream.get("ocm", OCM_POI_PATH, params=params)
+    return JsonResponse(jsoncodec.loads(response.content), safe=False)
 
-def _clean_ocm_item(s):
-    a = s.get("AddressInfo") or {}
-    conns = s.get("Connections") or []
-    connections = [{
-        "type": (c.get("ConnectionType") or {}).get("Title"),
-        "power_kw": c.get("PowerKW"),
-        "quantity": c.get("Quantity"),
-        "level": (c.get("Level") or {}).get("Title"),
-    } for c in conns]
+
+def _ocm_params(extra):
+    # one OCM POI request's params; `extra` holds the search params
     return {
-        "id": s.get("ID"),
-        "name": a.get("Title"),
-        "address": a.get("AddressLine1"),
-        "town": a.get("Town"),
-        "lat": a.get("Latitude"),
-        "lon": a.get("Longitude"),
-        "status": (s.get("StatusType") or {}).get("Title"),
-        "usage_cost": s.get("UsageCost"),
-        "connections": connections,
-        "num_points": s.get("NumberOfPoints"),
-        "operator": (s.get("OperatorInfo") or {}).get("Title"),
+        "output": "json",
+        "compact": True,
+        "verbose": False,
+        "key": settings.OCM_API_KEY,
+        **extra,
+    }
+
+def _parse_ocm(resp):
+    resp.raise_for_status()
+    return jsoncodec.loads(resp.content) or []
+
+def _ocm_query(extra, timeout, deadline=None):
+    return _parse_ocm(upstream.get("ocm", OCM_POI_PATH, params=_ocm_params(extra), timeout=timeout,
+                                   deadline=deadline))
+
+def _fanout_wait(deadline):
+    return OCM_FANOUT_DEADLINE if deadline is None else min(OCM_FANOUT_DEADLINE, deadline.remaining())
+
+def _ocm_iter(param_sets, timeout, deadline=None, missed=None):
+    """
+    Run one OCM POI query per params dict, in parallel, and yield
+    (index, raw POIs) in input order as soon as a query and all the ones
+    before it are done, so callers can stream results as they arrive.
+    Queries that fail or don't finish before OCM_FANOUT_DEADLINE (or the
+    upstream.Deadline) come back empty, and their indexes go in `missed`.
+    """
+    if not param_sets:
+        return
+    pool = ThreadPoolExecutor(max_workers=max(1, min(OCM_FANOUT_WORKERS, len(param_sets))))
+    query = metrics.bind(_ocm_query)
+    futures = {pool.submit(query, extra, timeout, deadline): i for i, extra in enumerate(param_sets)}
+    done = {}
+    nxt = 0
+    try:
+        for fut in as_completed(futures, timeout=_fanout_wait(deadline)):
+            i = futures[fut]
+            try:
+                done[i] = fut.result()
+            except Exception as e:
+                logger.warning("Error fetching stations for %s: %s", param_sets[i], e)
+                done[i] = []
+                if missed is not None:
+                    missed.append(i)
+            while nxt in done:
+                yield nxt, done.pop(nxt)
+                nxt += 1
+    except FuturesTimeout:
+        # keep whatever finished in time, drop the stragglers
+        pass
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    while nxt < len(param_sets):
+        if nxt not in done and missed is not None:
+            missed.append(nxt)
+        yield nxt, done.pop(nxt, [])
+        nxt += 1
+
+def _fanout_params(points, radius_km, max_per_point):
+    # one radius query per (lat, lon) point
+    return [{
+        "latitude": lat,
+        "longitude": lon,
+        "distance": radius_km,
+        "distanceunit": "KM",
+        "maxresults": max_per_point,
+    } for lat, lon in points]
+
+def _corridor_params(boxes, max_per_box):
+    # one bounding-box query per (south, west, north, east) box
+    return [{
+        "boundingbox": f"({s},{w}),({n},{e})",
+        "maxresults": max_per_box,
+    } for s, w, n, e in boxes]
+
+
+def _tile_level(radius_km):
+    # smallest tile at least as wide as the query circle -> at most 2x2 tiles per query
+    need = 2 * radius_km / 111.0
+    for level, deg in enumerate(EV_TILE_DEGREES):
+        if deg >= need:
+            return level
+    return len(EV_TILE_DEGREES) - 1
+
+def _tile_query(level, i, j):
+    deg = EV_TILE_DEGREES[level]
+    return {
+        "boundingbox": f"({i * deg},{j * deg}),({(i + 1) * deg},{(j + 1) * deg})",
+        "maxresults": EV_TILE_MAX_RESULTS,
     }
 
+def _tile_key(level, i, j):
+    return f"ocm_tile:{EV_TILE_DEGREES[level]}:{i}:{j}"
+
+def _tile_children(level, i, j, items):
+    # a truncated tile is rebuilt from its four children at the next finer level
+    if len(items) >= EV_TILE_MAX_RESULTS and level > 0:
+        return [(ci, cj) for ci in (2 * i, 2 * i + 1) for cj in (2 * j, 2 * j + 1)]
+    return None
+
+def _tile_records(items):
+    records = (station_store.StationRecord.from_ocm(it) for it in items)
+    return [rec for rec in records if rec.lat is not None and rec.lon is not None]
+
+def _ocm_tile(level, i, j):
+    """
+    Station records inside grid tile (i, j) of the given level, cached per
+    tile: cleaned and filter-ready, so cache hits skip the OCM parsing.
+    Stations without coordinates are dropped.
+    """
+    key = _tile_key(level, i, j)
+    prefetch.track("ocm_tile", key, (level, i, j))
+    return caching.get_or_compute("ocm_tile", key, lambda: _ocm_tile_fetch(level, i, j))
+
+def _ocm_tile_fetch(level, i, j):
+    items = _ocm_query(_tile_query(level, i, j), timeout=15)
+    children = _tile_children(level, i, j, items)
+    if children:
+        return [rec for ci, cj in children for rec in _ocm_tile(level - 1, ci, cj)]
+    return _tile_records(items)
+
+def _tiles_around(lat, lon, radius_km):
+    """(level, [(i, j), ...]): the grid tiles covering radius_km around (lat, lon)."""
+    level = _tile_level(radius_km)
+    deg = EV_TILE_DEGREES[level]
+    dlat = radius_km / 111.0
+    dlon = radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+    tiles = [(i, j)
+             for i in range(math.floor((lat - dlat) / deg), math.floor((lat + dlat) / deg) + 1)
+             for j in range(math.floor((lon - dlon) / deg), math.floor((lon + dlon) / deg) + 1)]
+    return level, tiles
+
+def _nearest_in_tiles(tile_records, lat, lon, radius_km, limit):
+    hits = {}
+    for records in tile_records:
+        for rec in records:
+            d = geo.haversine_km((lat, lon), (rec.lat, rec.lon))
+            if d <= radius_km:
+                hits[rec.id or id(rec)] = (d, rec)
+    return sorted(hits.values(), key=lambda h: h[0])[:limit]
+
+def _stations_from_tiles(lat, lon, radius_km, limit):
+    """
+    Up to `limit` stations within radius_km of (lat, lon), nearest first, as
+    (distance_km, record) pairs. Answered from whole grid tiles so that
+    nearby queries share cache entries.
+    """
+    level, tiles = _tiles_around(lat, lon, radius_km)
+    with ThreadPoolExecutor(max_workers=max(1, min(OCM_FANOUT_WORKERS, len(tiles)))) as pool:
+        tile_records = list(pool.map(metrics.bind(lambda t: _ocm_tile(level, *t)), tiles))
+    return _nearest_in_tiles(tile_records, lat, lon, radius_km, limit)
+
+def _new_records(items, seen):
+    # records for the raw POIs whose ID isn't in `seen` yet (and note them);
+    # first occurrence wins, walking lookups in route order -> stable output
+    out = []
+    for it in items:
+        sid = it.get("ID")
+        if sid and sid not in seen:
+            seen.add(sid)
+            out.append(station_store.StationRecord.from_ocm(it))
+    return out
+
+def _use_local_stations(request):
+    # ?source=local|upstream overrides OCM_STATION_SOURCE; an empty local store falls back to OCM
+    return _use_local(request.GET.get("source"))
+
+def _use_local(source=None):
+    source = (source or getattr(settings, "OCM_STATION_SOURCE", "upstream")).lower()
+    return source == "local" and station_store.get_index().size > 0
+
+# plan_trip's view of a station: the shared record and where it sits relative to the route
+_TripStation = namedtuple("_TripStation", "station distance_from_route km_along score")
+
+def _trip_station(ts):
+    # plan_trip's response dict for a station, with a few extra fields
+    station = ts.station.to_dict()
+    station["real_data"] = True
+    station.update(ts.station.meta())
+    
+    # Enhanced connection details
+    for conn in station["connections"]:
+        if conn.get("power_kw"):
+            conn["charging_speed"] = "Fast" if conn["power_kw"] >= 50 else "Standard"
+        else:
+            conn["charging_speed"] = "Standard"
+    station["distance_from_route"] = ts.distance_from_route
+    station["km_along"] = ts.km_along
+    station["score"] = ts.score
+    return station
+
 @require_GET
 def route_chargers(request):
     """
@@ -450,116 +648,216 @@ def route_chargers(request):
       sample_km (default 25) -- distance between sampling points along route
       radius_km (default 5) -- search radius around each sample point
       max_per_sample (default 20)
+      mode (default ROUTE_CHARGERS_MODE) -- "samples": radius query per sample point,
+        "corridor": a few bounding-box queries covering the simplified route,
+        keeping stations within radius_km of it
+      max_per_box (default 500) -- corridor mode result cap per box
+      zoom, tolerance_km, precision, geometry -- route geometry detail (see _geometry_options)
     Returns:
       { route: { coords: [[lon,lat],...] }, stations: [ ... cleaned ... ] }
     """
+    try:
+        args = _route_chargers_args(request) + (_use_local_stations(request),)
+    except _ViewError as e:
+        return JsonResponse(e.payload, status=e.status)
+    cache_key = _route_chargers_key(*args)
+    prefetch.track("routechargers", cache_key, args)
+    try:
+        geometry = _geometry_options(request)
+        fmt = streaming.requested_format(request)
+        if fmt:
+            return _route_chargers_stream(fmt, cache_key, geometry, *args)
+        result = caching.get_or_compute("routechargers", cache_key, lambda: _route_chargers_result(*args))
+    except _ViewError as e:
+        return JsonResponse(e.payload, status=e.status)
+    return JsonResponse({"route": _shaped(result["route"], geometry),
+                         "stations": _route_station_dicts(result["stations"])}, safe=False)
+
+
+def _route_chargers_args(request):
+    """
+    route_chargers' params as (src_lat, src_lon, dst_lat, dst_lon, sample_km,
+    radius_km, max_per_sample, mode, max_per_box). Raises _ViewError.
+    """
     src_lat = request.GET.get("src_lat")
     src_lon = request.GET.get("src_lon")
     dst_lat = request.GET.get("dst_lat")
     dst_lon = request.GET.get("dst_lon")
 
     if not (src_lat and src_lon and dst_lat and dst_lon):
-        return JsonResponse({"error": "src_lat,src_lon,dst_lat,dst_lon required"}, status=400)
+        raise _ViewError({"error": "src_lat,src_lon,dst_lat,dst_lon required"}, 400)
 
     try:
         src_lat = float(src_lat); src_lon = float(src_lon)
         dst_lat = float(dst_lat); dst_lon = float(dst_lon)
     except ValueError:
-        return JsonResponse({"error": "invalid coordinates"}, status=400)
-
-    sample_km = float(request.GET.get("sample_km", 25))
-    radius_km = float(request.GET.get("radius_km", 5))
-    max_per_sample = int(request.GET.get("max_per_sample", 20))
+        raise _ViewError({"error": "invalid coordinates"}, 400)
 
+    try:
+        sample_km = float(request.GET.get("sample_km", 25))
+        radius_km = float(request.GET.get("radius_km", 5))
+        max_per_sample = int(request.GET.get("max_per_sample", 20))
+        max_per_box = int(request.GET.get("max_per_box", 500))
+    except ValueError:
+        raise _ViewError({"error": "sample_km, radius_km, max_per_sample and max_per_box must be numbers"}, 400)
+    if not (sample_km > 0 and radius_km > 0):
+        raise _ViewError({"error": "sample_km and radius_km must be positive"}, 400)
+    if max_per_sample < 1:
+        raise _ViewError({"error": "max_per_sample must be at least 1"}, 400)
+    if not 1 <= max_per_box <= ROUTE_CHARGERS_MAX_PER_BOX:
+        raise _ViewError({"error": f"max_per_box must be between 1 and {ROUTE_CHARGERS_MAX_PER_BOX}"}, 400)
+    mode = (request.GET.get("mode") or getattr(settings, "ROUTE_CHARGERS_MODE", "samples")).lower()
+    if mode not in ("samples", "corridor"):
+        raise _ViewError({"error": "mode must be samples or corridor"}, 400)
+
+    return src_lat, src_lon, dst_lat, dst_lon, sample_km, radius_km, max_per_sample, mode, max_per_box
+
+def _route_chargers_key(src_lat, src_lon, dst_lat, dst_lon, sample_km, radius_km, max_per_sample,
+                        mode, max_per_box, local):
     # cache key (route+params)
     key_blob = json.dumps({
         "src": [src_lat, src_lon],
         "dst": [dst_lat, dst_lon],
         "sample_km": sample_km,
         "radius_km": radius_km,
-        "max_per_sample": max_per_sample
+        "max_per_sample": max_per_sample,
+        "local": local,
+        "mode": mode,
+        "max_per_box": max_per_box if mode == "corridor" else None
     }, sort_keys=True)
-    cache_key = "routechargers:" + hashlib.sha1(key_blob.encode()).hexdigest()
-    cached = cache.get(cache_key)
-    if cached:
-        return JsonResponse(cached, safe=False)
-
-    # 1) Get route from OSRM
-    coords_param = f"{src_lon},{src_lat};{dst_lon},{dst_lat}"
-    osrm_url = f"{OSRM_URL}/{coords_param}?overview=full&geometries=geojson"
+    return "routechargers:" + hashlib.sha1(key_blob.encode()).hexdigest()
+
+def _route_coords_or_error(route):
+    if not route:
+        raise _ViewError({"error": "no route found"}, 404)
+    return route["coordinates"]  # [lon,lat]
+
+def _route_coords(src_lat, src_lon, dst_lat, dst_lon):
+    # 1) Get route from OSRM (cached per snapped endpoints)
     try:
-        r = requests.get(osrm_url, timeout=15)
-        r.raise_for_status()
-        osrm_data = r.json()
+        with metrics.stage("route"):
+            route = routing.get_route(src_lat, src_lon, dst_lat, dst_lon)
     except Exception as e:
-        return JsonResponse({"error": "OSRM error", "detail": str(e)}, status=502)
+        raise _ViewError({"error": "OSRM error", "detail": str(e)}, 502)
+    return _route_coords_or_error(route)
 
-    routes = osrm_data.get("routes")
-    if not routes:
-        return JsonResponse({"error": "no route found"}, status=404)
+def _route_station_lookups(coords, sample_km, radius_km, max_per_sample, mode, max_per_box, local):
+    """
+    The station lookups for a route: (local_batches, None) answered from the
+    local index right away, or (None, OCM param sets) to query upstream.
+    """
+    if mode == "corridor":
+        # 2) cover the simplified route with a handful of boxes; the simplified
+        #    line strays up to `tol` from the real one, so widen the boxes by that much
+        tol = min(radius_km / 4, 0.5)
+        boxes = geo.corridor_boxes(geo.simplify(coords, tol), radius_km + tol)
 
-    route_geo = routes[0].get("geometry")  # geojson LineString with coords [lon,lat]
-    coords = route_geo.get("coordinates") if route_geo else []
+        # 3) one OCM (or local index) query per box
+        if local:
+            return [list(station_store.box_fanout(boxes).values())], None
+        return None, _corridor_params(boxes, max_per_box)
 
     # 2) sample along route
-    samples = _sample_along_route(coords, sample_km=sample_km)
-
-    # 3) Query OCM around each sample point
-    found = {}
-    for lat, lon in samples:
-        params = {
-            "output": "json",
-            "latitude": lat,
-            "longitude": lon,
-            "distance": radius_km,
-            "distanceunit": "KM",
-            "maxresults": max_per_sample,
-            "compact": True,
-            "verbose": False,
-            "key": settings.OCM_API_KEY
-        }
-        try:
-            resp = requests.get("https://api.openchargemap.io/v3/poi/", params=params, timeout=10)
-            resp.raise_for_status()
-            items = resp.json() or []
-        except Exception:
-            items = []
-        for it in items:
-            sid = it.get("ID")
-            if not sid:
-                continue
-            if sid in found:
-                continue
-            found[sid] = _clean_ocm_item(it)
+    with metrics.stage("sample"):
+        samples, _ = geo.sample_along_route(coords, sample_km=sample_km)
 
-    # 4) compute distance from route for ranking
-    # We'll compute min distance from each station to any sample point (fast)
-    for sid, st in found.items():
-        best = 1e9
-        spt = (st.get("lat"), st.get("lon"))
-        if spt[0] is None or spt[1] is None:
-            best = None
-        else:
-            for sp in samples:
-                d = _haversine_km(spt, sp)
-                if d < best:
-                    best = d
-        st["_dist_to_route_km"] = best
+    # 3) Query OCM (or the local index) around each sample point
+    if local:
+        return [list(station_store.fanout(samples, radius_km, max_per_sample).values())], None
+    return None, _fanout_params(samples, radius_km, max_per_sample)
 
+def _place_route_stations(found, coords, mode, radius_km):
+    # 4) compute distance from route for ranking
+    # true distance to the route polyline, batched over the batch's stations
+    located = [i for i, st in enumerate(found) if st.lat is not None and st.lon is not None]
+    dists = [None] * len(found)
+    for i, d in zip(located, geo.distance_to_route_km([(found[i].lat, found[i].lon) for i in located], coords)):
+        dists[i] = d
+    pairs = list(zip(found, dists))
+    if mode == "corridor":
+        # boxes over-fetch around bends; keep only the real corridor
+        pairs = [(st, d) for st, d in pairs if d is not None and d <= radius_km]
+    return pairs
+
+def _route_station_batches(coords, sample_km, radius_km, max_per_sample, mode, max_per_box, local):
+    """
+    Stations along the route, one list per lookup as the lookups come back
+    (in query order): (record, km from the route or None) pairs,
+    deduplicated across batches.
+    """
+    batches, param_sets = _route_station_lookups(coords, sample_km, radius_km, max_per_sample, mode,
+                                                 max_per_box, local)
+    if batches is None:
+        seen = set()
+        batches = (_new_records(items, seen) for _, items in _ocm_iter(param_sets, timeout=10))
+
+    for found in batches:
+        pairs = _place_route_stations(found, coords, mode, radius_km)
+        if pairs:
+            yield pairs
+
+def _sort_route_stations(stations_list):
     # 5) sort stations: nearest to route, higher power first
-    stations_list = list(found.values())
-    def _max_power(st):
-        p = [c.get("power_kw") or 0 for c in st.get("connections", [])]
-        return max(p) if p else 0
-    stations_list.sort(key=lambda s: ((s["_dist_to_route_km"] if s["_dist_to_route_km"] is not None else 9999), -_max_power(s)))
-
+    stations_list.sort(key=lambda p: ((p[1] if p[1] is not None else 9999), -p[0].max_power_kw))
+    return stations_list
+
+def _route_station_dicts(stations_list):
+    # response shape: the cleaned station plus its distance to the route
+    return [{**st.to_dict(), "_dist_to_route_km": d} for st, d in stations_list]
+
+def _route_chargers_result(src_lat, src_lon, dst_lat, dst_lon, sample_km, radius_km, max_per_sample,
+                           mode, max_per_box, local):
+    coords = _route_coords(src_lat, src_lon, dst_lat, dst_lon)
+    batches = _route_station_batches(coords, sample_km, radius_km, max_per_sample, mode, max_per_box, local)
+    with metrics.stage("stations"):
+        stations_list = [st for batch in batches for st in batch]
+    return _route_chargers_assembled(coords, stations_list)
+
+def _route_chargers_assembled(coords, stations_list):
     result = {
         "route": {"coordinates": coords},  # lon,lat pairs
-        "stations": stations_list
+        "stations": _sort_route_stations(stations_list)  # (record, km from route); see _route_station_dicts
     }
 
-    cache.set(cache_key, result, timeout=60*10)  # cache 10 min
-    return JsonResponse(result, safe=False)
+    return result
+
+def _route_chargers_stream(fmt, cache_key, geometry, src_lat, src_lon, dst_lat, dst_lon, sample_km, radius_km,
+                           max_per_sample, mode, max_per_box, local):
+    """
+    Streamed route_chargers: the route goes out before the station lookups
+    finish. The assembled result is cached like the non-streaming one.
+    """
+    cached = caching.peek("routechargers", cache_key)
+    if cached is not None:
+        coords, batches = cached["route"]["coordinates"], [cached["stations"]]
+    else:
+        # route errors still get a proper status: nothing has been sent yet
+        coords = _route_coords(src_lat, src_lon, dst_lat, dst_lon)
+        batches = _route_station_batches(coords, sample_km, radius_km, max_per_sample, mode, max_per_box, local)
+
+    def collected():
+        stations_list = []
+        for batch in batches:
+            stations_list.extend(batch)
+            yield batch
+        if cached is None:
+            caching.put("routechargers", cache_key, _route_chargers_assembled(coords, stations_list))
+
+    if fmt == "json":
+        def sorted_stations():
+            stations_list = [st for batch in collected() for st in batch]
+            yield from _route_station_dicts(_sort_route_stations(stations_list))
+        return streaming.document_response({"route": _shaped({"coordinates": coords}, geometry),
+                                            "stations": sorted_stations()})
+
+    def events():
+        yield _shaped({"type": "route", "coordinates": coords}, geometry)
+        count = 0
+        for batch in collected():
+            count += len(batch)
+            yield {"type": "stations", "stations": _route_station_dicts(_sort_route_stations(list(batch)))}
+        yield {"type": "done", "count": count}
+    return streaming.events_response(fmt, events())
 
 
 @require_GET
@@ -570,7 +868,13 @@ def plan_trip(request):
       from_city, to_city
       vehicle_range (default 300) -- EV range in km
       current_battery (default 80) -- current battery percentage
+      zoom, tolerance_km, precision, geometry -- route geometry detail (see _geometry_options)
     Returns detailed trip plan with costs, charging stops, and environmental impact
+
+    The whole request gets PLAN_TRIP_DEADLINE seconds of upstream time. When
+    the station lookups run out of it, the plan is made from the stations
+    found so far and flagged "degraded" (with "degraded_reasons"); when
+    geocoding or the route run out of it, there is nothing to plan with: 504.
     """
     try:
         from_city = request.GET.get("from", "").strip()
@@ -582,368 +886,642 @@ def plan_trip(request):
         vehicle_range = float(request.GET.get("vehicle_range", EV_RANGE_KM))
         current_battery = float(request.GET.get("current_battery", 80))
         
-        # Cache key for this specific trip
-        cache_key = f"trip_plan:{hashlib.sha1(f'{from_city}:{to_city}:{vehicle_range}:{current_battery}'.encode()).hexdigest()}"
-        cached = cache.get(cache_key)
-        if cached:
-            return JsonResponse(cached, safe=False)
-        
-        # 1. Geocode cities using Nominatim with fallback coordinates
-        MAJOR_CITIES = {
-            'mumbai': {'name': 'Mumbai, Maharashtra, India', 'lat': 19.0760, 'lon': 72.8777},
-            'delhi': {'name': 'Delhi, India', 'lat': 28.7041, 'lon': 77.1025},
-            'bangalore': {'name': 'Bangalore, Karnataka, India', 'lat': 12.9716, 'lon': 77.5946},
-            'bengaluru': {'name': 'Bengaluru, Karnataka, India', 'lat': 12.9716, 'lon': 77.5946},
-            'chennai': {'name': 'Chennai, Tamil Nadu, India', 'lat': 13.0827, 'lon': 80.2707},
-            'kolkata': {'name': 'Kolkata, West Bengal, India', 'lat': 22.5726, 'lon': 88.3639},
-            'hyderabad': {'name': 'Hyderabad, Telangana, India', 'lat': 17.3850, 'lon': 78.4867},
-            'pune': {'name': 'Pune, Maharashtra, India', 'lat': 18.5204, 'lon': 73.8567},
-            'ahmedabad': {'name': 'Ahmedabad, Gujarat, India', 'lat': 23.0225, 'lon': 72.5714},
-            'jaipur': {'name': 'Jaipur, Rajasthan, India', 'lat': 26.9124, 'lon': 75.7873},
-            'surat': {'name': 'Surat, Gujarat, India', 'lat': 21.1702, 'lon': 72.8311},
-            'lucknow': {'name': 'Lucknow, Uttar Pradesh, India', 'lat': 26.8467, 'lon': 80.9462},
-            'kanpur': {'name': 'Kanpur, Uttar Pradesh, India', 'lat': 26.4499, 'lon': 80.3319},
-            'nagpur': {'name': 'Nagpur, Maharashtra, India', 'lat': 21.1458, 'lon': 79.0882},
-            'indore': {'name': 'Indore, Madhya Pradesh, India', 'lat': 22.7196, 'lon': 75.8577},
-            'thane': {'name': 'Thane, Maharashtra, India', 'lat': 19.2183, 'lon': 72.9781},
-            'bhopal': {'name': 'Bhopal, Madhya Pradesh, India', 'lat': 23.2599, 'lon': 77.4126},
-            'visakhapatnam': {'name': 'Visakhapatnam, Andhra Pradesh, India', 'lat': 17.6868, 'lon': 83.2185},
-            'patna': {'name': 'Patna, Bihar, India', 'lat': 25.5941, 'lon': 85.1376},
-            'vadodara': {'name': 'Vadodara, Gujarat, India', 'lat': 22.3072, 'lon': 73.1812}
-        }
-        
-        def geocode_city(city):
-            city_key = city.lower().strip()
-            
-            # First try our hardcoded major cities
-            if city_key in MAJOR_CITIES:
-                return MAJOR_CITIES[city_key]
-            
-            # Try to find partial matches
-            for key, data in MAJOR_CITIES.items():
-                if city_key in key or key in city_key:
-                    return data
-            
-            # If not found, try Nominatim API
-            timeouts = [10, 15]
-            for timeout in timeouts:
-                try:
-                    url = f"https://nominatim.openstreetmap.org/search?format=json&limit=1&q={requests.utils.quote(city + ' India')}"
-                    resp = requests.get(url, timeout=timeout, headers={"User-Agent": "EV-PATH/1.0"})
-                    resp.raise_for_status()
-                    data = resp.json()
-                    
-                    if data and len(data) > 0:
-                        result = {
-                            "name": data[0].get("display_name", city),
-                            "lat": float(data[0]["lat"]),
-                            "lon": float(data[0]["lon"])
-                        }
-                        return result
-                except Exception:
-                    continue
-            
-            return None
-        
-        source = geocode_city(from_city)
-        destination = geocode_city(to_city)
+        local = _use_local_stations(request)
+        geometry = _geometry_options(request)
         
-        if not source or not destination:
-            return JsonResponse({"error": "Could not geocode one or both cities"}, status=400)
-        
-        # 2. Get route from OSRM
-        coords_param = f"{source['lon']},{source['lat']};{destination['lon']},{destination['lat']}"
-        osrm_url = f"{OSRM_URL}/{coords_param}?overview=full&geometries=geojson&steps=true"
-        
-        osrm_resp = requests.get(osrm_url, timeout=15)
-        osrm_resp.raise_for_status()
-        osrm_data = osrm_resp.json()
-        
-        if not osrm_data.get("routes"):
-            return JsonResponse({"error": "No route found"}, status=404)
-        
-        route = osrm_data["routes"][0]
-        distance_km = route["distance"] / 1000  # Convert meters to km
-        duration_seconds = route["duration"]
-        duration_minutes = duration_seconds / 60
-        duration_hours = duration_minutes / 60
-        
-        # 3. Calculate costs
-        petrol_liters = distance_km / PETROL_KMPL
-        diesel_liters = distance_km / DIESEL_KMPL
-        
-        petrol_cost = petrol_liters * PETROL_PRICE_PER_LITER
-        diesel_cost = diesel_liters * DIESEL_PRICE_PER_LITER
-        ev_cost = distance_km * EV_COST_PER_KM
-        
-        # 4. Calculate charging requirements
-        current_range = (current_battery / 100) * vehicle_range
-        charging_stops = []
-        charging_stops_count = 0
-        total_charging_time = 0
-        
-        if distance_km > current_range:
-            # Need charging stops
-            remaining_distance = distance_km - current_range
-            stops_needed = math.ceil(remaining_distance / (vehicle_range * 0.6))  # Charge to 80% each time
-            charging_stops_count = stops_needed
-            
-            for i in range(stops_needed):
-                stop_distance = current_range + (i * vehicle_range * 0.6)
-                if stop_distance < distance_km:
-                    charging_stops.append({
-                        "stop_number": i + 1,
-                        "distance_from_start": round(stop_distance, 1),
-                        "remaining_distance": round(distance_km - stop_distance, 1),
-                        "estimated_charge_time": f"{FAST_CHARGING_TIME_MINUTES} minutes",
-                        "charge_cost_estimate": f"₹{round(EV_BATTERY_CAPACITY * 0.6 * CHARGING_COST_PER_KWH)}-{round(EV_BATTERY_CAPACITY * 0.8 * CHARGING_COST_PER_KWH)}",
-                        "battery_before": "20%",
-                        "battery_after": "80%"
-                    })
-            
-            total_charging_time = charging_stops_count * FAST_CHARGING_TIME_MINUTES
-        
-        # 5. Get comprehensive charging stations along route
-        coords = route["geometry"]["coordinates"]
-        samples = _sample_along_route(coords, sample_km=30)  # Sample every 30km for better coverage
+        # Geocoding, route and stations depend only on the city pair and are
+        # cached per pair; the vehicle-specific arithmetic is redone per request
+        cache_key = _trip_corridor_key(from_city, to_city, local)
+        prefetch.track("trip_corridor", cache_key, (from_city, to_city, local))
+        deadline = upstream.Deadline(PLAN_TRIP_DEADLINE)
+        fmt = streaming.requested_format(request)
+        if fmt in ("ndjson", "sse"):
+            return _plan_trip_stream(fmt, cache_key, from_city, to_city, local, vehicle_range, current_battery,
+                                     geometry, deadline)
+        degraded = None
+        try:
+            corridor = caching.get_or_compute("trip_corridor", cache_key, lambda: _trip_corridor(
+                from_city, to_city, local, deadline), wait=deadline.remaining(), refresh=lambda: _trip_corridor(
+                from_city, to_city, local, deadline.renewed()))
+        except _Degraded as e:
+            corridor, degraded = e.value, e.reasons
+        with metrics.stage("plan"):
+            result = _shaped_trip(_plan_trip_result(corridor, vehicle_range, current_battery), geometry)
+        if degraded:
+            _mark_degraded(result, degraded)
+        if fmt == "json":
+            return streaming.document_response(result)
+        return JsonResponse(result, safe=False)
         
-        # Get charging stations near route with enhanced data
-        found_stations = {}
-        for lat, lon in samples[:15]:  # Increased sample points for better coverage
-            params = {
-                "output": "json",
-                "latitude": lat,
-                "longitude": lon,
-                "distance": 15,  # 15km radius for better coverage
-                "distanceunit": "KM",
-                "maxresults": 20,  # More stations per sample point
-                "compact": True,
-                "verbose": False,
-                "key": settings.OCM_API_KEY
-            }
+    except _ViewError as e:
+        return JsonResponse(e.payload, status=e.status)
+    except upstream.DeadlineExceeded as e:
+        return JsonResponse(_trip_timed_out(e), status=504)
+    except Exception as e:
+        return JsonResponse({"error": "Trip planning failed", "detail": str(e)}, status=500)
+
+
+def _trip_timed_out(e):
+    return {"error": "Trip planning timed out", "detail": str(e), "degraded": True}
+
+def _trip_corridor_key(from_city, to_city, local):
+    pair = f"{geocode.normalize(from_city)}:{geocode.normalize(to_city)}:{local}"
+    return f"trip_corridor:{hashlib.sha1(pair.encode()).hexdigest()}"
+
+def _shaped_trip(result, geometry):
+    result["routes"] = [_shaped(route, geometry) for route in result["routes"]]
+    return result
+
+def _trip_places_or_error(source, destination):
+    if not source or not destination:
+        raise _ViewError({"error": "Could not geocode one or both cities"}, 400)
+
+def _trip_route(from_city, to_city, deadline=None):
+    """Places and route for a city pair (everything before the station lookups)."""
+    # 1. Geocode cities: bundled gazetteer, then cached Nominatim
+    with metrics.stage("geocode"):
+        source = geocode.lookup(from_city, deadline)
+        destination = geocode.lookup(to_city, deadline)
+    return _trip_between(source, destination, deadline)
+
+def _trip_between(source, destination, deadline=None):
+    """_trip_route for places geocoded already (None: not found)."""
+    _trip_places_or_error(source, destination)
+    
+    # 2. Get route from OSRM (cached per snapped endpoints)
+    with metrics.stage("route"):
+        route = routing.get_route(source["lat"], source["lon"], destination["lat"], destination["lon"], deadline)
+    return _trip_from_route(source, destination, route)
+
+def _trip_from_route(source, destination, route):
+    if not route:
+        raise _ViewError({"error": "No route found"}, 404)
+    
+    coords = route["coordinates"]
+    with metrics.stage("sample"):
+        samples, sample_kms = geo.sample_along_route(coords, sample_km=30)  # Sample every 30km for better coverage
+    
+    return {
+        "source": source,
+        "destination": destination,
+        "distance": route["distance"],  # meters
+        "duration": route["duration"],  # seconds
+        "coordinates": coords,
+        "samples": samples,
+        "sample_kms": sample_kms,
+    }
+
+def _trip_station_batches(trip, local, deadline=None, missed=None, tiles=False):
+    """
+    Stations along a _trip_route, one list per lookup in query order, as
+    _TripStations (placed relative to the route and scored).
+    Stations without coordinates are dropped. Lookups that fail or run past
+    the deadline (less PLAN_TRIP_RESERVE) are noted in `missed`. With
+    `tiles`, OCM is asked through the grid tile cache (see _trip_tile_lookups).
+    """
+    if local:
+        batches = [list(station_store.fanout(_trip_points(trip), 15, 20).values())]
+    else:
+        if deadline is not None:
+            deadline = deadline.reserve(PLAN_TRIP_RESERVE)
+        if tiles:
+            batches = _trip_tile_lookups(trip, deadline, missed)
+        else:
+            seen = set()
+            batches = (_new_records(items, seen)
+                       for _, items in _ocm_iter(_trip_params(trip), timeout=15, deadline=deadline, missed=missed))
+    
+    for found in batches:
+        placed = _place_trip_stations(found, trip["coordinates"])
+        if placed:
+            yield placed
+
+def _trip_tile_lookups(trip, deadline=None, missed=None):
+    """
+    The OCM lookups of _trip_station_batches answered from the ev_stations
+    grid tiles: the same 20 nearest stations within 15 km of each point, but
+    trips whose routes overlap (Mumbai->Pune and Mumbai->Nashik) share the
+    cached tiles, and so the OCM calls, for their common stretch. Yields the
+    new records per point; points with a tile missing go in `missed`.
+    """
+    points = _trip_points(trip)
+    covering = [_tiles_around(lat, lon, 15) for lat, lon in points]
+    wanted = list(dict.fromkeys((level, i, j) for level, tiles in covering for i, j in tiles))
+    pool = ThreadPoolExecutor(max_workers=max(1, min(OCM_FANOUT_WORKERS, len(wanted))))
+    futures = {pool.submit(metrics.bind(_ocm_tile), *tile): tile for tile in wanted}
+    fetched = {}
+    try:
+        for fut in as_completed(futures, timeout=_fanout_wait(deadline)):
             try:
-                resp = requests.get("https://api.openchargemap.io/v3/poi/", params=params, timeout=15)
-                resp.raise_for_status()
-                items = resp.json() or []
-                for item in items:
-                    station_id = item.get("ID")
-                    if station_id and station_id not in found_stations:
-                        # Enhanced station cleaning with more details
-                        station = _clean_ocm_item(item)
-                        
-                        # Add additional real data
-                        station["real_data"] = True
-                        station["last_verified"] = item.get("DateLastVerified")
-                        station["date_created"] = item.get("DateCreated")
-                        station["date_last_status_update"] = item.get("DateLastStatusUpdate")
-                        
-                        # Enhanced connection details
-                        if station.get("connections"):
-                            for conn in station["connections"]:
-                                if conn.get("power_kw"):
-                                    conn["charging_speed"] = "Fast" if conn["power_kw"] >= 50 else "Standard"
-                                else:
-                                    conn["charging_speed"] = "Standard"
-                        
-                        found_stations[station_id] = station
+                fetched[futures[fut]] = fut.result()
             except Exception as e:
-                print(f"Error fetching stations for {lat},{lon}: {e}")
-                continue
-        
-        # Add distance to route for each station
-        for station in found_stations.values():
-            if station.get("lat") and station.get("lon"):
-                try:
-                    min_dist = min([
-                        _haversine_km((station["lat"], station["lon"]), sample) 
-                        for sample in samples
-                    ])
-                    station["distance_from_route"] = round(min_dist, 1)
-                except (ValueError, TypeError):
-                    station["distance_from_route"] = 999  # Default high distance if calculation fails
-        
-        # Enhanced station filtering and sorting
-        def station_score(station):
-            """Calculate a score for station ranking based on multiple factors"""
-            score = 0
-            
-            # Distance from route (closer is better)
-            distance = station.get("distance_from_route", 999)
-            if distance is None:
-                distance = 999
-            if distance <= 2:
-                score += 100
-            elif distance <= 5:
-                score += 80
-            elif distance <= 10:
-                score += 60
-            else:
-                score += 40
-            
-            # Operational status (operational is better)
-            status = (station.get("status") or "").lower()
-            if "operational" in status:
-                score += 50
-            elif "planned" in status or "construction" in status:
-                score += 20
-            else:
-                score += 10
-            
-            # Power capacity (higher is better)
-            powers = [c.get("power_kw", 0) or 0 for c in station.get("connections", [])]
-            max_power = max(powers) if powers else 0
-            if max_power >= 100:
-                score += 40
-            elif max_power >= 50:
-                score += 30
-            elif max_power >= 22:
-                score += 20
-            else:
-                score += 10
-            
-            # Number of connections (more is better)
-            conn_count = len(station.get("connections", []))
-            score += min(conn_count * 5, 25)
-            
-            # Recent verification (more recent is better)
-            if station.get("last_verified"):
-                score += 15
-            
-            return score
-        
-        # Filter and sort stations
-        filtered_stations = []
-        for station in found_stations.values():
-            # Only include stations with valid coordinates
-            if station.get("lat") and station.get("lon"):
-                station["score"] = station_score(station)
-                filtered_stations.append(station)
-        
-        # Sort by score (highest first) and then by distance
-        def sort_key(station):
-            score = station.get("score", 0)
-            distance = station.get("distance_from_route", 999)
-            if distance is None:
-                distance = 999
-            return (-score, distance)
-        
-        stations_list = sorted(filtered_stations, key=sort_key)
-        
-        # 6. Environmental impact calculation
-        co2_per_km_petrol = 2.3  # kg CO2 per km for petrol car
-        co2_per_km_ev = 0.5  # kg CO2 per km for EV (considering electricity grid mix)
-        co2_saved = (co2_per_km_petrol - co2_per_km_ev) * distance_km
-        trees_equivalent = co2_saved / 22  # 1 tree absorbs ~22kg CO2 per year
+                logger.warning("Error fetching station tile %s: %s", futures[fut], e)
+    except FuturesTimeout:
+        pass
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    seen = set()
+    for index, ((lat, lon), (level, tiles)) in enumerate(zip(points, covering)):
+        available = [fetched[level, i, j] for i, j in tiles if (level, i, j) in fetched]
+        if len(available) < len(tiles) and missed is not None:
+            missed.append(index)
+        found = []
+        for _, rec in _nearest_in_tiles(available, lat, lon, 15, 20):
+            if (rec.id or id(rec)) not in seen:
+                seen.add(rec.id or id(rec))
+                found.append(rec)
+        yield found
+
+def _trip_points(trip):
+    samples = trip["samples"]
+    # 5. Get comprehensive charging stations along route
+    # Get charging stations near route with enhanced data
+    # (15km radius, 20 stations per sample point, at most 15 points spread
+    # over the whole route so the stop optimizer sees stations to the end)
+    return samples if len(samples) <= 15 else [samples[round(k * (len(samples) - 1) / 14)] for k in range(15)]
+
+def _trip_params(trip):
+    return _fanout_params(_trip_points(trip), 15, 20)
+
+def _place_trip_stations(found, coords):
+    # Only include stations with valid coordinates
+    located = [st for st in found if st.lat and st.lon]
+    # Add distance to route, and where along it each station sits
+    projected = geo.project_to_route([(st.lat, st.lon) for st in located], coords)
+    placed = []
+    for station, (d, km) in zip(located, projected):
+        distance = round(d, 1) if d is not None else 999
+        placed.append(_TripStation(station, distance, round(km, 1) if km is not None else None,
+                                   _trip_station_score(station, distance)))
+    return placed
+
+def _trip_station_score(station, distance):
+    """Calculate a score for station ranking based on multiple factors"""
+    score = 0
+    
+    # Distance from route (closer is better)
+    if distance <= 2:
+        score += 100
+    elif distance <= 5:
+        score += 80
+    elif distance <= 10:
+        score += 60
+    else:
+        score += 40
+    
+    # Operational status (operational is better)
+    status = (station.status or "").lower()
+    if "operational" in status:
+        score += 50
+    elif "planned" in status or "construction" in status:
+        score += 20
+    else:
+        score += 10
+    
+    # Power capacity (higher is better)
+    max_power = station.max_power_kw
+    if max_power >= 100:
+        score += 40
+    elif max_power >= 50:
+        score += 30
+    elif max_power >= 22:
+        score += 20
+    else:
+        score += 10
+    
+    # Number of connections (more is better)
+    conn_count = len(station.connections)
+    score += min(conn_count * 5, 25)
+    
+    # Recent verification (more recent is better)
+    if station.last_verified:
+        score += 15
+    
+    return score
+
+
+def _trip_with_stations(trip, stations):
+    """The cached corridor: a _trip_route plus its stations, best first."""
+    # Sort by score (highest first) and then by distance
+    def sort_key(station):
+        return (-station.score, station.distance_from_route)
+    
+    stations_list = sorted(stations, key=sort_key)
+
+    return {**trip, "stations": stations_list}
+
+def _trip_corridor(from_city, to_city, local, deadline=None):
+    """
+    The part of a trip plan that depends only on the two cities: places,
+    route, stations. Raises _Degraded when some station lookups are missing.
+    """
+    return _trip_corridor_along(_trip_route(from_city, to_city, deadline), local, deadline)
+
+def _trip_corridor_along(trip, local, deadline=None, tiles=False):
+    # _trip_corridor from the _trip_route on
+    missed = []
+    with metrics.stage("stations"):
+        stations = [st for batch in _trip_station_batches(trip, local, deadline, missed, tiles) for st in batch]
+    return _trip_corridor_checked(_trip_with_stations(trip, stations), missed, len(_trip_points(trip)))
+
+def _trip_corridor_checked(corridor, missed, lookups):
+    if missed:
+        raise _Degraded(corridor, [_stations_missed(missed, lookups)])
+    return corridor
+
+def _stations_missed(missed, lookups):
+    return f"{len(missed)} of {lookups} station lookups failed or ran out of time; planned with the stations found"
+
+def _trip_summary(trip):
+    duration_minutes = trip["duration"] / 60
+    return {
+        "source": trip["source"],
+        "destination": trip["destination"],
+        "distance_km": round(trip["distance"] / 1000, 1),
+        "duration_minutes": round(duration_minutes),
+        "duration_hours": round(duration_minutes / 60, 1)
+    }
+
+def _plan_trip_stream(fmt, cache_key, from_city, to_city, local, vehicle_range, current_battery, geometry=None,
+                      deadline=None):
+    """
+    plan_trip as events: the route as soon as it is known, station batches as
+    the lookups return, then the full plan (without the route coordinates,
+    which were already sent). A plan missing station lookups is flagged
+    degraded and not cached, as in plan_trip.
+    """
+    corridor = caching.peek("trip_corridor", cache_key)
+    missed = []
+    if corridor is None:
+        # geocoding/route errors still get a proper status: nothing has been sent yet
+        trip = _trip_route(from_city, to_city, deadline)
+        batches = _trip_station_batches(trip, local, deadline, missed)
+    else:
+        trip, batches = corridor, [corridor["stations"]]
+
+    def events():
+        yield _shaped({"type": "route", "trip_summary": _trip_summary(trip), "coordinates": trip["coordinates"]},
+                      geometry)
+        stations = []
+        for batch in batches:
+            stations.extend(batch)
+            yield {"type": "stations", "stations": [_trip_station(ts) for ts in batch]}
+        full = corridor
+        if full is None:
+            full = _trip_with_stations(trip, stations)
+            if not missed:
+                caching.put("trip_corridor", cache_key, full)
+        result = _plan_trip_result(full, vehicle_range, current_battery)
+        if missed:
+            _mark_degraded(result, [_stations_missed(missed, len(_trip_points(trip)))])
+        for route in result["routes"]:
+            route.pop("coordinates", None)
+        yield {"type": "plan", **result}
+    return streaming.events_response(fmt, events())
+
+
+def _plan_trip_result(corridor, vehicle_range, current_battery):
+    """Vehicle-specific part of the trip plan: costs, charging stops and the response body."""
+    coords = corridor["coordinates"]
+    samples, sample_kms = corridor["samples"], corridor["sample_kms"]
+    stations_list = corridor["stations"]
+    
+    distance_km = corridor["distance"] / 1000  # Convert meters to km
+    duration_seconds = corridor["duration"]
+    duration_minutes = duration_seconds / 60
+    duration_hours = duration_minutes / 60
+    
+    # OSRM's road distance and our polyline length differ slightly; map one onto the other
+    km_scale = (sample_kms[-1] / distance_km) if sample_kms and distance_km else 1.0
+    
+    # 3. Calculate costs
+    petrol_liters = distance_km / PETROL_KMPL
+    diesel_liters = distance_km / DIESEL_KMPL
+    
+    petrol_cost = petrol_liters * PETROL_PRICE_PER_LITER
+    diesel_cost = diesel_liters * DIESEL_PRICE_PER_LITER
+    ev_cost = distance_km * EV_COST_PER_KM
+    
+    # 4. Calculate charging requirements
+    current_range = (current_battery / 100) * vehicle_range
+    charging_stops = []
+    charging_stops_count = 0
+    total_charging_time = 0
+    charging_cost = 0
+    
+    # Fastest plan through real stations along the route (drive + detour + charge time)
+    plan = optimizer.plan_stops(
+        [(ts.station, ts.km_along / km_scale, ts.distance_from_route)
+         for ts in stations_list if ts.km_along is not None],
+        distance_km, duration_seconds, vehicle_range, EV_BATTERY_CAPACITY, current_battery / 100,
+        vehicle_max_kw=EV_MAX_CHARGE_KW)
+    
+    if plan is not None:
+        for i, stop in enumerate(plan["stops"]):
+            st = stop["station"]
+            charging_stops.append({
+                "stop_number": i + 1,
+                "distance_from_start": round(stop["km_along"], 1),
+                "remaining_distance": round(distance_km - stop["km_along"], 1),
+                "estimated_charge_time": f"{round(stop['charge_minutes'])} minutes",
+                "charge_cost_estimate": f"₹{round(stop['energy_kwh'] * CHARGING_COST_PER_KWH)}",
+                "battery_before": f"{round(stop['arrive_soc'] * 100)}%",
+                "battery_after": f"{round(stop['leave_soc'] * 100)}%",
+                "location": {"lat": st.lat, "lon": st.lon},
+                "detour_km": round(2 * stop["detour_km"], 1),  # there and back
+                "station": {
+                    "id": st.id,
+                    "name": st.name,
+                    "address": st.address,
+                    "town": st.town,
+                    "operator": st.operator,
+                    "power_kw": round(stop["power_kw"], 1),
+                },
+            })
+        charging_stops_count = len(charging_stops)
+        total_charging_time = round(plan["charge_minutes"])
+        charging_cost = round(sum(s["energy_kwh"] for s in plan["stops"]) * CHARGING_COST_PER_KWH)
+    elif distance_km > current_range:
+        # no feasible plan with the stations we know of: fall back to evenly spaced estimates
+        remaining_distance = distance_km - current_range
+        stops_needed = math.ceil(remaining_distance / (vehicle_range * 0.6))  # Charge to 80% each time
+        charging_stops_count = stops_needed
         
-                # 7. Build comprehensive response
-        # Debug: Check stations data
-        print(f"Debug: Processing {len(stations_list)} stations")
-        for i, station in enumerate(stations_list[:3]):
-            print(f"Station {i}: {station.get('name', 'Unknown')} - distance: {station.get('distance_from_route')} - score: {station.get('score')}")
+        for i in range(stops_needed):
+            stop_distance = current_range + (i * vehicle_range * 0.6)
+            if stop_distance < distance_km:
+                loc = geo.point_at_km(samples, sample_kms, stop_distance * km_scale)
+                charging_stops.append({
+                    "stop_number": i + 1,
+                    "distance_from_start": round(stop_distance, 1),
+                    "remaining_distance": round(distance_km - stop_distance, 1),
+                    "estimated_charge_time": f"{FAST_CHARGING_TIME_MINUTES} minutes",
+                    "charge_cost_estimate": f"₹{round(EV_BATTERY_CAPACITY * 0.6 * CHARGING_COST_PER_KWH)}-{round(EV_BATTERY_CAPACITY * 0.8 * CHARGING_COST_PER_KWH)}",
+                    "battery_before": "20%",
+                    "battery_after": "80%",
+                    "location": {"lat": round(loc[0], 5), "lon": round(loc[1], 5)} if loc else None
+                })
         
-        result = {
-            "success": True,
-            "trip_summary": {
-                "source": source,
-                "destination": destination,
-                "distance_km": round(distance_km, 1),
-                "duration_minutes": round(duration_minutes),
-                "duration_hours": round(duration_hours, 1)
-            },
-            "routes": [{
-                "route_id": 1,
-                "name": "Optimal Route",
-                "coordinates": coords,  # [lon, lat] pairs for map
-                "distance_km": round(distance_km, 1),
-                "duration_minutes": round(duration_minutes),
-                "duration_hours": round(duration_hours, 1),
-                "costs": {
-                    "ev_cost": round(ev_cost, 2),
-                    "petrol_cost": round(petrol_cost, 2),
-                    "diesel_cost": round(diesel_cost, 2),
-                    "petrol_savings": round(petrol_cost - ev_cost, 2),
-                    "diesel_savings": round(diesel_cost - ev_cost, 2)
-                },
-                "charging_stops": charging_stops,
-                "charging_stops_count": charging_stops_count,
-                "total_charging_time": f"{total_charging_time} minutes",
-                "fuel_efficiency": {
-                    "petrol_liters_needed": round(petrol_liters, 2),
-                    "diesel_liters_needed": round(diesel_liters, 2),
-                    "ev_kwh_needed": round((distance_km / vehicle_range) * EV_BATTERY_CAPACITY, 2)
-                }
-            }],
-            "charging_stations": stations_list[:30],  # Top 30 stations with real data
-            "charging_stations_summary": {
-                "total_found": len(stations_list),
-                "operational_count": len([s for s in stations_list if "operational" in (s.get("status") or "").lower()]),
-                "fast_charging_count": len([s for s in stations_list if any((c.get("power_kw", 0) or 0) >= 50 for c in s.get("connections", []))]),
-                "average_distance_from_route": round(sum(s.get("distance_from_route", 0) for s in stations_list[:10] if s.get("distance_from_route") is not None) / max(len([s for s in stations_list[:10] if s.get("distance_from_route") is not None]), 1), 1),
-                "data_source": "OpenChargeMap API (Real-time)",
-                "last_updated": "Live data"
-            },
-            "cost_comparison": {
-                "distance_km": round(distance_km, 1),
+        total_charging_time = charging_stops_count * FAST_CHARGING_TIME_MINUTES
+        charging_cost = round(charging_stops_count * EV_BATTERY_CAPACITY * 0.6 * CHARGING_COST_PER_KWH)
+    
+    # 6. Environmental impact calculation
+    co2_per_km_petrol = 2.3  # kg CO2 per km for petrol car
+    co2_per_km_ev = 0.5  # kg CO2 per km for EV (considering electricity grid mix)
+    co2_saved = (co2_per_km_petrol - co2_per_km_ev) * distance_km
+    trees_equivalent = co2_saved / 22  # 1 tree absorbs ~22kg CO2 per year
+    
+    # 7. Build comprehensive response
+    result = {
+        "success": True,
+        "trip_summary": _trip_summary(corridor),
+        "routes": [{
+            "route_id": 1,
+            "name": "Optimal Route",
+            "coordinates": coords,  # [lon, lat] pairs for map
+            "distance_km": round(distance_km, 1),
+            "duration_minutes": round(duration_minutes),
+            "duration_hours": round(duration_hours, 1),
+            "costs": {
                 "ev_cost": round(ev_cost, 2),
                 "petrol_cost": round(petrol_cost, 2),
                 "diesel_cost": round(diesel_cost, 2),
-                "savings_vs_petrol": round(petrol_cost - ev_cost, 2),
-                "savings_vs_diesel": round(diesel_cost - ev_cost, 2),
-                "fuel_prices": {
-                    "petrol_per_liter": PETROL_PRICE_PER_LITER,
-                    "diesel_per_liter": DIESEL_PRICE_PER_LITER,
-                    "ev_per_km": EV_COST_PER_KM
-                }
-            },
-            "environmental_impact": {
-                "co2_saved_kg": round(co2_saved, 1),
-                "equivalent_trees": round(trees_equivalent, 1)
+                "petrol_savings": round(petrol_cost - ev_cost, 2),
+                "diesel_savings": round(diesel_cost - ev_cost, 2)
             },
-            "charging_analysis": {
-                "vehicle_range": vehicle_range,
-                "current_battery": current_battery,
-                "current_range": round(current_range, 1),
-                "charging_required": distance_km > current_range,
-                "total_stops_needed": charging_stops_count,
-                "total_charging_time_minutes": total_charging_time,
-                "charging_cost_estimate": round(charging_stops_count * EV_BATTERY_CAPACITY * 0.6 * CHARGING_COST_PER_KWH) if charging_stops_count > 0 else 0
+            "charging_stops": charging_stops,
+            "charging_stops_count": charging_stops_count,
+            "charging_plan": "optimized" if plan is not None else "estimated",
+            "total_trip_minutes": round(plan["total_minutes"]) if plan is not None else None,
+            "total_charging_time": f"{total_charging_time} minutes",
+            "fuel_efficiency": {
+                "petrol_liters_needed": round(petrol_liters, 2),
+                "diesel_liters_needed": round(diesel_liters, 2),
+                "ev_kwh_needed": round((distance_km / vehicle_range) * EV_BATTERY_CAPACITY, 2)
             }
+        }],
+        "charging_stations": [_trip_station(ts) for ts in stations_list[:30]],  # Top 30 stations with real data
+        "charging_stations_summary": {
+            "total_found": len(stations_list),
+            "operational_count": len([s for s in stations_list if "operational" in (s.station.status or "").lower()]),
+            "fast_charging_count": len([s for s in stations_list if s.station.max_power_kw >= 50]),
+            "average_distance_from_route": round(sum(s.distance_from_route for s in stations_list[:10]) / max(len(stations_list[:10]), 1), 1),
+            "data_source": "OpenChargeMap API (Real-time)",
+            "last_updated": "Live data"
+        },
+        "cost_comparison": {
+            "distance_km": round(distance_km, 1),
+            "ev_cost": round(ev_cost, 2),
+            "petrol_cost": round(petrol_cost, 2),
+            "diesel_cost": round(diesel_cost, 2),
+            "savings_vs_petrol": round(petrol_cost - ev_cost, 2),
+            "savings_vs_diesel": round(diesel_cost - ev_cost, 2),
+            "fuel_prices": {
+                "petrol_per_liter": PETROL_PRICE_PER_LITER,
+                "diesel_per_liter": DIESEL_PRICE_PER_LITER,
+                "ev_per_km": EV_COST_PER_KM
+            }
+        },
+        "environmental_impact": {
+            "co2_saved_kg": round(co2_saved, 1),
+            "equivalent_trees": round(trees_equivalent, 1)
+        },
+        "charging_analysis": {
+            "vehicle_range": vehicle_range,
+            "current_battery": current_battery,
+            "current_range": round(current_range, 1),
+            "charging_required": distance_km > current_range or charging_stops_count > 0,
+            "total_stops_needed": charging_stops_count,
+            "total_charging_time_minutes": total_charging_time,
+            "charging_cost_estimate": charging_cost
         }
-        
-        # Cache for 30 minutes
-        cache.set(cache_key, result, timeout=1800)
-        return JsonResponse(result, safe=False)
-        
-    except Exception as e:
-        return JsonResponse({"error": "Trip planning failed", "detail": str(e)}, status=500)
+    }
+    
+    return result
 
 
 @csrf_exempt
-def chatbot(request):
+@require_POST
+def plan_trips_batch(request):
     """
-    EV-focused chatbot using Gemini AI API
-    POST params:
-      message: user's question
-      conversation_history: list of previous messages (optional)
-    Returns:
-      { response: str, conversation_id: str }
+    plan_trip for many trips at once (fleets).
+    POST body:
+      {"trips": [{"from": "Mumbai", "to": "Pune", "vehicle_range": 250, "current_battery": 60,
+                  "id": "optional, echoed back"}, ...]}
+    Query params: source, and zoom, tolerance_km, precision, geometry as for plan_trip.
+    Returns NDJSON (or server-sent events with ?stream=sse / Accept: text/event-stream):
+      {"type": "trip", "index": i, "id": ..., "status": 200, ...plan_trip's response...}
+      per trip as soon as its plan is ready, failed trips with their error status
+      and body instead, and finally {"type": "done", "trips", "planned", "failed",
+      "corridors"}.
+
+    Trips with the same city pair share one corridor (geocoding, route and
+    stations); only the vehicle arithmetic runs per trip. Each city is
+    geocoded once, and the corridors are computed PLAN_TRIPS_BATCH_WORKERS at
+    a time, each with its own PLAN_TRIP_DEADLINE. Their stations come from
+    the ev_stations tile cache, so corridors that overlap share the OCM
+    calls for the common stretch.
     """
-    if request.method == 'POST':
+    try:
+        data = json.loads(request.body)
+        trips = data.get("trips") if isinstance(data, dict) else None
+        if not isinstance(trips, list) or not trips:
+            raise _ViewError({"error": "trips must be a non-empty list"}, 400)
+        if len(trips) > PLAN_TRIPS_BATCH_MAX:
+            raise _ViewError({"error": f"at most {PLAN_TRIPS_BATCH_MAX} trips per batch"}, 400)
+        local = _use_local_stations(request)
+        geometry = _geometry_options(request)
+    except _ViewError as e:
+        return JsonResponse(e.payload, status=e.status)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON in request body"}, status=400)
+    fmt = "sse" if streaming.requested_format(request) == "sse" else "ndjson"
+    return streaming.events_response(fmt, _plan_trips_events(trips, local, geometry))
+
+def _batch_trip(item):
+    """(from_city, to_city, vehicle_range, current_battery) of one batch entry. Raises _ViewError."""
+    if not isinstance(item, dict):
+        raise _ViewError({"error": "each trip must be an object"}, 400)
+    from_city = str(item.get("from") or "").strip()
+    to_city = str(item.get("to") or "").strip()
+    if not from_city or not to_city:
+        raise _ViewError({"error": "from and to parameters required"}, 400)
+    try:
+        vehicle_range = float(item.get("vehicle_range", EV_RANGE_KM))
+        current_battery = float(item.get("current_battery", 80))
+    except (TypeError, ValueError):
+        raise _ViewError({"error": "vehicle_range and current_battery must be numbers"}, 400)
+    return from_city, to_city, vehicle_range, current_battery
+
+def _batch_event(index, trip_id, status, body):
+    event = {"type": "trip", "index": index}
+    if trip_id is not None:
+        event["id"] = trip_id
+    return {**event, "status": status, **body}
+
+def _batch_failed(members, e):
+    if isinstance(e, _ViewError):
+        status, body = e.status, e.payload
+    elif isinstance(e, upstream.DeadlineExceeded):
+        status, body = 504, _trip_timed_out(e)
+    else:
+        status, body = 500, {"error": "Trip planning failed", "detail": str(e)}
+    for index, trip_id, _, _ in members:
+        yield _batch_event(index, trip_id, status, body)
+
+def _batch_planned(members, corridor, degraded, geometry):
+    for index, trip_id, vehicle_range, current_battery in members:
+        with metrics.stage("plan"):
+            result = _shaped_trip(_plan_trip_result(corridor, vehicle_range, current_battery), geometry)
+        if degraded:
+            _mark_degraded(result, degraded)
+        yield _batch_event(index, trip_id, 200, result)
+
+def _batch_place(city):
+    # (place or None, error) for one distinct city of the batch
+    try:
+        return geocode.lookup(city, upstream.Deadline(PLAN_TRIP_DEADLINE)), None
+    except Exception as e:
+        return None, e
+    finally:
+        connections.close_all()  # this worker thread's, from the geocode cache
+
+def _batch_corridor(key, source, destination, local):
+    # (corridor, degraded reasons) for one distinct city pair, cached like plan_trip's;
+    # stations come from the tile cache, so overlapping corridors share their OCM calls
+    deadline = upstream.Deadline(PLAN_TRIP_DEADLINE)
+    try:
+        return caching.get_or_compute("trip_corridor", key, lambda: _trip_corridor_along(
+            _trip_between(source, destination, deadline), local, deadline, tiles=True),
+            wait=deadline.remaining(), refresh=lambda: _batch_corridor_refresh(source, destination, local)), None
+    except _Degraded as e:
+        return e.value, e.reasons
+    finally:
+        connections.close_all()
+
+def _batch_corridor_refresh(source, destination, local):
+    deadline = upstream.Deadline(PLAN_TRIP_DEADLINE)
+    return _trip_corridor_along(_trip_between(source, destination, deadline), local, deadline, tiles=True)
+
+def _plan_trips_events(trips, local, geometry):
+    planned = failed = 0
+    corridors = {}
+    for event in _plan_trips(trips, local, geometry, corridors):
+        if event["status"] == 200:
+            planned += 1
+        else:
+            failed += 1
+        yield event
+    yield {"type": "done", "trips": len(trips), "planned": planned, "failed": failed, "corridors": len(corridors)}
+
+def _plan_trips(trips, local, geometry, corridors):
+    # trip events, cached corridors first, then each corridor's trips as it completes;
+    # `corridors` collects {corridor key: (from_city, to_city, members)}
+    for index, item in enumerate(trips):
+        trip_id = item.get("id") if isinstance(item, dict) else None
         try:
-            data = json.loads(request.body)
-            user_message = data.get('message', '').strip()
-            conversation_history = data.get('conversation_history', [])
-            
-            if not user_message:
-                return JsonResponse({"error": "Message is required"}, status=400)
-            
-            # Get Gemini API key from settings
-            gemini_api_key = getattr(settings, 'GEMINI_API_KEY', None)
-            if not gemini_api_key:
-                return JsonResponse({"error": "Gemini API key not configured"}, status=500)
-            
-            # Build conversation context for EV-focused responses
-            system_prompt = """You are an expert EV (Electric Vehicle) assistant for EV-PATH, a comprehensive EV navigation and planning platform. 
+            from_city, to_city, vehicle_range, current_battery = _batch_trip(item)
+        except _ViewError as e:
+            yield _batch_event(index, trip_id, e.status, e.payload)
+            continue
+        key = _trip_corridor_key(from_city, to_city, local)
+        prefetch.track("trip_corridor", key, (from_city, to_city, local))
+        corridors.setdefault(key, (from_city, to_city, []))[2].append(
+            (index, trip_id, vehicle_range, current_battery))
+
+    todo = {}
+    for key, (from_city, to_city, members) in corridors.items():
+        corridor = caching.peek("trip_corridor", key)
+        if corridor is None:
+            todo[key] = (from_city, to_city, members)
+        else:
+            yield from _batch_planned(members, corridor, None, geometry)
+    if not todo:
+        return
+
+    pool = ThreadPoolExecutor(max_workers=PLAN_TRIPS_BATCH_WORKERS)
+    try:
+        cities = {geocode.normalize(city): city for from_city, to_city, _ in todo.values() for city in (from_city, to_city)}
+        with metrics.stage("geocode"):
+            places = dict(zip(cities, pool.map(metrics.bind(_batch_place), cities.values())))
+        jobs = {}
+        for key, (from_city, to_city, members) in todo.items():
+            (source, source_error), (destination, destination_error) = (
+                places[geocode.normalize(from_city)], places[geocode.normalize(to_city)])
+            if source_error or destination_error:
+                yield from _batch_failed(members, source_error or destination_error)
+                continue
+            jobs[pool.submit(metrics.bind(_batch_corridor), key, source, destination, local)] = members
+        for job in as_completed(jobs):
+            try:
+                corridor, degraded = job.result()
+            except Exception as e:
+                yield from _batch_failed(jobs[job], e)
+                continue
+            yield from _batch_planned(jobs[job], corridor, degraded, geometry)
+    finally:
+        # a client that hangs up mid-stream leaves the rest of the batch unplanned
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _chatbot_request(data):
+    """
+    (user_message, conversation_history, api_key, payload) for a chatbot
+    request body. Raises _ViewError.
+    """
+    user_message = data.get('message', '').strip()
+    conversation_history = data.get('conversation_history', [])
+    
+    if not user_message:
+        raise _ViewError({"error": "Message is required"}, 400)
+    
+    # Get Gemini API key from settings
+    gemini_api_key = getattr(settings, 'GEMINI_API_KEY', None)
+    if not gemini_api_key:
+        raise _ViewError({"error": "Gemini API key not configured"}, 500)
+    
+    system_prompt = """You are an expert EV (Electric Vehicle) assistant for EV-PATH, a comprehensive EV navigation and planning platform. 
 
 Your expertise includes:
 - Electric vehicle technology, specifications, and performance
@@ -965,104 +1543,126 @@ Guidelines:
 
 Current platform features: EV station finder, trip planning, cost comparison, route optimization with charging stops."""
 
-            # Build the conversation for Gemini
-            messages = [{"role": "user", "parts": [{"text": system_prompt}]}]
-            
-            # Add conversation history if provided
-            for msg in conversation_history[-5:]:  # Keep last 5 messages for context
-                if msg.get('role') and msg.get('content'):
-                    messages.append({
-                        "role": msg['role'],
-                        "parts": [{"text": msg['content']}]
-                    })
-            
-            # Add current user message
-            messages.append({"role": "user", "parts": [{"text": user_message}]})
-            
-            # Call Gemini API
-            gemini_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
-            headers = {
-                "Content-Type": "application/json",
-            }
-            
-            payload = {
-                "contents": messages,
-                "generationConfig": {
-                    "temperature": 0.7,
-                    "topK": 40,
-                    "topP": 0.95,
-                    "maxOutputTokens": 1024,
-                },
-                "safetySettings": [
-                    {
-                        "category": "HARM_CATEGORY_HARASSMENT",
-                        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                    },
-                    {
-                        "category": "HARM_CATEGORY_HATE_SPEECH",
-                        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                    },
-                    {
-                        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                    },
-                    {
-                        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                    }
-                ]
+    # Build the conversation for Gemini
+    messages = [{"role": "user", "parts": [{"text": system_prompt}]}]
+    
+    # Add conversation history if provided
+    for msg in conversation_history[-5:]:  # Keep last 5 messages for context
+        if msg.get('role') and msg.get('content'):
+            messages.append({
+                "role": msg['role'],
+                "parts": [{"text": msg['content']}]
+            })
+    
+    # Add current user message
+    messages.append({"role": "user", "parts": [{"text": user_message}]})
+    
+    payload = {
+        "contents": messages,
+        "generationConfig": {
+            "temperature": 0.7,
+            "topK": 40,
+            "topP": 0.95,
+            "maxOutputTokens": 1024,
+        },
+        "safetySettings": [
+            {
+                "category": "HARM_CATEGORY_HARASSMENT",
+                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+            },
+            {
+                "category": "HARM_CATEGORY_HATE_SPEECH",
+                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+            },
+            {
+                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+            },
+            {
+                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
             }
+        ]
+    }
+    
+    return user_message, conversation_history, gemini_api_key, payload
+
+def _chatbot_reply(response, user_message, conversation_history):
+    """The chatbot response for Gemini's `response`."""
+    if response.status_code != 200:
+        # Check if it's a rate limit error
+        if response.status_code == 429:
+            # Provide intelligent fallback responses for common EV questions
+            fallback_response = get_ev_fallback_response(user_message)
             
-            response = requests.post(
-                f"{gemini_url}?key={gemini_api_key}",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                # Check if it's a rate limit error
-                if response.status_code == 429:
-                    # Provide intelligent fallback responses for common EV questions
-                    fallback_response = get_ev_fallback_response(user_message)
-                    
-                    return JsonResponse({
-                        "response": fallback_response,
-                        "conversation_id": hashlib.md5(f"{user_message}:{len(conversation_history)}".encode()).hexdigest()[:12],
-                        "timestamp": json.dumps(datetime.datetime.now().isoformat()),
-                        "rate_limited": True
-                    })
-                else:
-                    return JsonResponse({
-                        "error": "Failed to get response from Gemini API",
-                        "detail": response.text
-                    }, status=500)
-            
-            gemini_data = response.json()
-            
-            # Extract the response text
-            if 'candidates' in gemini_data and len(gemini_data['candidates']) > 0:
-                candidate = gemini_data['candidates'][0]
-                if 'content' in candidate and 'parts' in candidate['content']:
-                    parts = candidate['content']['parts']
-                    if len(parts) > 0 and 'text' in parts[0]:
-                        ai_response = parts[0]['text'].strip()
-                    else:
-                        ai_response = "I'm sorry, I couldn't generate a proper response. Please try again."
-                else:
-                    ai_response = "I'm sorry, I couldn't generate a proper response. Please try again."
+            return JsonResponse({
+                "response": fallback_response,
+                "conversation_id": hashlib.md5(f"{user_message}:{len(conversation_history)}".encode()).hexdigest()[:12],
+                "timestamp": json.dumps(datetime.datetime.now().isoformat()),
+                "rate_limited": True
+            })
+        else:
+            return JsonResponse({
+                "error": "Failed to get response from Gemini API",
+                "detail": response.text
+            }, status=500)
+    
+    gemini_data = jsoncodec.loads(response.content)
+    
+    # Extract the response text
+    if 'candidates' in gemini_data and len(gemini_data['candidates']) > 0:
+        candidate = gemini_data['candidates'][0]
+        if 'content' in candidate and 'parts' in candidate['content']:
+            parts = candidate['content']['parts']
+            if len(parts) > 0 and 'text' in parts[0]:
+                ai_response = parts[0]['text'].strip()
             else:
                 ai_response = "I'm sorry, I couldn't generate a proper response. Please try again."
+        else:
+            ai_response = "I'm sorry, I couldn't generate a proper response. Please try again."
+    else:
+        ai_response = "I'm sorry, I couldn't generate a proper response. Please try again."
+    
+    # Generate conversation ID for tracking
+    conversation_id = hashlib.md5(f"{user_message}:{len(conversation_history)}".encode()).hexdigest()[:12]
+    
+    return JsonResponse({
+        "response": ai_response,
+        "conversation_id": conversation_id,
+        "timestamp": json.dumps(datetime.datetime.now().isoformat())
+    })
+
+def _chatbot_post(gemini_api_key, payload):
+    # upstream.post / apost keyword arguments for a Gemini call
+    return dict(
+        params={"key": gemini_api_key},
+        headers={"Content-Type": "application/json"},
+        json=payload,
+        timeout=30
+    )
+
+
+@csrf_exempt
+def chatbot(request):
+    """
+    EV-focused chatbot using Gemini AI API
+    POST params:
+      message: user's question
+      conversation_history: list of previous messages (optional)
+    Returns:
+      { response: str, conversation_id: str }
+    """
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            user_message, conversation_history, gemini_api_key, payload = _chatbot_request(data)
             
-            # Generate conversation ID for tracking
-            conversation_id = hashlib.md5(f"{user_message}:{len(conversation_history)}".encode()).hexdigest()[:12]
-            
-            return JsonResponse({
-                "response": ai_response,
-                "conversation_id": conversation_id,
-                "timestamp": json.dumps(datetime.datetime.now().isoformat())
-            })
+            # Call Gemini API
+            response = upstream.post("gemini", GEMINI_PATH, **_chatbot_post(gemini_api_key, payload))
+            return _chatbot_reply(response, user_message, conversation_history)
             
+        except _ViewError as e:
+            return JsonResponse(e.payload, status=e.status)
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON in request body"}, status=400)
         except Exception as e: